@@ -0,0 +1,301 @@
+# ai_dispatch.py
+"""
+Concurrent fan-out of AI personality replies.
+
+handle_chat_message used to call each personality's generate_response one
+after another, so the last reply in a busy room waited for the *sum* of every
+model's latency. Instead each reply (claimed from the job queue, see
+job_queue.py) is handed to a small bounded pool of
+background tasks (threads under async_mode='threading', greenlets under the
+gevent worker) so the slowest model sets the pace, not the total.
+
+Two caps keep this from running away:
+    AI_MAX_CONCURRENCY   (env, default 8) - replies running across all rooms
+    AI_ROOM_CONCURRENCY  (env, default 4) - replies running inside one room
+
+Anything over a cap waits in a per-room backlog and is started, round-robin
+across rooms, as soon as a slot frees up.
+
+Plugins may also stream: if generate_response returns a generator of text
+chunks instead of a string, the chunks are relayed to the room as
+chat_message_start / chat_message_delta / chat_message_end events and the
+final text is written to ChatHistory once, at the end.
+"""
+import functools
+import inspect
+import os
+import threading
+import time
+import uuid
+from collections import deque
+
+from flask import current_app
+
+from extensions import socketio, plugin_module as load_plugin
+from models import ChatHistory
+import context_builder
+import history_cache
+import metrics
+import rate_limiter
+import summary_memory
+import tracing
+
+log = tracing.get_logger(__name__)
+
+MAX_CONCURRENT_REPLIES = int(os.environ.get('AI_MAX_CONCURRENCY', '8'))
+MAX_ROOM_REPLIES = int(os.environ.get('AI_ROOM_CONCURRENCY', '4'))
+
+_lock = threading.Lock()
+_running = 0
+_room_running = {}   # chat_uuid -> number of replies currently running
+_room_backlog = {}   # chat_uuid -> deque of callables waiting for a slot
+_room_order = deque()  # rooms with a non-empty backlog, for round-robin
+
+
+def submit(chat_uuid, task, priority=rate_limiter.PRIORITY_NORMAL):
+    """
+    Queue 'task' (a no-argument callable) to run in the background for the
+    given room, respecting both the global and the per-room caps. Tasks
+    for a personality addressed by name jump the room's backlog.
+    """
+    with _lock:
+        backlog = _room_backlog.get(chat_uuid)
+        if backlog is None:
+            backlog = _room_backlog[chat_uuid] = deque()
+        if not backlog:
+            _room_order.append(chat_uuid)
+        if priority < rate_limiter.PRIORITY_NORMAL:
+            backlog.appendleft(task)
+        else:
+            backlog.append(task)
+    _drain()
+
+
+def pending_count():
+    """Number of replies waiting for a slot (all rooms)."""
+    with _lock:
+        return sum(len(b) for b in _room_backlog.values())
+
+
+def running_count():
+    """Number of replies currently running (all rooms)."""
+    return _running
+
+
+def free_slots():
+    """How many more replies could start right now without exceeding the global cap."""
+    with _lock:
+        return MAX_CONCURRENT_REPLIES - _running - sum(len(b) for b in _room_backlog.values())
+
+
+def busy_rooms():
+    """Rooms that already have a full per-room cap of running + waiting replies."""
+    with _lock:
+        return {
+            room for room in set(_room_running) | set(_room_backlog)
+            if _room_running.get(room, 0) + len(_room_backlog.get(room, ())) >= MAX_ROOM_REPLIES
+        }
+
+
+def _drain():
+    """Start as many backlogged tasks as the caps allow."""
+    global _running
+    to_start = []
+    with _lock:
+        skipped = 0
+        # Walk the rooms round-robin; stop once every room with a backlog
+        # is either empty or at its own cap.
+        while _room_order and _running < MAX_CONCURRENT_REPLIES and skipped < len(_room_order):
+            chat_uuid = _room_order.popleft()
+            backlog = _room_backlog[chat_uuid]
+            if _room_running.get(chat_uuid, 0) >= MAX_ROOM_REPLIES:
+                _room_order.append(chat_uuid)
+                skipped += 1
+                continue
+            skipped = 0
+            task = backlog.popleft()
+            _running += 1
+            _room_running[chat_uuid] = _room_running.get(chat_uuid, 0) + 1
+            if backlog:
+                _room_order.append(chat_uuid)
+            else:
+                del _room_backlog[chat_uuid]
+            to_start.append((chat_uuid, task))
+
+    for chat_uuid, task in to_start:
+        socketio.start_background_task(_run, chat_uuid, task)
+
+
+def _run(chat_uuid, task):
+    global _running
+    try:
+        task()
+    except Exception as e:
+        log.error("AI reply task failed", room=chat_uuid, error=str(e), exc_info=True)
+    finally:
+        with _lock:
+            _running -= 1
+            remaining = _room_running.get(chat_uuid, 1) - 1
+            if remaining:
+                _room_running[chat_uuid] = remaining
+            else:
+                _room_running.pop(chat_uuid, None)
+        _drain()
+
+
+def generate_and_post(personality_name, chat_uuid, numeric_chat_id, chat_title, participants, history, message,
+                      priority=rate_limiter.PRIORITY_NORMAL, **extra):
+    """
+    Run one personality's plugin and, if it had something to say, store the
+    reply and broadcast it to the room. Must be called inside an app context.
+
+    The call waits its turn at the model's rate limiter ('priority' orders
+    the waiters). 'extra' holds optional context (e.g. summary=...) that is
+    only passed to plugins whose generate_response accepts that keyword.
+    """
+    personality = current_app.loaded_personalities[personality_name]
+    plugin_module = load_plugin(personality)
+    limiter = rate_limiter.limiter_for(personality)
+
+    waited = limiter.acquire(priority)
+    log.debug("Generating reply", personality=personality_name, history=len(history),
+              waited=round(waited, 3), model=limiter.model)
+
+    started = time.monotonic()
+    latency = None
+    ai_response = None
+    built = None
+    context_builder.last_build_stats()  # Don't pick up an earlier call's stats
+    try:
+        ai_response = plugin_module.generate_response(
+            chat_title,
+            participants,
+            history,
+            message,
+            **_accepted_kwargs(plugin_module.generate_response, extra)
+        )
+        # Time to the full reply, or to the start of a stream
+        latency = time.monotonic() - started
+        built = context_builder.last_build_stats()
+
+        # Plugins may return either the whole reply as a string, or a
+        # generator of text chunks which we relay to the room as they arrive.
+        stream_id = None
+        if not isinstance(ai_response, str):
+            stream_id, ai_response = _relay_stream(chat_uuid, personality_name, ai_response)
+    finally:
+        # Plugin call including prompt build and any streamed reply
+        elapsed = time.monotonic() - started
+        tracing.record_span('provider_call', elapsed, personality=personality_name)
+        metrics.inc('ai_requests_total', personality=personality_name)
+        metrics.observe('ai_request_seconds', elapsed, personality=personality_name)
+        if not isinstance(ai_response, str) or _is_error_reply(ai_response):
+            metrics.inc('ai_errors_total', personality=personality_name)
+        limiter.release(latency if latency is not None else elapsed,
+                        throttled=rate_limiter.is_throttled(ai_response),
+                        prompt_tokens=built['prompt_tokens'] if built else 0)
+
+    if not _is_worth_posting(ai_response):
+        if stream_id:
+            _discard_stream(chat_uuid, personality_name, stream_id)
+        return
+
+    try:
+        new_ai_msg = history_cache.commit_message(ChatHistory(
+            chat_id=numeric_chat_id,
+            sender_id=-1,
+            sender_name=personality_name,
+            message=ai_response
+        ))
+    except Exception:
+        if stream_id:
+            _discard_stream(chat_uuid, personality_name, stream_id)
+        raise
+    summary_memory.note_new_message(current_app._get_current_object(), numeric_chat_id)
+
+    payload = {
+        'room_message_id': new_ai_msg.room_message_id,
+        'username': personality_name,
+        'message': ai_response,
+        'db_id': new_ai_msg.id
+    }
+    with tracing.span('emit'):
+        if stream_id:
+            payload['stream_id'] = stream_id
+            socketio.emit('chat_message_end', payload, room=chat_uuid)
+        else:
+            socketio.emit('chat_message', payload, room=chat_uuid)
+
+
+def accepts(plugin_module, name):
+    """True if the plugin's generate_response takes the optional keyword 'name'."""
+    return name in _signature_params(plugin_module.generate_response)
+
+
+def _accepted_kwargs(func, candidates):
+    """The subset of 'candidates' that 'func' declares as parameters."""
+    accepted = _signature_params(func)
+    return {k: v for k, v in candidates.items() if k in accepted}
+
+
+@functools.lru_cache(maxsize=None)
+def _signature_params(func):
+    return frozenset(inspect.signature(func).parameters)
+
+
+def _relay_stream(chat_uuid, personality_name, chunks):
+    """
+    Forward a plugin's chunk generator to the room as chat_message_start /
+    chat_message_delta events. Returns (stream_id, full_text); the caller
+    persists the text and closes the stream with chat_message_end.
+    """
+    stream_id = uuid.uuid4().hex
+    parts = []
+    started = False
+
+    try:
+        for chunk in chunks:
+            if not chunk:
+                continue
+            if not started:
+                socketio.emit('chat_message_start', {
+                    'stream_id': stream_id,
+                    'username': personality_name
+                }, room=chat_uuid)
+                started = True
+            parts.append(chunk)
+            socketio.emit('chat_message_delta', {
+                'stream_id': stream_id,
+                'delta': chunk
+            }, room=chat_uuid)
+    except BaseException:
+        # The plugin failed mid-stream: don't leave the bubble open on clients
+        if started:
+            _discard_stream(chat_uuid, personality_name, stream_id)
+        raise
+
+    # Nothing streamed means nothing was shown, so there is nothing to close.
+    return (stream_id if started else None), "".join(parts).strip()
+
+
+def _discard_stream(chat_uuid, personality_name, stream_id):
+    """Close a stream whose reply won't be posted; clients drop the bubble."""
+    socketio.emit('chat_message_end', {
+        'stream_id': stream_id,
+        'username': personality_name,
+        'discarded': True
+    }, room=chat_uuid)
+
+
+def _is_error_reply(ai_response):
+    """Plugins report failures as "Error: ..." (streams append "\nError: ...")."""
+    return ai_response.lstrip().startswith("Error:") or "\nError: " in ai_response
+
+
+def _is_worth_posting(ai_response):
+    """Drop empty, very short and non-committal replies."""
+    if not ai_response or not ai_response.strip():
+        return False
+    if len(ai_response.split()) < 3:
+        return False
+    return ai_response.strip().lower() not in ["i'm not sure", "i don't know"]
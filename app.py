@@ -1,23 +1,37 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session
+from flask import Flask, render_template, request, redirect, url_for, flash, session, make_response
 from dotenv import load_dotenv
+import atexit
 import os
-import markdown
-
+from datetime import timezone
 # Load environment variables from .env file
 load_dotenv()
 
+import tracing
+
+log = tracing.get_logger(__name__)
+
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'fallback-secret-key')
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('SQLALCHEMY_DATABASE_URI', 'sqlite:///aimultichat.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# How many messages the chat page shows up front (and per 'load_older' page)
+app.config['CHAT_PAGE_SIZE'] = int(os.environ.get('CHAT_PAGE_SIZE', '100'))
 
 # Import db and socketio from extensions and initialize them
-from extensions import db, socketio, load_personalities
+from extensions import db, socketio, load_personalities, watch_plugins, WATCH_SECONDS, engine_options
+# SQLite pragmas or a MySQL connection pool, depending on the database (see extensions.py)
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
 db.init_app(app)
-socketio.init_app(app, async_mode='threading')
+# With several worker processes, SOCKETIO_MESSAGE_QUEUE (e.g. redis://host:6379/0)
+# lets each worker relay broadcasts to clients connected to the others.
+socketio.init_app(
+    app,
+    async_mode='threading',
+    message_queue=os.environ.get('SOCKETIO_MESSAGE_QUEUE') or None
+)
 
 # Import models and blueprints
-from models import AIAgent, Chat, ChatParticipant, ChatHistory, User
+from models import AIAgent, Chat, ChatParticipant, ChatHistory, ChatDeletion, User
 from auth import auth_bp
 from auth.admin import admin_bp
 from auth.admin_chat import admin_chat_bp
@@ -27,44 +41,42 @@ app.register_blueprint(admin_bp)
 app.register_blueprint(admin_chat_bp)
 
 import socketio_events
+import history_cache
+import metrics
+import page_cache
+import room_sequence
+import presence
+import search
+import write_behind
 
 app.loaded_personalities = load_personalities()
+if WATCH_SECONDS > 0:
+    # Pick up added, edited and removed plugins without a restart
+    socketio.start_background_task(watch_plugins, app)
 
 @app.route('/')
 def index():
     """
     The homepage.
-    We'll sort app.loaded_personalities.values() by .name and pass them to index.html,
-    AND load README.md -> HTML to display on the page as well.
+    The personalities sorted by name and README.md as HTML, both cached
+    (see page_cache); a repeat visit with a matching ETag gets a 304.
     """
-    readme_md = ""
-    try:
-        with open("README.md", "r", encoding="utf-8") as f:
-            readme_md = f.read()
-    except FileNotFoundError:
-        readme_md = "# Welcome to AIMultiChat\n*(No README.md found.)*"
-
-    readme_html = markdown.markdown(
-        readme_md,
-        extensions=["fenced_code", "codehilite"],
-        extension_configs={
-            "codehilite": {
-                "css_class": "highlight",
-                "linenums": False
-            }
-        }
-    )
-
-    personalities_list = sorted(
-        app.loaded_personalities.values(),
-        key=lambda p: p["name"].lower()
-    )
-
-    return render_template(
+    readme_html, readme_mtime = page_cache.readme_html()
+    personalities_list, _, registry_version, registry_modified = \
+        page_cache.personalities(app.loaded_personalities)
+
+    tag = page_cache.etag('index', readme_mtime, registry_version)
+    last_modified = page_cache.latest(page_cache.as_datetime(readme_mtime), registry_modified)
+    cacheable = page_cache.cacheable()
+    if cacheable and page_cache.not_modified(tag, last_modified):
+        return page_cache.not_modified_response(tag, last_modified)
+
+    response = make_response(render_template(
         'index.html',
         personalities=personalities_list,
         readme_html=readme_html
-    )
+    ))
+    return page_cache.conditional(response, tag, last_modified) if cacheable else response
 
 @app.route('/chat/<string:join_code>')
 def chat_room(join_code):
@@ -73,31 +85,73 @@ def chat_room(join_code):
         flash('Error: Chat room not found.', 'danger')
         return redirect(url_for('index'))
 
-    numeric_chat_id = str(chat.id)
-    messages = ChatHistory.query.filter_by(chat_id=numeric_chat_id).order_by(ChatHistory.id).all()
-    sorted_personality_keys = sorted(app.loaded_personalities.keys(), key=str.lower)
+    # Newest deletion tombstone, so a reconnecting client only asks for later ones
+    last_deletion_id = db.session.query(db.func.max(ChatDeletion.id)).filter_by(chat_id=chat.id).scalar() or 0
+    _, sorted_personality_keys, registry_version, registry_modified = \
+        page_cache.personalities(app.loaded_personalities)
 
     available_chats = []
     if session.get('is_admin'):
         available_chats = Chat.query.all()
 
-    return render_template(
+    # Messages are only ever appended or deleted, so the newest message and
+    # the newest deletion pin down the page without loading it.
+    newest = history_cache.newest(chat.id)
+    tag = page_cache.etag('chat', chat.id, chat.title, chat.allow_anonymous,
+                          newest.id if newest else None, last_deletion_id, app.config['CHAT_PAGE_SIZE'],
+                          registry_version, [(c.join_code, c.title) for c in available_chats])
+    last_modified = page_cache.latest(
+        newest.timestamp.replace(tzinfo=timezone.utc) if newest and newest.timestamp else None,
+        registry_modified)
+    cacheable = page_cache.cacheable()
+    if cacheable and page_cache.not_modified(tag, last_modified):
+        return page_cache.not_modified_response(tag, last_modified)
+
+    # Only the latest page is rendered; older pages are fetched with the
+    # 'load_older' Socket.IO event as the user scrolls up.
+    messages, has_more = history_cache.get_page(chat.id, limit=app.config['CHAT_PAGE_SIZE'])
+    response = make_response(render_template(
         'chat.html',
         chat_id=join_code,
         chat_title=chat.title,
         messages=messages,
+        has_more=has_more,
+        last_deletion_id=last_deletion_id,
         personalities=sorted_personality_keys,
         is_admin=session.get('is_admin', False),
         available_chats=available_chats
-    )
+    ))
+    return page_cache.conditional(response, tag, last_modified) if cacheable else response
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """
+    Prometheus text exposition of this worker's metrics (see metrics.py).
+    Requires 'Authorization: Bearer <METRICS_TOKEN>' if METRICS_TOKEN is set.
+    """
+    if metrics.TOKEN and request.headers.get('Authorization') != f"Bearer {metrics.TOKEN}":
+        return "Unauthorized\n", 401, {'Content-Type': 'text/plain'}
+
+    room_counts = socketio_events.participants.room_counts()
+    body = metrics.render({
+        'rooms_active': len(room_counts),
+        'participants': sum(room_counts.values()),
+        'socket_sessions': socketio_events.sessions.stats()['sessions'],
+    })
+    return body, 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
 
 # --------------------------------------------------------------------------
 # NEW: run db.create_all() + default admin at import time (for Gunicorn, etc.)
 # --------------------------------------------------------------------------
 with app.app_context():
     db.create_all()
+    room_sequence.ensure_indexes(db.engine)
+    search.ensure_index(db.engine)
+    if write_behind.ENABLED:
+        # Insert messages a crashed worker emitted but never flushed
+        write_behind.recover()
     if User.query.count() == 0:
-        print("No users found. Creating default admin user.")
+        log.info("No users found. Creating default admin user.")
         admin = User(
             username='test@aimultichat.null',
             friendly_name='Temporary Administrator',
@@ -106,10 +160,23 @@ with app.app_context():
         admin.set_password('F7svijfIin')
         db.session.add(admin)
         db.session.commit()
-        print("Created default admin user!")
+        log.info("Created default admin user!")
     else:
-        print("User table already populated; skipping creation.")
+        log.debug("User table already populated; skipping creation.")
+
+# Clear out AIs left in empty rooms and presence rows of dead workers
+socketio.start_background_task(presence.gc_loop, app)
+
+if write_behind.ENABLED:
+    socketio.start_background_task(write_behind.flush_loop, app)
+    atexit.register(write_behind.shutdown, app)
+
+@app.cli.command('search-rebuild')
+def search_rebuild():
+    """Recreate the full-text search index from chat_history."""
+    rows = search.rebuild(db.engine)
+    print(f"Search index rebuilt over {rows} messages")
 
 if __name__ == '__main__':
-    print("🚀 Starting in development mode (no SSL)")
+    log.info("🚀 Starting in development mode (no SSL)")
     socketio.run(app, host='0.0.0.0', port=5000, debug=True)
@@ -1,4 +1,4 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, jsonify
 from extensions import db
 from models import User
 from werkzeug.security import generate_password_hash
@@ -68,3 +68,30 @@ def user_delete(user_id):
     else:
         flash('User not found.', 'danger')
     return redirect(url_for('admin.user_list'))
+
+# AI job queue depth and timings (JSON)
+@admin_bp.route('/jobs')
+@admin_required
+def job_stats():
+    import job_queue
+    import openai_client
+    import rate_limiter
+    import relevance_gate
+    import response_cache
+    import tracing
+    import write_behind
+    return jsonify(dict(job_queue.queue_stats(), provider=openai_client.client_stats(),
+                        relevance=relevance_gate.gate_stats(),
+                        response_cache=response_cache.cache_stats(),
+                        rate_limits=rate_limiter.limiter_stats(),
+                        write_behind=write_behind.stats(),
+                        spans=tracing.span_stats()))
+
+# Re-scan the plugins folder without a restart (JSON). Only reloads the worker
+# that serves the request; with several workers use PLUGIN_WATCH_SECONDS.
+@admin_bp.route('/personalities/reload', methods=['POST'])
+@admin_required
+def personalities_reload():
+    from flask import current_app
+    from extensions import reload_personalities
+    return jsonify(reload_personalities(current_app._get_current_object()))
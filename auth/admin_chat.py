@@ -1,7 +1,12 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash, session
 from extensions import db
-from models import Chat
+from models import Chat, ChatSummary
 import uuid  # For generating unique join codes
+import history_cache
+import language_detect
+import search
+import summary_memory
+import write_behind
 
 admin_chat_bp = Blueprint('admin_chat', __name__, url_prefix='/admin/chats')
 
@@ -22,6 +27,18 @@ def chat_list():
     chats = Chat.query.all()
     return render_template('admin/chat_list.html', chats=chats)
 
+# Search messages across chats (or in one, with ?room=<join_code>)
+@admin_chat_bp.route('/search')
+@admin_required
+def chat_search():
+    query = request.args.get('q', '')
+    room = request.args.get('room', '')
+    page = request.args.get('page', 1, type=int)
+    chat = Chat.query.filter_by(join_code=room).first() if room else None
+    results, has_more = search.search(query, chat.id if chat else None, page=page) if query else ([], False)
+    return render_template('admin/chat_search.html', query=query, room=room, page=max(1, page),
+                           results=results, has_more=has_more, chats=Chat.query.all())
+
 # Add or Edit a chat
 @admin_chat_bp.route('/edit/<string:join_code>', methods=['GET', 'POST'])
 @admin_chat_bp.route('/add', methods=['GET', 'POST'])
@@ -53,6 +70,11 @@ def chat_form(join_code=None):
 def chat_delete(join_code):
     chat = Chat.query.filter_by(join_code=join_code).first()
     if chat:
+        write_behind.settle(chat.id)  # Don't insert its pending messages after it is gone
+        history_cache.evict_room(chat.id)
+        summary_memory.forget_room(chat.id)
+        language_detect.forget_room(chat.id)
+        ChatSummary.query.filter_by(chat_id=chat.id).delete()
         db.session.delete(chat)
         db.session.commit()
         flash('Chat deleted successfully.', 'success')
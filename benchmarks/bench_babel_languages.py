@@ -0,0 +1,82 @@
+"""
+Benchmark: Babel model calls with local language detection.
+
+Replays a monolingual and a bilingual room through the Babel plugin with
+the OpenAI client replaced by a counter, and compares the number of model
+calls (and prompt size) with the old behaviour of one call per message
+carrying the whole history.
+
+    python benchmarks/bench_babel_languages.py
+"""
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import context_builder
+import language_detect
+import openai_client
+from plugins import babel
+
+ENGLISH = [
+    "Has anyone tried the new version yet?",
+    "I will be a bit late for the call today",
+    "That sounds like a good plan to me",
+    "Can you explain how this works please",
+    "the server crashed again last night",
+    "we need more tests before friday",
+]
+SPANISH = [
+    "¿Alguien ha probado ya la nueva versión?",
+    "Me parece un buen plan para el proyecto",
+    "el servidor se cayó otra vez anoche",
+    "necesitamos más pruebas antes del viernes",
+]
+MESSAGES = 60
+
+
+class CountingClient:
+    def __init__(self):
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, model, messages, **kwargs):
+        self.calls += 1
+        self.prompt_tokens += sum(context_builder.estimate_tokens(m["content"]) for m in messages)
+        reply = SimpleNamespace(content="Spanish: (translation)")
+        return SimpleNamespace(choices=[SimpleNamespace(message=reply)])
+
+
+def replay(chat_id, texts):
+    client = CountingClient()
+    openai_client.get_client = lambda: client
+    history = []
+    old_prompt_tokens = 0
+    start = time.perf_counter()
+    for i in range(MESSAGES):
+        text = texts[i % len(texts)]
+        history.append(SimpleNamespace(id=i + 1, sender_name=f"user{i % 3}", message=text))
+        old_prompt_tokens += sum(context_builder.estimate_tokens(context_builder.format_entry(e)) for e in history)
+        languages = language_detect.room_languages(chat_id, history, {babel.PERSONALITY_NAME: None})
+        babel.generate_response("Room", [], history, text, languages=languages)
+    elapsed = (time.perf_counter() - start) / MESSAGES * 1000
+    return client, old_prompt_tokens, elapsed
+
+
+def main():
+    rooms = [
+        ("monolingual", ENGLISH),
+        ("bilingual", [text for pair in zip(ENGLISH, SPANISH) for text in pair]),
+    ]
+    for chat_id, (label, texts) in enumerate(rooms, start=1):
+        client, old_tokens, elapsed = replay(chat_id, texts)
+        print(f"{label:<12} model calls {client.calls:3d}/{MESSAGES} (was {MESSAGES}), "
+              f"prompt ~{client.prompt_tokens} tokens (was ~{old_tokens}), "
+              f"local overhead {elapsed:.2f} ms/message")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Benchmark: worker boot time, with lazy plugin loading vs eager imports.
+
+Imports the app in fresh interpreter processes (what each gunicorn worker
+does at start-up) against a scratch SQLite database and reports the median
+wall time of 'import app' and of the personality discovery inside it, with
+PLUGIN_PRELOAD=0 (metadata read from the plugin sources, modules imported on
+first use) and PLUGIN_PRELOAD=1 (every plugin imported at boot, as before).
+
+    python benchmarks/bench_boot.py
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RUNS = 5
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import extensions
+original = extensions.load_personalities
+timings = {}
+def timed(*args, **kwargs):
+    t = time.perf_counter()
+    result = original(*args, **kwargs)
+    timings['discovery'] = time.perf_counter() - t
+    return result
+extensions.load_personalities = timed
+import app
+timings['boot'] = time.perf_counter() - start
+timings['openai_imported'] = 'openai' in sys.modules
+print(json.dumps(timings))
+"""
+
+
+def measure(preload):
+    workdir = tempfile.mkdtemp(prefix="aimultichat-boot-")
+    env = dict(
+        os.environ,
+        SQLALCHEMY_DATABASE_URI=f"sqlite:///{os.path.join(workdir, 'boot.db')}",
+        CHATGPTAPIKEY=os.environ.get('CHATGPTAPIKEY', 'sk-placeholder'),
+        PLUGIN_PRELOAD=preload,
+        LOG_LEVEL='WARNING',
+        PYTHONPATH=ROOT,
+    )
+    runs = []
+    for _ in range(RUNS):
+        out = subprocess.run([sys.executable, "-c", PROBE], cwd=ROOT, env=env, check=True,
+                             capture_output=True, text=True).stdout
+        runs.append(json.loads(out.strip().splitlines()[-1]))
+    return (statistics.median(r['boot'] for r in runs),
+            statistics.median(r.get('discovery', 0) for r in runs),
+            runs[-1]['openai_imported'])
+
+
+def main():
+    for label, preload in [("eager (PLUGIN_PRELOAD=1)", '1'), ("lazy  (PLUGIN_PRELOAD=0)", '0')]:
+        boot, discovery, openai_loaded = measure(preload)
+        print(f"{label}: boot {boot * 1000:7.1f} ms, plugin discovery {discovery * 1000:7.1f} ms, "
+              f"openai imported at boot: {openai_loaded}")
+
+
+if __name__ == "__main__":
+    main()
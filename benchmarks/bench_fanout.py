@@ -0,0 +1,77 @@
+"""
+Benchmark: sequential vs concurrent AI reply fan-out.
+
+Simulates a room with several personalities of very different latency and
+measures how long it takes until the *last* reply is ready.
+
+    python benchmarks/bench_fanout.py
+
+Sequential latency should be roughly the sum of the model latencies; the
+ai_dispatch fan-out should track the slowest single model.
+"""
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from extensions import socketio
+import ai_dispatch
+
+# Simulated per-personality latencies in seconds (o1 is the slow one)
+LATENCIES = {
+    "Echo Bot": 0.05,
+    "Cassie (ChatGPT 4o Mini)": 0.4,
+    "Delia (ChatGPT 4o)": 0.8,
+    "Francesca (ChatGPT o1)": 2.0,
+}
+
+
+def fake_reply(latency):
+    time.sleep(latency)
+    return "simulated reply text"
+
+
+def run_sequential():
+    start = time.perf_counter()
+    for latency in LATENCIES.values():
+        fake_reply(latency)
+    return time.perf_counter() - start
+
+
+def run_concurrent():
+    done = threading.Event()
+    remaining = [len(LATENCIES)]
+    lock = threading.Lock()
+
+    def task(latency):
+        fake_reply(latency)
+        with lock:
+            remaining[0] -= 1
+            if remaining[0] == 0:
+                done.set()
+
+    start = time.perf_counter()
+    for latency in LATENCIES.values():
+        ai_dispatch.submit("bench-room", lambda l=latency: task(l))
+    done.wait()
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    app = Flask(__name__)
+    socketio.init_app(app, async_mode='threading')
+
+    slowest = max(LATENCIES.values())
+    total = sum(LATENCIES.values())
+    seq = run_sequential()
+    conc = run_concurrent()
+
+    print(f"personalities:        {len(LATENCIES)}")
+    print(f"slowest model:        {slowest:.2f}s")
+    print(f"sum of latencies:     {total:.2f}s")
+    print(f"sequential fan-out:   {seq:.2f}s")
+    print(f"concurrent fan-out:   {conc:.2f}s "
+          f"(global cap={ai_dispatch.MAX_CONCURRENT_REPLIES}, room cap={ai_dispatch.MAX_ROOM_REPLIES})")
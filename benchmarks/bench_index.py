@@ -0,0 +1,59 @@
+"""
+Micro-benchmark: requests per second on the index page and a chat page.
+
+Uses Flask's test client (no network) against a scratch SQLite database,
+so the numbers are the app's own cost per request: first plain GETs, then
+repeat visits that send back the ETag from the first response.
+
+    python benchmarks/bench_index.py
+"""
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)  # The index page reads README.md from the working directory
+os.environ['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+os.environ.setdefault('CHATGPTAPIKEY', 'sk-placeholder')
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+import app as chat_app
+from models import Chat, ChatHistory
+
+SECONDS = 3.0
+
+
+def rate(client, path, headers=None):
+    count, status = 0, None
+    deadline = time.perf_counter() + SECONDS
+    while time.perf_counter() < deadline:
+        status = client.get(path, headers=headers or {}).status_code
+        count += 1
+    return count / SECONDS, status
+
+
+def main():
+    with chat_app.app.app_context():
+        chat = Chat(title='Bench', join_code='bench-room', allow_anonymous=True)
+        chat_app.db.session.add(chat)
+        chat_app.db.session.commit()
+        for n in range(1, 101):
+            chat_app.db.session.add(ChatHistory(chat_id=chat.id, sender_name='alice', message=f'message {n}',
+                                                room_message_id=n))
+        chat_app.db.session.commit()
+
+    client = chat_app.app.test_client()
+    for path in ('/', '/chat/bench-room'):
+        first = client.get(path)
+        etag = first.headers.get('ETag')
+        plain, status = rate(client, path)
+        print(f"{path:18} GET:               {plain:7.0f} req/s ({status})")
+        if etag:
+            repeat, status = rate(client, path, {'If-None-Match': etag})
+            print(f"{path:18} GET If-None-Match: {repeat:7.0f} req/s ({status})")
+
+
+if __name__ == "__main__":
+    main()
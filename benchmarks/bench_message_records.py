@@ -0,0 +1,92 @@
+"""
+Benchmark: loading and holding a 50k-message room as ORM objects vs Message records.
+
+Fills a scratch SQLite database with one room of ROWS messages, then loads
+it three ways and reports load time, memory retained by the result
+(tracemalloc) and the time to walk it once reading sender_name and message
+(what context_builder and the plugins do):
+
+  orm       ChatHistory.query.all()         - live, session-bound instances
+  detached  .all() + detached copies        - what history_cache used to keep
+  records   column-only query -> Message    - what it keeps now
+
+    python benchmarks/bench_message_records.py [rows]
+"""
+import gc
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+os.environ.setdefault('CHATGPTAPIKEY', 'sk-placeholder')
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+import app as chat_app
+from models import Chat, ChatHistory, Message, MESSAGE_COLUMNS
+
+db = chat_app.db
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+
+
+def load_orm():
+    return ChatHistory.query.filter_by(chat_id=1).order_by(ChatHistory.id).all()
+
+
+def load_detached():
+    return [ChatHistory(id=r.id, room_message_id=r.room_message_id, timestamp=r.timestamp, chat_id=r.chat_id,
+                        sender_id=r.sender_id, sender_name=r.sender_name, message=r.message)
+            for r in load_orm()]
+
+
+def load_records():
+    rows = db.session.query(*MESSAGE_COLUMNS).filter(ChatHistory.chat_id == 1).order_by(ChatHistory.id).all()
+    return list(map(Message._make, rows))
+
+
+def walk(history):
+    return sum(len(m.sender_name or "") + len(m.message) for m in history)
+
+
+def measure(load):
+    db.session.expunge_all()
+    gc.collect()
+    start = time.perf_counter()
+    load()
+    loaded = time.perf_counter() - start  # Timed without tracemalloc, which slows allocation down
+
+    db.session.expunge_all()
+    gc.collect()
+    tracemalloc.start()
+    history = load()
+    gc.collect()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    start = time.perf_counter()
+    walk(history)
+    walked = time.perf_counter() - start
+    return loaded, retained, peak, walked
+
+
+def main():
+    with chat_app.app.app_context():
+        db.session.add(Chat(id=1, title='Bench', join_code='bench-room', allow_anonymous=True))
+        db.session.commit()
+        db.session.execute(ChatHistory.__table__.insert(), [
+            {'chat_id': 1, 'room_message_id': n, 'sender_id': n % 7, 'sender_name': f'user-{n % 7}',
+             'message': f'message number {n} with a little text in it'} for n in range(1, ROWS + 1)
+        ])
+        db.session.commit()
+
+        print(f"{ROWS} messages")
+        for label, load in [("orm", load_orm), ("detached", load_detached), ("records", load_records)]:
+            loaded, retained, peak, walked = measure(load)
+            print(f"{label:9} load {loaded * 1000:7.0f} ms  retained {retained / 2**20:6.1f} MiB "
+                  f"(peak {peak / 2**20:6.1f})  walk {walked * 1000:5.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
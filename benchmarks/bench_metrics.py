@@ -0,0 +1,73 @@
+"""
+Benchmark: cost of metrics.inc/observe under contention.
+
+THREADS threads each record OPS counter increments and histogram
+observations, first through metrics.py's per-thread shards, then through a
+single dict behind one lock (the obvious alternative). Prints ns per
+operation for each and the time to render a scrape.
+
+    python benchmarks/bench_metrics.py
+"""
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import metrics
+
+THREADS = 8
+OPS = 100_000
+PERSONALITIES = ["Cassie (ChatGPT 4o Mini)", "Delia (ChatGPT 4o)", "Babel (Universal Translator)"]
+
+
+def sharded(i):
+    for n in range(OPS):
+        name = PERSONALITIES[n % 3]
+        metrics.inc('ai_requests_total', personality=name)
+        metrics.observe('ai_request_seconds', (n % 50) / 10.0, personality=name)
+
+
+_lock = threading.Lock()
+_counters = {}
+
+
+def locked_inc(name, amount=1, **labels):
+    key = metrics._key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def locked(i):
+    for n in range(OPS):
+        name = PERSONALITIES[n % 3]
+        locked_inc('ai_requests_total', personality=name)
+        locked_inc('ai_request_seconds_sum', (n % 50) / 10.0, personality=name)
+
+
+def run(target):
+    threads = [threading.Thread(target=target, args=(i,)) for i in range(THREADS)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return (time.perf_counter() - start) / (THREADS * OPS * 2) * 1e9
+
+
+def main():
+    print(f"{THREADS} threads x {OPS} increments + {OPS} observations")
+    print(f"metrics.py shards: {run(sharded):6.0f} ns/op")
+    print(f"one locked dict:   {run(locked):6.0f} ns/op")
+
+    start = time.perf_counter()
+    text = metrics.render({'rooms_active': 1})
+    print(f"render: {(time.perf_counter() - start) * 1000:.2f} ms for {len(text.splitlines())} lines")
+    counters, _ = metrics.snapshot()
+    total = sum(v for (name, _), v in counters.items() if name == 'ai_requests_total')
+    print(f"counted {total} requests (expected {THREADS * OPS})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Benchmark: per-plugin OpenAI clients vs the shared pooled client.
+
+Runs a local TLS endpoint that answers /v1/chat/completions after a short
+fixed delay, then replays a room's traffic: replies rotate across the six
+OpenAI personalities with quiet gaps between messages.
+
+  per-plugin  one client per plugin with the SDK's default 5 s keep-alive,
+              as the plugins used to build at import time
+  shared      openai_client.create_client() with OPENAI_KEEPALIVE_SECONDS
+
+Time is scaled down (SCALE) so the run takes seconds: gaps and keep-alive
+expiries are divided by it. A gap longer than the keep-alive means the next
+call pays a fresh TCP + TLS handshake.
+
+    python benchmarks/bench_openai_client.py
+"""
+import json
+import os
+import ssl
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import openai_client
+
+SCALE = 25
+PLUGINS = 6
+CALLS = 120
+GAPS = (2, 4, 6, 8)            # Seconds between messages in a room, unscaled
+SERVER_DELAY = 0.01            # Simulated model time
+SDK_KEEPALIVE = 5.0            # httpx default keep-alive expiry
+
+COMPLETION = json.dumps({
+    "id": "chatcmpl-bench", "object": "chat.completion", "created": 0, "model": "bench",
+    "choices": [{"index": 0, "finish_reason": "stop",
+                 "message": {"role": "assistant", "content": "simulated reply text"}}],
+    "usage": {"prompt_tokens": 1, "completion_tokens": 3, "total_tokens": 4}
+}).encode()
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(SERVER_DELAY)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(COMPLETION)))
+        self.end_headers()
+        self.wfile.write(COMPLETION)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_server(workdir):
+    cert, key = os.path.join(workdir, "cert.pem"), os.path.join(workdir, "key.pem")
+    subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+                    "-subj", "/CN=127.0.0.1", "-keyout", key, "-out", cert],
+                   check=True, capture_output=True)
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert, key)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"https://127.0.0.1:{server.server_address[1]}/v1"
+
+
+def run(clients):
+    latencies = []
+    for i in range(CALLS):
+        time.sleep(GAPS[i % len(GAPS)] / SCALE)
+        client = clients[i % len(clients)]
+        start = time.perf_counter()
+        client.chat.completions.create(model="bench", messages=[{"role": "user", "content": "hi"}])
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+
+def report(label, latencies):
+    ordered = sorted(latencies)
+    p95 = ordered[int(len(ordered) * 0.95)]
+    print(f"{label:<12} p50 {statistics.median(ordered):6.1f} ms   p95 {p95:6.1f} ms")
+
+
+def main():
+    workdir = tempfile.mkdtemp(prefix="aimultichat-")
+    server, base_url = start_server(workdir)
+    try:
+        per_plugin = [openai_client.create_client(api_key="sk-bench", base_url=base_url,
+                                                  keepalive_seconds=SDK_KEEPALIVE / SCALE, verify=False)
+                      for _ in range(PLUGINS)]
+        shared = openai_client.create_client(api_key="sk-bench", base_url=base_url,
+                                             keepalive_seconds=openai_client.KEEPALIVE_SECONDS / SCALE,
+                                             verify=False)
+
+        print(f"{CALLS} calls across {PLUGINS} plugins, gaps {GAPS} s, time scaled 1/{SCALE}, "
+              f"server time {SERVER_DELAY * 1000:.0f} ms")
+        report("per-plugin", run(per_plugin))
+        report("shared", run([shared] * PLUGINS))
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
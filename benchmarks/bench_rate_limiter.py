@@ -0,0 +1,95 @@
+"""
+Benchmark: provider 429s during a burst, with and without rate_limiter.
+
+A simulated provider accepts at most PROVIDER_CONCURRENCY calls at once and
+PROVIDER_RPM calls per minute, answering the rest with a 429 the way the
+plugins report it ("Error: ... 429 ..."). A burst of CALLS requests from
+THREADS dispatch threads is sent straight at it, then through a
+ModelLimiter configured with the provider's RPM. Prints errors, wall time
+and the order in which addressed (priority) calls got through.
+
+    python benchmarks/bench_rate_limiter.py
+"""
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('RATE_LIMIT_BACKOFF_SECONDS', '0.5')
+
+import rate_limiter
+
+PROVIDER_CONCURRENCY = 3
+PROVIDER_RPM = 600
+CALL_SECONDS = 0.05
+CALLS = 60
+THREADS = 16
+ADDRESSED_EVERY = 6  # Every sixth call names the personality
+
+
+class FakeProvider:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.started = []  # monotonic start times of accepted calls
+
+    def call(self):
+        now = time.monotonic()
+        with self.lock:
+            recent = [t for t in self.started if now - t < 60]
+            if self.in_flight >= PROVIDER_CONCURRENCY or len(recent) >= PROVIDER_RPM:
+                return "Error: 429 Rate limit reached for requests"
+            self.in_flight += 1
+            self.started.append(now)
+        time.sleep(CALL_SECONDS)
+        with self.lock:
+            self.in_flight -= 1
+        return "ok"
+
+
+def run(limiter):
+    provider = FakeProvider()
+    errors = []
+    order = []
+
+    def one(i):
+        priority = rate_limiter.PRIORITY_ADDRESSED if i % ADDRESSED_EVERY == 0 else rate_limiter.PRIORITY_NORMAL
+        if limiter:
+            limiter.acquire(priority, tokens=0)
+        started = time.monotonic()
+        reply = provider.call()
+        if limiter:
+            limiter.release(time.monotonic() - started, throttled=rate_limiter.is_throttled(reply))
+        order.append(priority)
+        if reply != "ok":
+            errors.append(i)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(THREADS) as pool:
+        list(pool.map(one, range(CALLS)))
+    return errors, time.perf_counter() - start, order
+
+
+def mean_position(order, priority):
+    positions = [i for i, p in enumerate(order) if p == priority]
+    return sum(positions) / len(positions) / len(order)
+
+
+def main():
+    print(f"{CALLS} calls from {THREADS} threads; provider allows {PROVIDER_CONCURRENCY} "
+          f"concurrent, {PROVIDER_RPM} rpm")
+    for label, limiter in [("no limiter", None),
+                           ("rate_limiter", rate_limiter.ModelLimiter("sim", rpm=PROVIDER_RPM))]:
+        errors, elapsed, order = run(limiter)
+        print(f"{label:>12}: {len(errors):3d} errors (429), {elapsed:.2f}s, "
+              f"addressed calls finish at {mean_position(order, rate_limiter.PRIORITY_ADDRESSED):.0%} "
+              f"of the burst on average (others {mean_position(order, rate_limiter.PRIORITY_NORMAL):.0%})")
+        if limiter:
+            print(f"{'':>12}  final concurrency limit {int(limiter.limit)}, "
+                  f"{limiter.stats['throttled']} throttled, {limiter.stats['waited']} calls waited")
+
+
+if __name__ == "__main__":
+    main()
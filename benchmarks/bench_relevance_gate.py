@@ -0,0 +1,83 @@
+"""
+Benchmark: how many plugin calls the relevance gate avoids, and what it costs.
+
+Replays a scripted room with two humans and four AI personalities, running
+every human message through relevance_gate for each AI, and prints the
+calls made vs avoided plus the gate's own time per decision.
+
+    python benchmarks/bench_relevance_gate.py
+
+Without the gate every human message would call every AI in the room.
+"""
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import relevance_gate
+
+PERSONALITIES = {
+    name: {"name": name, "aliases": [], "policy": policy}
+    for name, policy in [
+        ("Cassie (ChatGPT 4o Mini)", None),
+        ("Delia (ChatGPT 4o)", None),
+        ("Francesca (ChatGPT o1)", None),
+        ("Babel (Universal Translator)", "always"),
+    ]
+}
+PARTICIPANTS = ["alice", "bob"] + list(PERSONALITIES)
+
+# (sender, text); AI entries are replies that land in the history
+SCRIPT = [
+    ("alice", "morning bob"),
+    ("bob", "morning! did you see the build went green"),
+    ("alice", "yes finally"),
+    ("alice", "Cassie, can you summarise what we decided yesterday?"),
+    ("Cassie (ChatGPT 4o Mini)", "You agreed to ship the release on Friday."),
+    ("alice", "and the risks?"),
+    ("Cassie (ChatGPT 4o Mini)", "The migration has not been tested on MySQL."),
+    ("bob", "I can test it on MySQL tonight"),
+    ("bob", "alice, lunch at 12?"),
+    ("alice", "sure"),
+    ("bob", "Does anyone know a good way to speed up the test suite?"),
+    ("Delia (ChatGPT 4o)", "Run the slow tests in parallel."),
+    ("bob", "ok thanks"),
+    ("alice", "@Francesca prove that the scheduler can't deadlock"),
+    ("Francesca (ChatGPT o1)", "It holds locks in a fixed global order."),
+    ("alice", "nice"),
+    ("bob", "lol"),
+    ("alice", "brb"),
+]
+ROUNDS = 2000
+
+
+def replay():
+    history, called, avoided = [], 0, 0
+    for sender, text in SCRIPT:
+        if sender not in PERSONALITIES:
+            for name, personality in PERSONALITIES.items():
+                if relevance_gate.decide(personality, text, sender, PARTICIPANTS, PERSONALITIES, history)[0]:
+                    called += 1
+                else:
+                    avoided += 1
+        history.append(SimpleNamespace(sender_name=sender, message=text))
+    return called, avoided
+
+
+def main():
+    called, avoided = replay()
+    total = called + avoided
+    print(f"{total} candidate calls: {called} made, {avoided} avoided ({avoided / total:.0%})")
+
+    decisions = total * ROUNDS
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        replay()
+    elapsed = time.perf_counter() - start
+    print(f"Gate cost: {elapsed / decisions * 1e6:.1f} µs per decision")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Benchmark: response_cache hit rate and latency on repeated requests.
+
+Replays a stream of translation-style requests where some messages recur
+("ok", "thanks", greetings, retries), against a simulated provider with a
+fixed latency, with and without the cache. Then drops the memory tier to
+simulate a restart and replays again against the SQLite tier alone.
+
+    python benchmarks/bench_response_cache.py
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import response_cache
+
+PROVIDER_LATENCY = 0.02
+REQUESTS = 400
+DISTINCT = 120
+PERSONALITY = "Babel (Universal Translator)"
+
+
+def workload(seed=1):
+    rng = random.Random(seed)
+    # Zipf-like: a few messages are very common, most are rare
+    weights = [1 / (rank + 1) for rank in range(DISTINCT)]
+    picks = rng.choices(range(DISTINCT), weights=weights, k=REQUESTS)
+    return [[{"role": "user", "content": "Target languages: Spanish."},
+             {"role": "user", "content": f"message number {i}"}] for i in picks]
+
+
+def provider(messages):
+    time.sleep(PROVIDER_LATENCY)
+    return "Spanish: " + messages[-1]["content"]
+
+
+def run(requests, use_cache):
+    start = time.perf_counter()
+    for messages in requests:
+        if use_cache:
+            response_cache.cached(PERSONALITY, "o3-mini", messages, lambda: provider(messages))
+        else:
+            provider(messages)
+    return (time.perf_counter() - start) / len(requests) * 1000
+
+
+def main():
+    response_cache.SQLITE_PATH = os.path.join(tempfile.mkdtemp(prefix="aimultichat-"), "response_cache.db")
+    response_cache.configure(PERSONALITY, 3600)
+    requests = workload()
+
+    baseline = run(requests, use_cache=False)
+    cached = run(requests, use_cache=True)
+    stats = response_cache.cache_stats()
+    print(f"{REQUESTS} requests, {DISTINCT} distinct, provider {PROVIDER_LATENCY * 1000:.0f} ms")
+    print(f"no cache     {baseline:6.2f} ms/request")
+    print(f"cache        {cached:6.2f} ms/request, hit rate {stats['hit_rate']:.0%}")
+
+    # Restart: memory tier empty, SQLite tier still warm
+    with response_cache._lock:
+        response_cache._entries.clear()
+        response_cache._total_bytes = 0
+    before = response_cache.cache_stats()
+    restarted = run(requests, use_cache=True)
+    after = response_cache.cache_stats()
+    print(f"after restart {restarted:5.2f} ms/request, "
+          f"{after['sqlite_hits'] - before['sqlite_hits']} SQLite hits, "
+          f"{after['misses'] - before['misses']} misses")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Benchmark: allocating room_message_id in a room with 100k messages.
+
+Compares the old approach (max(room_message_id) over the room on every
+insert, no index on chat_history) with the ChatSequence counter plus the
+(chat_id, room_message_id) index.
+
+    python benchmarks/bench_room_sequence.py [rows] [inserts]
+"""
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+from sqlalchemy import func
+
+from extensions import db
+from models import Chat, ChatHistory
+import room_sequence
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+INSERTS = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+ROOMS = 10  # the big room shares the table with a few others
+
+
+def make_app(path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{path}"
+    db.init_app(app)
+    return app
+
+
+def insert_with_max(count=INSERTS):
+    for _ in range(count):
+        current = db.session.query(func.max(ChatHistory.room_message_id)).filter_by(chat_id=1).scalar() or 0
+        db.session.add(ChatHistory(chat_id=1, sender_name='bench', message='hello', room_message_id=current + 1))
+        db.session.commit()
+
+
+def insert_with_sequence(count=INSERTS):
+    for _ in range(count):
+        db.session.add(ChatHistory(chat_id=1, sender_name='bench', message='hello',
+                                   room_message_id=room_sequence.allocate(1)))
+        db.session.commit()
+
+
+def concurrently(fn, threads=4):
+    """Run 'fn' from several threads at once (each with its own session)."""
+    import threading
+    from flask import current_app
+    app = current_app._get_current_object()
+
+    def worker():
+        with app.app_context():
+            fn(INSERTS // threads)
+
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+
+
+def timed(label, with_index, fn):
+    with tempfile.TemporaryDirectory() as tmp:
+        app = make_app(os.path.join(tmp, "bench.db"))
+        with app.app_context():
+            saved = set(ChatHistory.__table__.indexes)
+            if not with_index:
+                ChatHistory.__table__.indexes.clear()
+            try:
+                db.create_all()
+            finally:
+                ChatHistory.__table__.indexes.update(saved)
+            for room in range(1, ROOMS + 1):
+                db.session.add(Chat(id=room, join_code=f"room-{room}", title=f"Room {room}"))
+            db.session.commit()
+
+            now = datetime.utcnow()
+            db.session.execute(ChatHistory.__table__.insert(), [
+                {'chat_id': 1 if i < ROWS else (i % (ROOMS - 1)) + 2, 'room_message_id': i + 1,
+                 'sender_name': 'seed', 'message': 'x' * 80, 'timestamp': now}
+                for i in range(ROWS + ROWS // 2)
+            ])
+            db.session.commit()
+
+            start = time.perf_counter()
+            fn()
+            elapsed = time.perf_counter() - start
+
+            ids = [r for (r,) in db.session.query(ChatHistory.room_message_id)
+                   .filter_by(chat_id=1, sender_name='bench').all()]
+    print(f"{label:<36} {INSERTS / elapsed:8.0f} inserts/s  "
+          f"({elapsed * 1000 / INSERTS:.2f} ms each, duplicate ids: {len(ids) - len(set(ids))})")
+
+
+if __name__ == '__main__':
+    print(f"room size: {ROWS} messages, {INSERTS} inserts, SQLite")
+    timed("max(room_message_id), no index", False, insert_with_max)
+    timed("max(room_message_id), with index", True, insert_with_max)
+    timed("ChatSequence counter + index", True, insert_with_sequence)
+    timed("max(), index, 4 threads", True, lambda: concurrently(insert_with_max))
+    timed("ChatSequence counter, 4 threads", True, lambda: concurrently(insert_with_sequence))
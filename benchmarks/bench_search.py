@@ -0,0 +1,94 @@
+"""
+Benchmark: full-text search with the FTS5 index vs a LIKE scan.
+
+Fills a scratch SQLite database with ROWS messages spread over ROOMS rooms
+(made of words from a small vocabulary, plus a rare word in one message in
+a thousand), then times search.search() for a few queries - common word,
+rare word, two words, a prefix - across all rooms and within one, with the
+'fts5' backend and with the 'like' fallback, and reports the mean per query.
+Also reports the insert rate with and without the sync triggers.
+
+    python benchmarks/bench_search.py [rows]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+os.environ.setdefault('CHATGPTAPIKEY', 'sk-placeholder')
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+from sqlalchemy import text
+
+import app as chat_app
+import search
+from models import Chat, ChatHistory
+
+db = chat_app.db
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+ROOMS = 50
+REPEAT = 20
+WORDS = ("the quick brown fox jumps over lazy dog river stone cloud light music paper window garden "
+         "coffee morning evening planet signal engine silver orange yellow purple market travel").split()
+QUERIES = ['coffee', 'xylophone', 'silver planet', 'gard']
+
+
+def fill(rows):
+    random.seed(1)
+    return [{'chat_id': n % ROOMS + 1, 'room_message_id': n, 'sender_id': 0, 'sender_name': 'bench',
+             'message': " ".join(random.choices(WORDS, k=12)) + (" xylophone" if n % 1000 == 0 else "")}
+            for n in range(1, rows + 1)]
+
+
+def insert_rate(rows):
+    start = time.perf_counter()
+    with db.engine.begin() as conn:
+        conn.execute(ChatHistory.__table__.insert(), rows)
+    return len(rows) / (time.perf_counter() - start)
+
+
+def timed(query, chat_id):
+    search.search(query, chat_id)  # Warm the page cache
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        search.search(query, chat_id)
+    return (time.perf_counter() - start) / REPEAT * 1000
+
+
+def main():
+    with chat_app.app.app_context():
+        db.session.add_all([Chat(id=i, title=f'Bench {i}', join_code=f'bench-{i}', allow_anonymous=True)
+                            for i in range(1, ROOMS + 1)])
+        db.session.commit()
+        rows = fill(ROWS)
+        sample = rows[:20_000]
+
+        with_triggers = insert_rate(sample)
+        db.session.execute(text("DELETE FROM chat_history"))
+        for trigger in ('insert', 'delete', 'update'):
+            db.session.execute(text(f"DROP TRIGGER chat_history_fts_{trigger}"))
+        db.session.commit()
+        without_triggers = insert_rate(sample)
+        db.session.execute(text("DELETE FROM chat_history"))
+        db.session.commit()
+        insert_rate(rows)  # Then the full set, indexed by the rebuild below
+        search.rebuild(db.engine)
+        print(f"{ROWS} messages in {ROOMS} rooms; inserts {without_triggers:,.0f} rows/s without the index, "
+              f"{with_triggers:,.0f} rows/s with it")
+
+        for scope, chat_id in (("all rooms", None), ("one room", 1)):
+            for query in QUERIES:
+                times = {}
+                for backend in ('like', 'fts5'):
+                    search._backend = backend
+                    times[backend] = timed(query, chat_id)
+                print(f"{scope:9} {query!r:16} like {times['like']:8.1f} ms  fts5 {times['fts5']:6.1f} ms  "
+                      f"x{times['like'] / times['fts5']:.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Check: reads carry on while SQLite is being written to.
+
+One writer thread commits big batches of chat_history rows (large enough
+to spill SQLite's page cache, which with a rollback journal takes the
+exclusive lock before the commit) as fast as it can while READERS threads page through the same room (the query the chat page
+and 'load_older' run) and SENDERS threads store single messages through
+room_sequence, as chat_message does. Runs once with SQLite's defaults
+(rollback journal, synchronous=FULL, no busy_timeout pragma) and once with
+extensions.SQLITE_PRAGMAS (WAL etc.), each on a fresh database file, and
+reports read latency, "database is locked" errors and write throughput.
+
+    python benchmarks/check_sqlite_concurrency.py
+
+Exits non-zero if the WAL profile saw any locking error or a read slower
+than MAX_READ_MS.
+"""
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'  # The app's own engine isn't used
+os.environ.setdefault('CHATGPTAPIKEY', 'sk-placeholder')
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.exc import OperationalError
+
+import extensions
+from models import ChatHistory, ChatSequence
+
+SECONDS = 5.0
+READERS = 4
+SENDERS = 2
+BATCH = 5000
+MESSAGE = 'x' * 2000
+MAX_READ_MS = 250
+
+DEFAULTS = {'journal_mode': 'DELETE', 'synchronous': 'FULL'}
+
+
+def run(pragmas):
+    extensions.SQLITE_PRAGMAS.clear()
+    extensions.SQLITE_PRAGMAS.update(pragmas)
+    path = os.path.join(tempfile.mkdtemp(), 'check.db')
+    engine = create_engine(f"sqlite:///{path}", pool_size=READERS + SENDERS + 2)
+    extensions.db.metadata.create_all(engine, tables=[ChatHistory.__table__, ChatSequence.__table__])
+    history = ChatHistory.__table__
+    sequence = ChatSequence.__table__
+    with engine.begin() as conn:
+        conn.execute(sequence.insert().values(chat_id=1, last_room_message_id=0))
+
+    stop = threading.Event()
+    read_ms, errors, written = [], {'read': 0, 'write': 0}, [0]
+    lock = threading.Lock()
+
+    def writer():
+        rows = [{'chat_id': 2, 'sender_name': 'bulk', 'message': MESSAGE, 'room_message_id': i}
+                for i in range(BATCH)]
+        while not stop.is_set():
+            try:
+                with engine.begin() as conn:
+                    conn.execute(history.insert(), rows)
+            except OperationalError:
+                with lock:
+                    errors['write'] += 1
+
+    def sender():
+        while not stop.is_set():
+            try:
+                with engine.begin() as conn:
+                    conn.execute(sequence.update().where(sequence.c.chat_id == 1)
+                                 .values(last_room_message_id=sequence.c.last_room_message_id + 1))
+                    number = conn.execute(select(sequence.c.last_room_message_id)
+                                          .where(sequence.c.chat_id == 1)).scalar()
+                    conn.execute(history.insert().values(chat_id=1, sender_name='human', message='hi',
+                                                         room_message_id=number))
+                with lock:
+                    written[0] += 1
+            except OperationalError:
+                with lock:
+                    errors['write'] += 1
+
+    def reader():
+        query = select(history).where(history.c.chat_id == 1) \
+            .order_by(history.c.room_message_id.desc()).limit(100)
+        while not stop.is_set():
+            start = time.perf_counter()
+            try:
+                with engine.connect() as conn:
+                    conn.execute(query).all()
+                with lock:
+                    read_ms.append((time.perf_counter() - start) * 1000)
+            except OperationalError:
+                with lock:
+                    errors['read'] += 1
+
+    threads = [threading.Thread(target=writer)] + \
+              [threading.Thread(target=sender) for _ in range(SENDERS)] + \
+              [threading.Thread(target=reader) for _ in range(READERS)]
+    for t in threads:
+        t.start()
+    time.sleep(SECONDS)
+    stop.set()
+    for t in threads:
+        t.join()
+    engine.dispose()
+
+    read_ms.sort()
+    return {
+        'reads': len(read_ms),
+        'read_p50_ms': round(statistics.median(read_ms), 1) if read_ms else None,
+        'read_p99_ms': round(read_ms[int(len(read_ms) * 0.99) - 1], 1) if read_ms else None,
+        'read_max_ms': round(read_ms[-1], 1) if read_ms else None,
+        'read_errors': errors['read'],
+        'write_errors': errors['write'],
+        'messages_per_s': round(written[0] / SECONDS),
+    }
+
+
+def main():
+    profile = dict(extensions.SQLITE_PRAGMAS)
+    before = run(DEFAULTS)
+    after = run(profile)
+    print(f"{READERS} readers, {SENDERS} senders, 1 bulk writer ({BATCH} rows/commit), {SECONDS:.0f}s each")
+    print(f"defaults: {before}")
+    print(f"profile:  {after}")
+    ok = after['read_errors'] == 0 and after['write_errors'] == 0 and after['read_max_ms'] < MAX_READ_MS
+    print("OK" if ok else "FAIL")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+"""
+Socket.IO load test: how many rooms and users one worker keeps up with.
+
+Starts the app on a scratch SQLite database with the simulated personality
+from benchmarks/simulated_llm.py, creates ROOMS anonymous rooms with the
+simulated AI in each, connects CLIENTS python-socketio clients per room and
+has every client join, send MESSAGES chat messages INTERVAL seconds apart
+and leave. Reports, as JSON:
+
+    send_to_broadcast_ms     chat_message emit -> the broadcast arriving at
+                             each client in the room (sender included)
+    send_to_ai_first_ms      emit -> first streamed chunk of the AI's reply
+    send_to_ai_reply_ms      emit -> the AI's complete reply
+    throughput               messages sent, broadcasts and AI replies per second
+
+each latency with count/p50/p95/p99/max, plus the parameters and the git
+commit, so runs can be compared between commits:
+
+    python benchmarks/load_test.py --rooms 10 --clients 5 --output before.json
+
+Simulated model: --latency-ms, --tokens-per-second, --reply-tokens,
+--no-stream. Needs python-socketio's client extras
+(pip install requests websocket-client).
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.join(ROOT, "benchmarks")
+sys.path.insert(0, ROOT)
+
+import socketio
+
+from simulated_llm import PERSONALITY_NAME as SIM_NAME
+
+SERVER = """
+import sys
+sys.path.insert(0, {bench_dir!r})
+import app
+import extensions
+import simulated_llm
+app.app.loaded_personalities[simulated_llm.PERSONALITY_NAME] = extensions.personality_record(simulated_llm, 'Sim')
+app.socketio.run(app.app, host='127.0.0.1', port={port}, allow_unsafe_werkzeug=True)
+"""
+
+
+def percentiles(samples):
+    if not samples:
+        return {'count': 0}
+    ordered = sorted(samples)
+
+    def pick(p):
+        return round(ordered[min(len(ordered) - 1, int(p / 100.0 * len(ordered)))], 2)
+
+    return {'count': len(ordered), 'p50': pick(50), 'p95': pick(95), 'p99': pick(99),
+            'max': round(ordered[-1], 2)}
+
+
+def seed_rooms(env, count):
+    codes = [str(uuid.uuid4()) for _ in range(count)]
+    script = (
+        "import app\n"
+        "from models import Chat\n"
+        "with app.app.app_context():\n"
+        f"    for code in {codes!r}:\n"
+        "        app.db.session.add(Chat(title='Load test', join_code=code, allow_anonymous=True))\n"
+        "    app.db.session.commit()\n"
+    )
+    subprocess.run([sys.executable, "-c", script], cwd=ROOT, env=env, check=True,
+                   stdout=subprocess.DEVNULL)
+    return codes
+
+
+def wait_for_port(port, timeout=20):
+    import socket as sock
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with sock.create_connection(('127.0.0.1', port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Server on port {port} did not start")
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Recorder:
+    """Send times by tag, and the latencies measured against them."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sent = {}
+        self.broadcast = []
+        self.ai_first = []
+        self.ai_reply = []
+        self.streams = {}  # stream_id -> tag of the message it answers
+        self.errors = []
+
+    def on_message(self, data):
+        now = time.perf_counter()
+        text = data.get('message') or ''
+        with self.lock:
+            if data.get('username') == SIM_NAME:
+                tag = _reply_tag(text)
+                if tag in self.sent:
+                    self.ai_first.append((now - self.sent[tag]) * 1000)
+                    self.ai_reply.append((now - self.sent[tag]) * 1000)
+            else:
+                tag = text.split()[0] if text.split() else None
+                if tag in self.sent:
+                    self.broadcast.append((now - self.sent[tag]) * 1000)
+
+    def on_delta(self, data):
+        now = time.perf_counter()
+        with self.lock:
+            if data['stream_id'] in self.streams:
+                return
+            tag = _reply_tag(data.get('delta') or '')
+            self.streams[data['stream_id']] = tag
+            if tag in self.sent:
+                self.ai_first.append((now - self.sent[tag]) * 1000)
+
+    def on_end(self, data):
+        now = time.perf_counter()
+        with self.lock:
+            tag = self.streams.get(data.get('stream_id'))
+            if tag in self.sent and not data.get('discarded'):
+                self.ai_reply.append((now - self.sent[tag]) * 1000)
+
+
+def _reply_tag(text):
+    # simulated_llm replies start with "re <tag>:"
+    parts = text.split()
+    return parts[1].rstrip(':') if len(parts) > 1 and parts[0] == 're' else None
+
+
+def run_client(url, join_code, username, args, recorder, listens, start_barrier):
+    client = socketio.Client(reconnection=False)
+    if listens:
+        # One listener per room is enough for AI replies; every client
+        # measures broadcasts so fan-out cost shows up.
+        client.on('chat_message_delta', recorder.on_delta)
+        client.on('chat_message_end', recorder.on_end)
+    client.on('chat_message', recorder.on_message if listens else
+              (lambda data: data.get('username') != SIM_NAME and recorder.on_message(data)))
+    try:
+        client.connect(url, transports=['websocket'])
+        client.emit('join', {'chat_id': join_code, 'username': username})
+        if listens:
+            client.emit('add_personality', {'chat_id': join_code, 'personality': SIM_NAME})
+        start_barrier.wait()
+        time.sleep(random.uniform(0, args.interval))
+        for seq in range(args.messages):
+            tag = f"{username}.{seq}"
+            with recorder.lock:
+                recorder.sent[tag] = time.perf_counter()
+            client.emit('chat_message', {'chat_id': join_code, 'username': username,
+                                         'message': f"{tag} could someone take a look at this?"})
+            time.sleep(args.interval)
+        return client
+    except Exception as e:
+        with recorder.lock:
+            recorder.errors.append(f"{username}: {e}")
+        return client
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument('--rooms', type=int, default=5)
+    parser.add_argument('--clients', type=int, default=4, help="clients per room")
+    parser.add_argument('--messages', type=int, default=10, help="messages per client")
+    parser.add_argument('--interval', type=float, default=0.5, help="seconds between a client's messages")
+    parser.add_argument('--latency-ms', type=float, default=300)
+    parser.add_argument('--tokens-per-second', type=float, default=50)
+    parser.add_argument('--reply-tokens', type=int, default=40)
+    parser.add_argument('--no-stream', action='store_true')
+    parser.add_argument('--drain-timeout', type=float, default=60, help="seconds to wait for AI replies")
+    parser.add_argument('--port', type=int, default=5111)
+    parser.add_argument('--output', help="also write the JSON result to this file")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="aimultichat-load-")
+    env = dict(
+        os.environ,
+        SQLALCHEMY_DATABASE_URI=f"sqlite:///{os.path.join(workdir, 'load.db')}",
+        CHATGPTAPIKEY=os.environ.get('CHATGPTAPIKEY', 'sk-placeholder'),
+        SIM_LLM_LATENCY_MS=str(args.latency_ms),
+        SIM_LLM_TOKENS_PER_SECOND=str(args.tokens_per_second),
+        SIM_LLM_REPLY_TOKENS=str(args.reply_tokens),
+        SIM_LLM_STREAM='0' if args.no_stream else '1',
+        PYTHONPATH=ROOT,
+    )
+    codes = seed_rooms(env, args.rooms)
+    server = subprocess.Popen([sys.executable, "-c", SERVER.format(bench_dir=BENCH_DIR, port=args.port)],
+                              cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{args.port}"
+    recorder = Recorder()
+    clients = []
+    try:
+        wait_for_port(args.port)
+        total = args.rooms * args.clients
+        start_barrier = threading.Barrier(total + 1)
+        results = [None] * total
+        threads = []
+        for r, code in enumerate(codes):
+            for c in range(args.clients):
+                index = r * args.clients + c
+
+                def target(index=index, code=code, r=r, c=c):
+                    username = f"u{r}-{c}"
+                    client = run_client(url, code, username, args, recorder, c == 0, start_barrier)
+                    results[index] = (client, code, username)
+
+                thread = threading.Thread(target=target, daemon=True)
+                thread.start()
+                threads.append(thread)
+
+        start_barrier.wait(timeout=60)
+        started = time.perf_counter()
+        for thread in threads:
+            thread.join()
+        send_seconds = time.perf_counter() - started
+        clients = [c for c in results if c is not None]
+
+        expected = total * args.messages
+        deadline = time.time() + args.drain_timeout
+        while time.time() < deadline:
+            with recorder.lock:
+                if len(recorder.ai_reply) >= expected:
+                    break
+            time.sleep(0.1)
+        elapsed = time.perf_counter() - started
+
+        for client, code, username in clients:
+            if client.connected:
+                client.emit('leave', {'chat_id': code, 'username': username})
+
+        with recorder.lock:
+            result = {
+                'commit': git_commit(),
+                'params': {k: v for k, v in vars(args).items() if k != 'output'},
+                'clients': total,
+                'messages_sent': len(recorder.sent),
+                'send_seconds': round(send_seconds, 2),
+                'elapsed_seconds': round(elapsed, 2),
+                'throughput': {
+                    'messages_per_s': round(len(recorder.sent) / send_seconds, 1),
+                    'broadcasts_per_s': round(len(recorder.broadcast) / elapsed, 1),
+                    'ai_replies_per_s': round(len(recorder.ai_reply) / elapsed, 1),
+                },
+                'send_to_broadcast_ms': percentiles(recorder.broadcast),
+                'send_to_ai_first_ms': percentiles(recorder.ai_first),
+                'send_to_ai_reply_ms': percentiles(recorder.ai_reply),
+                'ai_replies_missing': expected - len(recorder.ai_reply),
+                'errors': recorder.errors,
+            }
+        output = json.dumps(result, indent=2)
+        print(output)
+        if args.output:
+            with open(args.output, 'w') as f:
+                f.write(output + "\n")
+        return 0 if not recorder.errors else 1
+    finally:
+        for client, _, _ in clients:
+            try:
+                client.disconnect()
+            except Exception:
+                pass
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,142 @@
+"""
+Multi-process check: a message sent via worker A reaches clients on worker B.
+
+Starts two app processes on different ports that share one SQLite database,
+PRESENCE_BACKEND=sql and a Socket.IO message queue, connects a Socket.IO
+client to each, sends a chat_message through A and waits for it on B.
+
+    python benchmarks/multiworker_broadcast.py
+
+Uses SOCKETIO_MESSAGE_QUEUE if it is set, otherwise an in-process fake
+Redis server (pip install fakeredis). The client side needs
+python-socketio's client extras (pip install requests websocket-client).
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import socketio
+
+PORTS = (5101, 5102)
+TIMEOUT = 15
+
+WORKER = """
+import app
+app.socketio.run(app.app, host='127.0.0.1', port={port}, allow_unsafe_werkzeug=True)
+"""
+
+
+def start_fake_redis():
+    from fakeredis import TcpFakeServer
+    server = TcpFakeServer(('127.0.0.1', 0), server_type="redis")
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address
+    return server, f"redis://{host}:{port}/0"
+
+
+def seed_chat(env):
+    """Create the tables and an anonymous room in the shared database."""
+    join_code = str(uuid.uuid4())
+    script = (
+        "import app\n"
+        "from models import Chat\n"
+        "with app.app.app_context():\n"
+        f"    app.db.session.add(Chat(title='Broadcast check', join_code='{join_code}', allow_anonymous=True))\n"
+        "    app.db.session.commit()\n"
+    )
+    subprocess.run([sys.executable, "-c", script], cwd=ROOT, env=env, check=True,
+                   stdout=subprocess.DEVNULL)
+    return join_code
+
+
+def wait_for_port(port):
+    import socket as sock
+    deadline = time.time() + TIMEOUT
+    while time.time() < deadline:
+        try:
+            with sock.create_connection(('127.0.0.1', port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Worker on port {port} did not start")
+
+
+def main():
+    fake_server = None
+    queue = os.environ.get('SOCKETIO_MESSAGE_QUEUE')
+    if not queue:
+        fake_server, queue = start_fake_redis()
+
+    workdir = tempfile.mkdtemp(prefix="aimultichat-")
+    env = dict(
+        os.environ,
+        SQLALCHEMY_DATABASE_URI=f"sqlite:///{os.path.join(workdir, 'shared.db')}",
+        PRESENCE_BACKEND='sql',
+        SOCKETIO_MESSAGE_QUEUE=queue,
+        CHATGPTAPIKEY=os.environ.get('CHATGPTAPIKEY', 'sk-placeholder'),
+        PYTHONPATH=ROOT,
+    )
+    join_code = seed_chat(env)
+
+    workers = [subprocess.Popen([sys.executable, "-c", WORKER.format(port=port)], cwd=ROOT, env=env,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+               for port in PORTS]
+    clients = []
+    try:
+        for port in PORTS:
+            wait_for_port(port)
+
+        received = threading.Event()
+        participants_seen = {}
+        text = f"hello from A {uuid.uuid4().hex[:6]}"
+
+        for name, port in zip(("A", "B"), PORTS):
+            client = socketio.Client()
+
+            @client.on('participant_update')
+            def on_participants(data, name=name):
+                participants_seen[name] = data['participants']
+
+            if name == "B":
+                @client.on('chat_message')
+                def on_message(data):
+                    if data.get('message') == text:
+                        received.set()
+
+            client.connect(f"http://127.0.0.1:{port}", transports=['websocket'])
+            client.emit('join', {'chat_id': join_code, 'username': name})
+            clients.append(client)
+
+        time.sleep(1)  # Let both joins land
+        start = time.perf_counter()
+        clients[0].emit('chat_message', {'chat_id': join_code, 'username': 'A', 'message': text})
+        ok = received.wait(TIMEOUT)
+        elapsed = (time.perf_counter() - start) * 1000
+
+        print(f"Message queue:          {queue}")
+        print(f"Presence seen on A:     {participants_seen.get('A')}")
+        print(f"Presence seen on B:     {participants_seen.get('B')}")
+        if ok:
+            print(f"Worker A -> worker B:   delivered in {elapsed:.1f} ms")
+        else:
+            print(f"Worker A -> worker B:   NOT delivered within {TIMEOUT}s")
+        return 0 if ok else 1
+    finally:
+        for client in clients:
+            client.disconnect()
+        for worker in workers:
+            worker.terminate()
+            worker.wait()
+        if fake_server is not None:
+            fake_server.shutdown()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
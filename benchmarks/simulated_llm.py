@@ -0,0 +1,59 @@
+"""
+A stand-in LLM personality for load tests, shaped like plugins/dummy.py.
+
+It builds its prompt with context_builder like the real plugins, then
+"thinks" for SIM_LLM_LATENCY_MS before producing SIM_LLM_REPLY_TOKENS words
+at SIM_LLM_TOKENS_PER_SECOND, streamed unless SIM_LLM_STREAM=0. Every reply
+starts with "re <tag>:" where <tag> is the first word of the message it
+answers, so a load generator can match replies to what it sent.
+
+Not in plugins/ so it never shows up in a real deployment; load_test.py
+registers it with extensions.personality_record() in its server process.
+"""
+import os
+import time
+
+import context_builder
+
+PERSONALITY_NAME = "Sim (Simulated LLM)"
+PERSONALITY_DESC = "Simulated model with configurable latency and reply length, for load tests."
+PERSONALITY_INTELLIGENCE = 0
+PERSONALITY_COST = 0
+PERSONALITY_WINDOW = 128000
+PERSONALITY_MAXOUT = 4000
+# Answers every message, so every send has a reply to time
+RELEVANCE_POLICY = "always"
+
+LATENCY_MS = float(os.environ.get('SIM_LLM_LATENCY_MS', '300'))
+TOKENS_PER_SECOND = float(os.environ.get('SIM_LLM_TOKENS_PER_SECOND', '50'))
+REPLY_TOKENS = int(os.environ.get('SIM_LLM_REPLY_TOKENS', '40'))
+STREAM = os.environ.get('SIM_LLM_STREAM', '1') == '1'
+
+WORDS = ("the quick brown fox jumps over a lazy dog while seven bright "
+         "planets drift through quiet silver clouds").split()
+
+
+def generate_response(chat_title, participants, chat_history, new_message):
+    context_builder.build_messages(
+        PERSONALITY_NAME,
+        f"Simulated model in '{chat_title}' with {participants}.",
+        chat_history,
+        new_message,
+        window=PERSONALITY_WINDOW,
+        maxout=PERSONALITY_MAXOUT
+    )
+    tag = (new_message or "").split()[0] if (new_message or "").split() else "-"
+    words = [f"re {tag}:"] + [WORDS[i % len(WORDS)] for i in range(REPLY_TOKENS)]
+
+    time.sleep(LATENCY_MS / 1000.0)
+    if not STREAM:
+        time.sleep(REPLY_TOKENS / TOKENS_PER_SECOND)
+        return " ".join(words)
+    return _stream(words)
+
+
+def _stream(words):
+    yield words[0]
+    for word in words[1:]:
+        time.sleep(1.0 / TOKENS_PER_SECOND)
+        yield " " + word
@@ -0,0 +1,103 @@
+"""
+Soak test: presence and session bookkeeping stay flat under connection churn.
+
+Over and over, CLIENTS Socket.IO test clients join random rooms (a third
+also add an AI personality) and then disconnect without sending 'leave',
+like crashed tabs. presence.collect() runs every GC_EVERY cycles with
+PRESENCE_AI_IDLE_SECONDS=0. Every REPORT_SECONDS the script prints the
+session/presence counts and traced Python memory; at the end it fails if
+anything is still registered or memory grew more than MAX_GROWTH_KIB after
+the warm-up.
+
+    python benchmarks/soak_presence.py [seconds]      # default 60; 86400 for a day
+"""
+import gc
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'soak.db')}"
+os.environ.setdefault('CHATGPTAPIKEY', 'sk-placeholder')
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+os.environ['PRESENCE_AI_IDLE_SECONDS'] = '0'
+os.environ['PRESENCE_GC_SECONDS'] = '3600'  # collect() is called directly below
+
+import app as chat_app
+import presence
+from models import Chat
+
+ROOMS = 20
+CLIENTS = 10
+GC_EVERY = 5
+REPORT_SECONDS = 10
+WARMUP_SECONDS = 10
+MAX_GROWTH_KIB = 512
+
+
+def counts():
+    return dict(presence.sessions.stats(), participants=sum(presence.store.room_counts().values()))
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 60.0
+    app = chat_app.app
+    with app.app_context():
+        chats = [Chat(title=f'Soak {i}', join_code=f'soak-{i}', allow_anonymous=True) for i in range(ROOMS)]
+        chat_app.db.session.add_all(chats)
+        chat_app.db.session.commit()
+    personality = sorted(app.loaded_personalities)[0]
+
+    tracemalloc.start()
+    start = last_report = time.monotonic()
+    baseline = None
+    cycles = 0
+    while time.monotonic() - start < seconds:
+        clients = []
+        for n in range(CLIENTS):
+            client = chat_app.socketio.test_client(app)
+            room = f'soak-{random.randrange(ROOMS)}'
+            client.emit('join', {'chat_id': room, 'username': f'user-{n}'})
+            if n % 3 == 0:
+                client.emit('add_personality', {'chat_id': room, 'personality': personality})
+            clients.append(client)
+        for client in clients:
+            # No 'leave': the tab just went away. Closing the Engine.IO
+            # transport is what the server sees then (the test client's own
+            # disconnect() only leaves the namespace and keeps its state).
+            client.get_received()
+            chat_app.socketio.server._handle_eio_disconnect(client.eio_sid, 'transport close')
+            client.clients.pop(client.eio_sid, None)
+        cycles += 1
+        if cycles % GC_EVERY == 0:
+            with app.app_context():
+                presence.collect()
+
+        now = time.monotonic()
+        if now - last_report >= REPORT_SECONDS:
+            gc.collect()
+            current, _ = tracemalloc.get_traced_memory()
+            if baseline is None and now - start >= WARMUP_SECONDS:
+                baseline = current
+            print(f"{now - start:7.0f}s cycles={cycles} {counts()} traced={current / 1024:.0f} KiB", flush=True)
+            last_report = now
+
+    with app.app_context():
+        presence.collect()
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    left = counts()
+    growth = (current - baseline) / 1024 if baseline is not None else 0.0
+    print(f"end: {cycles} cycles, {cycles * CLIENTS} connections, left over {left}, "
+          f"growth after warm-up {growth:.0f} KiB")
+    ok = not any(left.values()) and growth <= MAX_GROWTH_KIB
+    print("OK" if ok else "FAIL")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+# context_builder.py
+"""
+Shared prompt builder for the AI plugins.
+
+Plugins used to send the entire room history on every call with a fixed
+output cap, so request cost and latency grew without bound and long rooms
+eventually failed with context-length errors. build_messages() fits the
+history into a personality's budget instead:
+
+    budget = PERSONALITY_WINDOW
+             - PERSONALITY_MAXOUT (reserved for the reply)
+             - system prompt - latest message
+
+and keeps the most recent messages that fit, dropping the oldest first.
+If the room has a rolling summary (see summary_memory.py) it is added to the
+system prompt and the messages it covers are left out.
+Tokens are estimated locally (roughly 4 characters per token plus a small
+per-message overhead), which is close enough for budgeting.
+"""
+import threading
+import time
+
+import tracing
+
+log = tracing.get_logger(__name__)
+
+CHARS_PER_TOKEN = 4
+MESSAGE_OVERHEAD_TOKENS = 4  # role + separators per chat message
+DEFAULT_MAX_OUTPUT_TOKENS = 2000
+
+_lock = threading.Lock()
+_local = threading.local()  # Stats of the last build in this thread (see last_build_stats)
+_totals = {'requests': 0, 'trimmed_requests': 0, 'dropped_messages': 0, 'dropped_tokens': 0,
+           'summarized_requests': 0, 'summary_tokens_saved': 0}
+
+
+def estimate_tokens(text):
+    """Cheap local token estimate for a piece of text."""
+    if not text:
+        return MESSAGE_OVERHEAD_TOKENS
+    return MESSAGE_OVERHEAD_TOKENS + (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def format_entry(entry):
+    """How a history entry appears in the prompt."""
+    return f"{entry.sender_name}: {entry.message}"
+
+
+def build_messages(personality_name, system_prompt, chat_history, new_message,
+                   window=0, maxout=0, system_role="system", summary=None):
+    """
+    Build the OpenAI-style messages array for one call:
+        [system prompt, <as much recent history as fits>, new message]
+
+    :param personality_name: Entries from this sender become 'assistant' turns
+    :param system_prompt:    The plugin's combined system prompt
+    :param chat_history:     Room messages, oldest first
+    :param new_message:      The latest user message that triggered the AI
+    :param window:           PERSONALITY_WINDOW (0 = unlimited)
+    :param maxout:           PERSONALITY_MAXOUT, reserved for the reply (0 = default)
+    :param system_role:      'system', or 'user' for models that reject system turns
+    :param summary:          Optional summary_memory.RoomSummary of the older messages
+    :return: (messages, stats) where stats reports what was kept and dropped
+    """
+    started = time.perf_counter()
+    max_output = maxout or DEFAULT_MAX_OUTPUT_TOKENS
+    system_prompt = system_prompt.strip()
+
+    # Swap the messages a summary covers for the summary itself
+    summary_tokens_saved = 0
+    if summary is not None:
+        covered = 0
+        while covered < len(chat_history) and chat_history[covered].id <= summary.through_message_id:
+            covered += 1
+        if covered:
+            replaced_tokens = sum(estimate_tokens(format_entry(e)) for e in chat_history[:covered])
+            chat_history = chat_history[covered:]
+            prefix = f"\n\nSummary of the earlier conversation ({summary.message_count} messages):\n{summary.text}"
+            system_prompt += prefix
+            summary_tokens_saved = replaced_tokens - estimate_tokens(prefix)
+
+    fixed_tokens = estimate_tokens(system_prompt) + estimate_tokens(new_message)
+
+    if window:
+        budget = window - max_output - fixed_tokens
+    else:
+        budget = None
+
+    # Walk backwards from the newest message until the budget runs out
+    kept = []
+    used = 0
+    for index in range(len(chat_history) - 1, -1, -1):
+        entry = chat_history[index]
+        content = format_entry(entry)
+        cost = estimate_tokens(content)
+        if budget is not None and used + cost > budget:
+            break
+        kept.append((entry, content))
+        used += cost
+    kept.reverse()
+
+    dropped_messages = len(chat_history) - len(kept)
+    dropped_tokens = 0
+    if dropped_messages:
+        dropped_tokens = sum(estimate_tokens(format_entry(e)) for e in chat_history[:dropped_messages])
+
+    messages = [{"role": system_role, "content": system_prompt}]
+    for entry, content in kept:
+        # "assistant" if entry.sender_name == personality_name, else "user"
+        role = "assistant" if entry.sender_name == personality_name else "user"
+        messages.append({"role": role, "content": content})
+    messages.append({"role": "user", "content": new_message})
+
+    stats = {
+        'kept_messages': len(kept),
+        'dropped_messages': dropped_messages,
+        'dropped_tokens': dropped_tokens,
+        'prompt_tokens': fixed_tokens + used,
+        'max_output_tokens': max_output,
+        'summary_tokens_saved': summary_tokens_saved,
+    }
+
+    _local.last_stats = stats
+
+    with _lock:
+        _totals['requests'] += 1
+        if dropped_messages:
+            _totals['trimmed_requests'] += 1
+            _totals['dropped_messages'] += dropped_messages
+            _totals['dropped_tokens'] += dropped_tokens
+        if summary_tokens_saved:
+            _totals['summarized_requests'] += 1
+            _totals['summary_tokens_saved'] += summary_tokens_saved
+
+    if dropped_messages:
+        log.debug("Context trimmed", personality=personality_name, dropped_messages=dropped_messages,
+                  dropped_tokens=dropped_tokens, window=window, maxout=max_output)
+
+    if summary_tokens_saved:
+        log.debug("Context used room summary", personality=personality_name, tokens_saved=summary_tokens_saved)
+
+    tracing.record_span('prompt_build', time.perf_counter() - started, personality=personality_name)
+    return messages, stats
+
+
+def last_build_stats():
+    """
+    Stats of the last build_messages() call in this thread (or greenlet), then
+    forgotten - lets the dispatcher see what a plugin actually sent.
+    """
+    stats = getattr(_local, 'last_stats', None)
+    _local.last_stats = None
+    return stats
+
+
+def context_stats():
+    """Running totals of how much history the builder has trimmed."""
+    with _lock:
+        return dict(_totals)
@@ -1,22 +1,84 @@
 # extensions.py
 from flask_sqlalchemy import SQLAlchemy
 from flask_socketio import SocketIO
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, make_url
+import ast
 import importlib
 import os
+import sys
+import threading
+import time
+import metrics
+import rate_limiter
+import response_cache
+import tracing
+
+log = tracing.get_logger(__name__)
 
 db = SQLAlchemy()
 socketio = SocketIO()  # Create the Socket.IO instance here
 
+# SQLite: set on every new connection. WAL lets readers carry on while a write
+# is in progress, NORMAL only fsyncs at checkpoints (safe in WAL mode), and
+# busy_timeout makes a second writer wait for the lock instead of failing
+# with "database is locked". cache_size is in KiB when negative.
+SQLITE_PRAGMAS = {
+    'journal_mode': os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'),
+    'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+    'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', '5000')),
+    'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024))),
+    'cache_size': int(os.environ.get('SQLITE_CACHE_SIZE', '-65536')),
+}
+
+
+def engine_options(uri):
+    """
+    SQLALCHEMY_ENGINE_OPTIONS for the database in 'uri'. SQLite gets its
+    pragmas from the connect hook below; server databases (MySQL) get a
+    sized connection pool that recycles connections before the server's
+    wait_timeout drops them, and pings each one as it is checked out.
+    """
+    if make_url(uri).get_backend_name() == 'sqlite':
+        return {}
+    return {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', '10')),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', '20')),
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', '30')),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', '1800')),
+        'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', '1') == '1',
+    }
+
+
+@event.listens_for(Engine, "connect")
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    if type(dbapi_connection).__module__ != 'sqlite3':
+        return
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+PLUGIN_DIR = os.path.join(os.path.dirname(__file__), 'plugins')
+PLUGIN_CONSTANT_PREFIXES = ('PERSONALITY_', 'RELEVANCE_POLICY', 'RESPONSE_CACHE_TTL')
+PRELOAD = os.environ.get('PLUGIN_PRELOAD', '0') == '1'
+WATCH_SECONDS = float(os.environ.get('PLUGIN_WATCH_SECONDS', '0'))
+
+_import_lock = threading.Lock()
+_reload_lock = threading.Lock()
+_imported = {}  # module name -> mtime of the file when it was imported
+
 def load_personalities():
     """
-    Scans the 'plugins' folder, loads each plugin, and returns a dictionary of:
+    Scans the 'plugins' folder and returns a dictionary of:
         {
             internal_key: {
                 "name": <string>,
-                "module": <imported module object>,
+                "module": <imported module object, or None until first use>,
                 "desc": <string>,
                 "intelligence": <int>,
                 "cost": <int>,
+                ...
             },
             ...
         }
@@ -27,45 +89,209 @@ def load_personalities():
         PERSONALITY_DESC       (str) or optional
         PERSONALITY_INTELLIGENCE (int) or optional
         PERSONALITY_COST       (int) or optional
+        PERSONALITY_ALIASES    (list) or optional, extra names for relevance_gate
+        RELEVANCE_POLICY       (str) or optional, see relevance_gate
+        RESPONSE_CACHE_TTL     (int) or optional, seconds; opts in to response_cache
+        PERSONALITY_MODEL      (str) or optional, provider model, for rate_limiter
+        PERSONALITY_RPM        (int) or optional, requests per minute, for rate_limiter
+        PERSONALITY_TPM        (int) or optional, tokens per minute, for rate_limiter
 
     If any field is missing, we default to something.
+
+    These are read from the plugin's source as literal constants, without
+    running it; the module itself (and the openai client it pulls in) is
+    imported by plugin_module() the first time the personality is called.
+    A plugin whose constants aren't plain literals is imported straight
+    away. PLUGIN_PRELOAD=1 imports every plugin at boot instead.
     """
     personalities = {}
-    plugin_dir = os.path.join(os.path.dirname(__file__), 'plugins')
 
-    if not os.path.exists(plugin_dir):
-        print(f"❌ Plugin directory not found: {plugin_dir}")
+    if not os.path.exists(PLUGIN_DIR):
+        log.error("❌ Plugin directory not found", path=PLUGIN_DIR)
         return personalities
 
-    print(f"🗂️ Looking for plugins in: {plugin_dir}")
-    print(f"📋 Directory contents: {os.listdir(plugin_dir)}")
+    log.info("🗂️ Looking for plugins", path=PLUGIN_DIR)
+    log.debug("📋 Directory contents", files=os.listdir(PLUGIN_DIR))
 
-    for filename in os.listdir(plugin_dir):
+    for filename in sorted(os.listdir(PLUGIN_DIR)):
         if filename.endswith(".py") and filename not in ["__init__.py", "init.py"]:
             try:
-                module_name = f'plugins.{filename[:-3]}'
-                plugin_module = importlib.import_module(module_name)
-
-                personality_name = getattr(plugin_module, 'PERSONALITY_NAME', filename[:-3].capitalize())
-                personality_desc = getattr(plugin_module, 'PERSONALITY_DESC', "No description provided.")
-                personality_intel = getattr(plugin_module, 'PERSONALITY_INTELLIGENCE', 5)
-                personality_cost = getattr(plugin_module, 'PERSONALITY_COST', 1)
-                personality_window = getattr(plugin_module, 'PERSONALITY_WINDOW', 0)
-                personality_maxout = getattr(plugin_module, 'PERSONALITY_MAXOUT', 0)
-
-                # Build our record
-                personalities[personality_name] = {
-                    "name": personality_name,
-                    "module": plugin_module,
-                    "desc": personality_desc,
-                    "intelligence": personality_intel,
-                    "cost": personality_cost,
-                    "window": personality_window,
-                    "maxout": personality_maxout,
-                }
-
-                print(f"✅ Loaded personality: {personality_name}")
+                record = _discover(filename)
+                if PRELOAD:
+                    plugin_module(record)
+                personalities[record["name"]] = record
+
+                log.info("✅ Loaded personality", name=record['name'],
+                         imported=record["module"] is not None)
             except Exception as e:
-                print(f"⚠️ Failed to load {filename}: {e}")
+                log.error("⚠️ Failed to load plugin", file=filename, error=str(e))
 
+    rate_limiter.configure(personalities)
     return personalities
+
+
+def _discover(filename):
+    """A personality record for plugins/<filename>, from its source if possible."""
+    path = os.path.join(PLUGIN_DIR, filename)
+    module_name = f'plugins.{filename[:-3]}'
+    default_name = filename[:-3].capitalize()
+    mtime = os.path.getmtime(path)
+
+    with open(path, "r", encoding="utf-8") as f:
+        constants, static = _read_constants(f.read(), path)
+    if static:
+        record = _build_record(constants.get, default_name, None)
+    else:
+        # Constants computed at import time: we have to run the module
+        module = importlib.import_module(module_name)
+        _imported[module_name] = mtime
+        record = personality_record(module, default_name)
+    record["module_name"] = module_name
+    record["mtime"] = mtime
+    return record
+
+
+def _read_constants(source, path):
+    """
+    The plugin's top-level PERSONALITY_* / RELEVANCE_POLICY / RESPONSE_CACHE_TTL
+    assignments as {name: value}, and whether they were all literals and
+    generate_response is defined.
+    """
+    tree = ast.parse(source, filename=path)
+    constants, static, has_entry_point = {}, True, False
+    for node in tree.body:
+        if isinstance(node, ast.FunctionDef) and node.name == 'generate_response':
+            has_entry_point = True
+        if not isinstance(node, ast.Assign):
+            continue
+        for target in node.targets:
+            if isinstance(target, ast.Name) and target.id.startswith(PLUGIN_CONSTANT_PREFIXES):
+                try:
+                    constants[target.id] = ast.literal_eval(node.value)
+                except ValueError:
+                    static = False
+    if not has_entry_point:
+        raise AttributeError("no generate_response() defined")
+    return constants, static and 'PERSONALITY_NAME' in constants
+
+
+def plugin_module(personality):
+    """
+    The plugin module behind a loaded_personalities entry, imported on first
+    use (and re-imported if the file changed since, see reload_personalities).
+    """
+    module = personality.get("module")
+    if module is not None:
+        return module
+    module_name = personality["module_name"]
+    with _import_lock:
+        module = personality.get("module")
+        if module is None:
+            started = time.perf_counter()
+            loaded = sys.modules.get(module_name)
+            if loaded is None:
+                module = importlib.import_module(module_name)
+            elif _imported.get(module_name) != personality["mtime"]:
+                module = importlib.reload(loaded)
+            else:
+                module = loaded
+            _imported[module_name] = personality["mtime"]
+            personality["module"] = module
+            log.info("Imported plugin", name=personality["name"],
+                     ms=round((time.perf_counter() - started) * 1000, 1))
+    return module
+
+
+def reload_personalities(app):
+    """
+    Re-scan the plugins folder and swap app.loaded_personalities for the
+    result in one assignment, so requests see either the old registry or
+    the new one. Records of unchanged files keep their imported module.
+    Returns {'added': [...], 'removed': [...], 'changed': [...]}.
+    """
+    with _reload_lock:
+        old = app.loaded_personalities
+        old_by_file = {p.get("module_name"): p for p in old.values()}
+        new = load_personalities()
+        for name, record in list(new.items()):
+            previous = old_by_file.get(record["module_name"])
+            if previous is not None and previous["name"] == name and previous["mtime"] == record["mtime"] \
+                    and previous.get("module") is not None:
+                record["module"] = previous["module"]
+        for name in set(old) - set(new):
+            response_cache.configure(name, 0)
+        app.loaded_personalities = new
+
+    changes = {
+        'added': sorted(set(new) - set(old)),
+        'removed': sorted(set(old) - set(new)),
+        'changed': sorted(n for n in set(new) & set(old) if new[n]["mtime"] != old[n].get("mtime")),
+    }
+    log.info("🔄 Reloaded personalities", **changes)
+    return changes
+
+
+def plugin_files_signature():
+    """(filename, mtime) of every plugin file, to notice additions, edits and removals."""
+    try:
+        return tuple(sorted((f, os.path.getmtime(os.path.join(PLUGIN_DIR, f)))
+                            for f in os.listdir(PLUGIN_DIR) if f.endswith(".py")))
+    except OSError:
+        return ()
+
+
+def watch_plugins(app):
+    """
+    Reload the registry when a plugin file is added, changed or removed.
+    Started as a background task when PLUGIN_WATCH_SECONDS > 0.
+    """
+    signature = plugin_files_signature()
+    while True:
+        socketio.sleep(WATCH_SECONDS)
+        current = plugin_files_signature()
+        if current != signature:
+            signature = current
+            try:
+                reload_personalities(app)
+            except Exception as e:
+                log.error("⚠️ Plugin reload failed", error=str(e), exc_info=True)
+
+
+def personality_record(plugin_module, default_name):
+    """
+    Build the loaded_personalities entry for one imported plugin module
+    (see load_personalities for the attributes it reads).
+    """
+    return _build_record(lambda attr, default: getattr(plugin_module, attr, default), default_name,
+                         plugin_module)
+
+
+def _build_record(get, default_name, plugin_module):
+    personality_name = get('PERSONALITY_NAME', default_name)
+    personality_desc = get('PERSONALITY_DESC', "No description provided.")
+    personality_intel = get('PERSONALITY_INTELLIGENCE', 5)
+    personality_cost = get('PERSONALITY_COST', 1)
+    personality_window = get('PERSONALITY_WINDOW', 0)
+    personality_maxout = get('PERSONALITY_MAXOUT', 0)
+    personality_aliases = get('PERSONALITY_ALIASES', [])
+    personality_policy = get('RELEVANCE_POLICY', None)
+    personality_model = get('PERSONALITY_MODEL', None)
+    personality_rpm = get('PERSONALITY_RPM', 0)
+    personality_tpm = get('PERSONALITY_TPM', 0)
+    response_cache.configure(personality_name, get('RESPONSE_CACHE_TTL', 0))
+    metrics.configure(personality_name, personality_cost)
+
+    return {
+        "name": personality_name,
+        "module": plugin_module,
+        "desc": personality_desc,
+        "intelligence": personality_intel,
+        "cost": personality_cost,
+        "window": personality_window,
+        "maxout": personality_maxout,
+        "aliases": personality_aliases,
+        "policy": personality_policy,
+        "model": personality_model,
+        "rpm": personality_rpm,
+        "tpm": personality_tpm,
+    }
@@ -0,0 +1,356 @@
+# history_cache.py
+"""
+In-memory, per-room cache of ChatHistory.
+
+Every chat_message and every /chat/<join_code> page view used to reload the
+room's entire history from the database. Instead, a room is loaded once on
+first access and then kept up to date incrementally: new rows are appended
+as they are committed and deleted rows are dropped.
+
+Rooms are kept in LRU order and evicted when
+    HISTORY_CACHE_MAX_ROOMS      (env, default 256)     rooms are cached,
+    HISTORY_CACHE_MAX_BYTES      (env, default 64 MiB)  estimated size is exceeded,
+    HISTORY_CACHE_IDLE_SECONDS   (env, default 3600)    a room has not been touched.
+
+Cached entries are models.Message records - immutable tuples read with a
+column-only query, never attached to a session - so callers (and plugins)
+get a snapshot they can read from any thread without touching the
+database.
+
+When several worker processes write to the same rooms (HISTORY_CACHE_SHARED,
+on by default whenever SOCKETIO_MESSAGE_QUEUE is set) a cached room is
+topped up before each read with the rows and deletion tombstones other
+workers committed since - two small indexed queries instead of a reload.
+
+With WRITE_BEHIND=1 new rows are cached before they are inserted (see
+write_behind.py), so reads that fall through to the database flush first.
+"""
+import os
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from operator import attrgetter
+
+from extensions import db
+from models import ChatHistory, ChatDeletion, Message, MESSAGE_COLUMNS
+import metrics
+import room_sequence
+import tracing
+import write_behind
+
+MAX_ROOMS = int(os.environ.get('HISTORY_CACHE_MAX_ROOMS', '256'))
+MAX_BYTES = int(os.environ.get('HISTORY_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+IDLE_SECONDS = int(os.environ.get('HISTORY_CACHE_IDLE_SECONDS', '3600'))
+SHARED = os.environ.get('HISTORY_CACHE_SHARED',
+                        '1' if os.environ.get('SOCKETIO_MESSAGE_QUEUE') else '0') == '1'
+
+# Rough per-row overhead (tuple, ints, datetime, string headers) on top of the text
+_ROW_OVERHEAD = 250
+
+_lock = threading.Lock()
+_rooms = OrderedDict()   # chat_id -> _Room, least recently used first
+_generation = {}         # chat_id -> bumped on writes to uncached rooms (see get_history)
+_total_bytes = 0
+_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+
+class _Room:
+    __slots__ = ('messages', 'size', 'last_access', 'last_deletion')
+
+    def __init__(self, messages, last_deletion=0):
+        self.messages = messages  # Sorted by _position
+        self.size = sum(_row_size(m) for m in messages)
+        self.last_access = time.monotonic()
+        self.last_deletion = last_deletion  # Newest ChatDeletion.id already applied
+
+
+def _position(message):
+    """
+    Where a message sits in its room: (room_message_id, id), the order
+    pages and clients use. Ids are handed out in the same transaction as
+    room numbers (see room_sequence.py), so within a room this is id order
+    too and the id lookups below bisect the same list by id.
+    """
+    return message.room_message_id, message.id
+
+
+_id = attrgetter('id')
+
+
+def _row_size(message):
+    return _ROW_OVERHEAD + len(message.message or "") + len(message.sender_name or "")
+
+
+def _messages():
+    """A column-only query for Message records (no ORM instances are built)."""
+    return db.session.query(*MESSAGE_COLUMNS)
+
+
+def get_history(chat_id, up_to_id=None):
+    """
+    Return the room's messages (oldest first) as a tuple snapshot, loading
+    the room from the database on first access. If 'up_to_id' is given, only
+    messages with ChatHistory.id <= up_to_id are returned.
+    """
+    chat_id = int(chat_id)
+    _top_up(chat_id)
+    with _lock:
+        room = _rooms.get(chat_id)
+        if room is not None:
+            _rooms.move_to_end(chat_id)
+            room.last_access = time.monotonic()
+            _stats['hits'] += 1
+            return _snapshot(room, up_to_id)
+        _stats['misses'] += 1
+        generation = _generation.get(chat_id, 0)
+
+    write_behind.settle(chat_id)
+    # Read the tombstone high-water mark first, so a deletion racing the load
+    # is re-applied by the next top-up rather than missed.
+    last_deletion = _last_deletion_id(chat_id) if SHARED else 0
+    rows = _messages().filter(ChatHistory.chat_id == chat_id) \
+                      .order_by(ChatHistory.room_message_id, ChatHistory.id).all()
+    room = _Room(list(map(Message._make, rows)), last_deletion)
+
+    with _lock:
+        # Only install the room if nothing was written to it while we were
+        # loading, otherwise we could cache a copy that is missing that write.
+        if chat_id not in _rooms and _generation.get(chat_id, 0) == generation and room.size <= MAX_BYTES:
+            _install(chat_id, room)
+    return _snapshot(room, up_to_id)
+
+
+def get_page(chat_id, before=None, before_id=None, limit=100):
+    """
+    The newest 'limit' messages of a room that come before the keyset cursor
+    (before, before_id) = (room_message_id, ChatHistory.id) of the oldest
+    message the caller already has; no cursor means the latest page.
+    Returns (messages oldest first, has_more).
+
+    Served from the cache when the room is warm, otherwise by a keyset query
+    on the (chat_id, room_message_id) index - never by loading the whole room.
+    """
+    chat_id = int(chat_id)
+    _top_up(chat_id)
+    with _lock:
+        room = _rooms.get(chat_id)
+        if room is not None:
+            _rooms.move_to_end(chat_id)
+            room.last_access = time.monotonic()
+            _stats['hits'] += 1
+            end = len(room.messages)
+            if before is not None and before_id is not None:
+                end = bisect_left(room.messages, (int(before), int(before_id)), key=_position)
+            start = max(0, end - limit)
+            return tuple(room.messages[start:end]), start > 0
+
+    write_behind.settle(chat_id)
+    query = _messages().filter(ChatHistory.chat_id == chat_id)
+    if before is not None and before_id is not None:
+        query = query.filter(db.or_(
+            ChatHistory.room_message_id < before,
+            db.and_(ChatHistory.room_message_id == before, ChatHistory.id < before_id)
+        ))
+    rows = query.order_by(ChatHistory.room_message_id.desc(), ChatHistory.id.desc()) \
+                .limit(limit + 1).all()
+    has_more = len(rows) > limit
+    return tuple(map(Message._make, reversed(rows[:limit]))), has_more
+
+
+def newest(chat_id):
+    """
+    The room's newest message, or None - from the cache when the room is
+    warm, otherwise one row off the (chat_id, room_message_id) index.
+    """
+    chat_id = int(chat_id)
+    _top_up(chat_id)
+    with _lock:
+        room = _rooms.get(chat_id)
+        if room is not None:
+            return room.messages[-1] if room.messages else None
+    write_behind.settle(chat_id)
+    row = _messages().filter(ChatHistory.chat_id == chat_id) \
+                     .order_by(ChatHistory.room_message_id.desc(), ChatHistory.id.desc()).first()
+    return Message._make(row) if row else None
+
+
+def count_after(chat_id, after_id):
+    """
+    How many of the room's messages have ChatHistory.id > 'after_id' - a
+    bisect on the cached ids when the room is warm, otherwise a COUNT.
+    """
+    chat_id = int(chat_id)
+    _top_up(chat_id)
+    with _lock:
+        room = _rooms.get(chat_id)
+        if room is not None:
+            return len(room.messages) - bisect_right(room.messages, after_id, key=_id)
+    write_behind.settle(chat_id)
+    return db.session.query(db.func.count(ChatHistory.id)) \
+                     .filter(ChatHistory.chat_id == chat_id, ChatHistory.id > after_id).scalar()
+
+
+def get_since(chat_id, after, limit=500):
+    """
+    Messages with room_message_id > 'after' (oldest first), for clients
+    catching up after a reconnect. Returns (messages, complete); 'complete'
+    is False if there were more than 'limit' and the client should reload.
+    """
+    chat_id = int(chat_id)
+    _top_up(chat_id)
+    with _lock:
+        room = _rooms.get(chat_id)
+        if room is not None:
+            _rooms.move_to_end(chat_id)
+            room.last_access = time.monotonic()
+            _stats['hits'] += 1
+            start = len(room.messages)
+            while start > 0 and room.messages[start - 1].room_message_id > after:
+                start -= 1
+            missing = room.messages[start:]
+            return tuple(missing[:limit]), len(missing) <= limit
+
+    write_behind.settle(chat_id)
+    rows = _messages().filter(ChatHistory.chat_id == chat_id, ChatHistory.room_message_id > after) \
+                      .order_by(ChatHistory.room_message_id, ChatHistory.id).limit(limit + 1).all()
+    return tuple(map(Message._make, rows[:limit])), len(rows) <= limit
+
+
+def _last_deletion_id(chat_id):
+    return db.session.query(db.func.max(ChatDeletion.id)).filter_by(chat_id=chat_id).scalar() or 0
+
+
+def _top_up(chat_id):
+    """
+    In shared mode, pull in rows and deletions other workers committed since
+    this process last looked at a cached room.
+    """
+    if not SHARED:
+        return
+    with _lock:
+        room = _rooms.get(chat_id)
+        if room is None:
+            return
+        after = room.messages[-1].room_message_id if room.messages else 0
+        after_deletion = room.last_deletion
+
+    rows = _messages().filter(ChatHistory.chat_id == chat_id, ChatHistory.room_message_id > after) \
+                      .order_by(ChatHistory.room_message_id, ChatHistory.id).all()
+    deletions = ChatDeletion.query.filter(ChatDeletion.chat_id == chat_id, ChatDeletion.id > after_deletion) \
+                                  .order_by(ChatDeletion.id).all()
+    for row in rows:
+        add_message(Message._make(row))
+    for deletion in deletions:
+        remove_message(chat_id, deletion.message_id)
+    if deletions:
+        with _lock:
+            if _rooms.get(chat_id) is room:
+                room.last_deletion = max(room.last_deletion, deletions[-1].id)
+
+
+def _snapshot(room, up_to_id):
+    if up_to_id is None:
+        return tuple(room.messages)
+    return tuple(room.messages[:bisect_right(room.messages, up_to_id, key=_id)])
+
+
+def _install(chat_id, room):
+    global _total_bytes
+    _rooms[chat_id] = room
+    _total_bytes += room.size
+    _evict()
+
+
+def _evict():
+    """Drop idle rooms, then least recently used rooms until we are within the caps."""
+    global _total_bytes
+    cutoff = time.monotonic() - IDLE_SECONDS
+    while _rooms:
+        chat_id, room = next(iter(_rooms.items()))
+        if len(_rooms) <= MAX_ROOMS and _total_bytes <= MAX_BYTES and room.last_access >= cutoff:
+            break
+        del _rooms[chat_id]
+        _total_bytes -= room.size
+        _stats['evictions'] += 1
+
+
+def add_message(message):
+    """Record a newly committed message (a Message record, see commit_message)."""
+    global _total_bytes
+    chat_id = int(message.chat_id)
+    with _lock:
+        room = _rooms.get(chat_id)
+        if room is None:
+            _generation[chat_id] = _generation.get(chat_id, 0) + 1
+            return
+        index = bisect_left(room.messages, _position(message), key=_position)
+        if index < len(room.messages) and room.messages[index].id == message.id:
+            return  # Already have it (e.g. picked up by a top-up first)
+        room.messages.insert(index, message)  # Normally at the end
+        size = _row_size(message)
+        room.size += size
+        _total_bytes += size
+        _evict()
+
+
+def remove_message(chat_id, message_id):
+    """Forget a deleted ChatHistory row."""
+    global _total_bytes
+    chat_id = int(chat_id)
+    message_id = int(message_id)
+    with _lock:
+        room = _rooms.get(chat_id)
+        if room is None:
+            _generation[chat_id] = _generation.get(chat_id, 0) + 1
+            return
+        index = bisect_left(room.messages, message_id, key=_id)
+        if index == len(room.messages) or room.messages[index].id != message_id:
+            # Rows from before ids came from room_sequence may be out of id order
+            index = next((i for i, m in enumerate(room.messages) if m.id == message_id), None)
+        if index is not None:
+            size = _row_size(room.messages[index])
+            del room.messages[index]
+            room.size -= size
+            _total_bytes -= size
+
+
+def evict_room(chat_id):
+    """Drop a room entirely (e.g. when the chat itself is deleted)."""
+    global _total_bytes
+    chat_id = int(chat_id)
+    with _lock:
+        room = _rooms.pop(chat_id, None)
+        _generation[chat_id] = _generation.get(chat_id, 0) + 1
+        if room is not None:
+            _total_bytes -= room.size
+
+
+def commit_message(row):
+    """
+    Store a new ChatHistory row, numbering it within its room, and record it
+    in the cache. Returns its Message record, carrying the id.
+
+    Normally that is add, flush and commit: flushing first assigns the id and
+    column defaults while the row is still loaded, so caching it doesn't cost
+    an extra SELECT after the commit. With WRITE_BEHIND=1 the row is queued
+    for the next group commit instead.
+    """
+    if write_behind.ENABLED:
+        message = write_behind.persist(row)
+    else:
+        with tracing.span('db_commit'):
+            row.room_message_id = room_sequence.allocate(row.chat_id)
+            row.id = room_sequence.allocate_id()
+            db.session.add(row)
+            db.session.flush()
+            message = Message.from_row(row)
+            db.session.commit()
+        metrics.inc('messages_persisted_total', sender='ai' if message.sender_id == -1 else 'human')
+    add_message(message)
+    return message
+
+
+def cache_stats():
+    with _lock:
+        return dict(_stats, rooms=len(_rooms), bytes=_total_bytes)
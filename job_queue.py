@@ -0,0 +1,290 @@
+# job_queue.py
+"""
+Durable, SQL-backed queue of AI reply jobs.
+
+The chat_message handler only stores the human message and inserts one
+AIJob row per AI personality in the room, then returns. A single background
+poller per process claims queued jobs (an atomic UPDATE ... WHERE
+status='queued', so several processes can share the table safely) and hands
+them to ai_dispatch, which runs the plugin within the concurrency caps and
+emits the reply.
+
+Jobs left 'running' by a crashed or restarted process are put back in the
+queue once their lease (AI_JOB_LEASE_SECONDS) expires, up to
+AI_JOB_MAX_ATTEMPTS tries. Those of a process on this host that is gone
+(including this one's previous run, when a restarted container gets the
+same pid) are put back as soon as the poller starts.
+"""
+import json
+import os
+import socket
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+
+from extensions import socketio, db, plugin_module as load_plugin
+from models import AIJob, Chat, ChatHistory
+import ai_dispatch
+import history_cache
+import language_detect
+import rate_limiter
+import relevance_gate
+import summary_memory
+import tracing
+
+log = tracing.get_logger(__name__)
+
+POLL_INTERVAL = float(os.environ.get('AI_JOB_POLL_SECONDS', '1.0'))
+LEASE_SECONDS = int(os.environ.get('AI_JOB_LEASE_SECONDS', '600'))
+MAX_ATTEMPTS = int(os.environ.get('AI_JOB_MAX_ATTEMPTS', '3'))
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+_wakeup = threading.Event()
+_started = False
+_start_lock = threading.Lock()
+
+
+def enqueue_replies(chat, trigger_message, participants, sender_name, personalities):
+    """
+    Insert one queued job for every AI personality in 'participants' (except
+    the sender) that relevance_gate expects to answer. Commits, wakes the
+    poller and returns the number of jobs.
+    """
+    candidates = [name for name in participants if name in personalities and name != sender_name]
+    if not candidates:
+        return 0
+
+    # The last few turns before this message, for the gate's follow-up check
+    history = history_cache.get_history(chat.id, up_to_id=trigger_message.id)
+    recent = history[-relevance_gate.RECENT_TURNS - 1:]
+    if recent and recent[-1].id == trigger_message.id:
+        recent = recent[:-1]
+
+    jobs = [
+        AIJob(
+            chat_id=chat.id,
+            personality=name,
+            trigger_message_id=trigger_message.id,
+            participants=json.dumps(participants)
+        )
+        for name in candidates
+        if relevance_gate.should_call(personalities[name], trigger_message.message, sender_name,
+                                      participants, personalities, recent)
+    ]
+    if not jobs:
+        return 0
+
+    db.session.add_all(jobs)
+    db.session.commit()
+    _wakeup.set()
+    return len(jobs)
+
+
+def ensure_worker(app):
+    """Start this process's job poller, once."""
+    global _started
+    with _start_lock:
+        if _started:
+            return
+        _started = True
+    socketio.start_background_task(_poll_loop, app)
+
+
+def _poll_loop(app):
+    log.info("🧵 AI job worker started", worker=WORKER_ID)
+    with app.app_context():
+        requeue_orphaned()
+        requeue_stale()
+
+    while True:
+        _wakeup.wait(POLL_INTERVAL)
+        _wakeup.clear()
+        try:
+            with app.app_context():
+                requeue_stale()
+                for job_id, join_code, priority in _claim_jobs(app):
+                    ai_dispatch.submit(join_code, lambda job_id=job_id, priority=priority:
+                                       _run_job(app, job_id, priority), priority)
+        except Exception as e:
+            log.error("AI job poller error", error=str(e), exc_info=True)
+
+
+def _claim_jobs(app):
+    """
+    Claim as many queued jobs as there are free slots, skipping rooms that are
+    already at their per-room cap and personalities whose model is saturated
+    (see rate_limiter). Returns [(job_id, join_code, priority), ...].
+    """
+    free = ai_dispatch.free_slots()
+    if free <= 0:
+        return []
+
+    query = db.session.query(AIJob.id, Chat.join_code, AIJob.personality, ChatHistory.message) \
+        .join(Chat, Chat.id == AIJob.chat_id) \
+        .outerjoin(ChatHistory, ChatHistory.id == AIJob.trigger_message_id) \
+        .filter(AIJob.status == 'queued')
+    busy = ai_dispatch.busy_rooms()
+    if busy:
+        query = query.filter(Chat.join_code.notin_(busy))
+    blocked = rate_limiter.blocked_personalities(app.loaded_personalities)
+    if blocked:
+        query = query.filter(AIJob.personality.notin_(blocked))
+    candidates = query.order_by(AIJob.id).limit(free).all()
+
+    claimed = []
+    now = datetime.utcnow()
+    for job_id, join_code, personality, message in candidates:
+        updated = AIJob.query.filter_by(id=job_id, status='queued').update({
+            'status': 'running',
+            'claimed_at': now,
+            'worker': WORKER_ID,
+            'attempts': AIJob.attempts + 1,
+        }, synchronize_session=False)
+        if updated:
+            # A personality addressed by name goes ahead of general replies
+            addressed = personality in app.loaded_personalities and \
+                relevance_gate.is_addressed(app.loaded_personalities[personality], message)
+            claimed.append((job_id, join_code, rate_limiter.PRIORITY_ADDRESSED if addressed
+                            else rate_limiter.PRIORITY_NORMAL))
+    db.session.commit()
+    return claimed
+
+
+def _run_job(app, job_id, priority=rate_limiter.PRIORITY_NORMAL):
+    """Run one claimed job inside its own app context and record the outcome."""
+    with app.app_context():
+        job = db.session.get(AIJob, job_id)
+        if job is None:
+            log.info("AI job no longer exists", job=job_id)
+            return
+        chat = db.session.get(Chat, job.chat_id)
+        with tracing.bind(room=chat.join_code if chat else None, trace=tracing.trace_id(job.trigger_message_id),
+                          personality=job.personality):
+            try:
+                if chat is None or job.personality not in app.loaded_personalities:
+                    raise LookupError("chat or personality no longer exists")
+
+                # Everything up to and including the message being answered
+                with tracing.span('history_load'):
+                    history = history_cache.get_history(chat.id, up_to_id=job.trigger_message_id)
+                    trigger = history[-1] if history and history[-1].id == job.trigger_message_id \
+                        else db.session.get(ChatHistory, job.trigger_message_id)
+                    extra = {'summary': summary_memory.get_summary(chat.id)}
+
+                plugin_module = load_plugin(app.loaded_personalities[job.personality])
+                if ai_dispatch.accepts(plugin_module, 'languages'):
+                    # The room's human languages, for the translator
+                    extra['languages'] = language_detect.room_languages(chat.id, history, app.loaded_personalities)
+
+                ai_dispatch.generate_and_post(
+                    job.personality,
+                    chat.join_code,
+                    chat.id,
+                    chat.title,
+                    json.loads(job.participants or "[]"),
+                    history,
+                    trigger.message if trigger else "",
+                    priority=priority,
+                    **extra
+                )
+                _finish(job_id, 'done')
+            except Exception as e:
+                db.session.rollback()
+                _finish(job_id, 'failed', str(e))
+                raise
+
+
+def _finish(job_id, status, error=None):
+    job = db.session.get(AIJob, job_id)
+    job.status = status
+    job.error = error
+    job.finished_at = datetime.utcnow()
+    db.session.commit()
+
+    waited = (job.claimed_at - job.created_at).total_seconds()
+    ran = (job.finished_at - job.claimed_at).total_seconds()
+    log.debug("AI job finished", job=job_id, status=status, waited=round(waited, 3), ran=round(ran, 3))
+
+
+def _requeue(stale, reason):
+    """Put the jobs 'stale' selects back in the queue, or fail those out of attempts."""
+    requeued = stale.filter(AIJob.attempts < MAX_ATTEMPTS) \
+        .update({'status': 'queued', 'worker': None}, synchronize_session=False)
+    stale.filter(AIJob.attempts >= MAX_ATTEMPTS) \
+        .update({'status': 'failed', 'error': reason, 'finished_at': datetime.utcnow()},
+                synchronize_session=False)
+    db.session.commit()
+    return requeued
+
+
+def requeue_stale():
+    """
+    Put 'running' jobs whose lease has expired back in the queue (or fail them
+    once they have used up their attempts). Returns the number requeued.
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=LEASE_SECONDS)
+    return _requeue(AIJob.query.filter(AIJob.status == 'running', AIJob.claimed_at < cutoff), 'lease expired')
+
+
+def _gone(worker):
+    """
+    Is the worker (a WORKER_ID) a process on this host that no longer runs?
+    Called before this process claims anything, so its own id can only be
+    left over from an earlier process that had the same pid.
+    """
+    host, _, pid = (worker or '').rpartition(':')
+    if host != socket.gethostname() or not pid.isdigit() or os.name != 'posix':
+        return False
+    if int(pid) == os.getpid():
+        return True
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        pass  # Alive, just not ours to signal
+    return False
+
+
+def requeue_orphaned():
+    """
+    Put back 'running' jobs whose worker on this host has gone, without
+    waiting out their lease. Call at start-up. Returns the number requeued.
+    """
+    workers = [worker for (worker,) in db.session.query(AIJob.worker)
+               .filter(AIJob.status == 'running').distinct()]
+    gone = [worker for worker in workers if _gone(worker)]
+    if not gone:
+        return 0
+    requeued = _requeue(AIJob.query.filter(AIJob.status == 'running', AIJob.worker.in_(gone)), 'worker died')
+    log.warning("Requeued jobs of workers that died", workers=len(gone), jobs=requeued)
+    return requeued
+
+
+def queue_stats(sample=200):
+    """
+    Queue depth plus average wait (enqueue -> claim) and run (claim -> finish)
+    times over the most recent 'sample' finished jobs.
+    """
+    counts = dict(db.session.query(AIJob.status, func.count(AIJob.id)).group_by(AIJob.status).all())
+
+    oldest = db.session.query(func.min(AIJob.created_at)).filter(AIJob.status == 'queued').scalar()
+    recent = AIJob.query.filter(AIJob.finished_at.isnot(None), AIJob.claimed_at.isnot(None)) \
+        .order_by(AIJob.id.desc()).limit(sample).all()
+
+    waits = [(j.claimed_at - j.created_at).total_seconds() for j in recent]
+    runs = [(j.finished_at - j.claimed_at).total_seconds() for j in recent]
+
+    return {
+        'queued': counts.get('queued', 0),
+        'running': counts.get('running', 0),
+        'done': counts.get('done', 0),
+        'failed': counts.get('failed', 0),
+        'oldest_queued_seconds': (datetime.utcnow() - oldest).total_seconds() if oldest else 0.0,
+        'avg_wait_seconds': sum(waits) / len(waits) if waits else 0.0,
+        'avg_run_seconds': sum(runs) / len(runs) if runs else 0.0,
+        'local_running': ai_dispatch.running_count(),
+        'local_pending': ai_dispatch.pending_count(),
+    }
@@ -0,0 +1,274 @@
+# language_detect.py
+"""
+Fast local language detection, and the set of languages spoken in each room.
+
+Babel used to send the whole history to o3-mini on every message just so
+the model could work out which languages were in use - even in
+single-language rooms, where the answer was always "say nothing". Instead
+each human message is classified locally:
+
+  - by Unicode script for non-Latin text (Cyrillic, Greek, Arabic, Hebrew,
+    Devanagari, Thai, Hangul, kana, Han), and
+  - for Latin text, by a naive Bayes score over character trigrams, with
+    profiles built at import time from the short samples below.
+
+Short or ambiguous messages ("ok", "lol", names) come back as None rather
+than a guess. room_languages() keeps a per-room count of detected languages,
+updated incrementally from the messages it has not seen yet; a language
+joins the room's set once LANGUAGE_MIN_MESSAGES (env, default 2) human
+messages were written in it, so one misdetection doesn't make a room
+bilingual.
+"""
+import math
+import os
+import re
+import threading
+import unicodedata
+from bisect import bisect_right
+from collections import Counter, OrderedDict
+from operator import attrgetter
+
+MIN_MESSAGES = int(os.environ.get('LANGUAGE_MIN_MESSAGES', '2'))
+MIN_LETTERS = 12       # Below this a Latin-script message is too short to call
+MIN_MARGIN = 0.10      # Required lead of the best language, in log-prob per trigram
+MAX_ROOMS = 1024
+
+NAMES = {
+    'en': 'English', 'es': 'Spanish', 'fr': 'French', 'de': 'German', 'it': 'Italian',
+    'pt': 'Portuguese', 'nl': 'Dutch', 'pl': 'Polish', 'ru': 'Russian', 'uk': 'Ukrainian',
+    'el': 'Greek', 'ar': 'Arabic', 'fa': 'Persian', 'he': 'Hebrew', 'hi': 'Hindi',
+    'th': 'Thai', 'ko': 'Korean', 'ja': 'Japanese', 'zh': 'Chinese',
+}
+
+_SAMPLES = {
+    'en': """
+        The quick brown fox jumps over the lazy dog. I think we should meet tomorrow morning
+        to talk about the project and what still needs to be done before the release. Could you
+        send me the latest version of the document? It would be great if everyone could have a
+        look at it before the meeting. What do you think about the new design? I have been
+        working on this for a while and there are still a few things that are not quite right.
+        Thank you for your help, that was really useful. Where are you going this weekend?
+        We were thinking of going to the beach if the weather is nice, otherwise we will stay
+        at home and watch a film. Have you ever been there? It is one of the most beautiful
+        places that I know, and the food is wonderful. Let me know when you are ready.
+    """,
+    'es': """
+        El rápido zorro marrón salta sobre el perro perezoso. Creo que deberíamos reunirnos
+        mañana por la mañana para hablar del proyecto y de lo que todavía queda por hacer antes
+        del lanzamiento. ¿Podrías enviarme la última versión del documento? Sería genial que todos
+        pudieran echarle un vistazo antes de la reunión. ¿Qué te parece el nuevo diseño? Llevo un
+        tiempo trabajando en esto y todavía hay algunas cosas que no están del todo bien. Gracias
+        por tu ayuda, ha sido muy útil. ¿Adónde vas este fin de semana? Estábamos pensando en ir
+        a la playa si hace buen tiempo, si no nos quedaremos en casa viendo una película. ¿Has
+        estado allí alguna vez? Es uno de los lugares más bonitos que conozco y la comida es
+        maravillosa. Avísame cuando estés listo.
+    """,
+    'fr': """
+        Le renard brun rapide saute par-dessus le chien paresseux. Je pense que nous devrions nous
+        retrouver demain matin pour parler du projet et de ce qu'il reste à faire avant la sortie.
+        Pourrais-tu m'envoyer la dernière version du document ? Ce serait bien que tout le monde
+        puisse y jeter un coup d'œil avant la réunion. Qu'est-ce que tu penses du nouveau design ?
+        Je travaille là-dessus depuis un moment et il y a encore quelques choses qui ne vont pas.
+        Merci pour ton aide, c'était vraiment utile. Où est-ce que tu vas ce week-end ? Nous
+        pensions aller à la plage s'il fait beau, sinon nous resterons à la maison pour regarder
+        un film. Est-ce que tu y es déjà allé ? C'est l'un des plus beaux endroits que je connaisse
+        et la nourriture est merveilleuse. Dis-moi quand tu es prêt.
+    """,
+    'de': """
+        Der schnelle braune Fuchs springt über den faulen Hund. Ich denke, wir sollten uns morgen
+        früh treffen, um über das Projekt zu sprechen und darüber, was vor der Veröffentlichung
+        noch zu tun ist. Könntest du mir die neueste Version des Dokuments schicken? Es wäre
+        schön, wenn sich alle das vor dem Treffen ansehen könnten. Was hältst du von dem neuen
+        Design? Ich arbeite schon eine Weile daran und es gibt noch ein paar Dinge, die nicht
+        ganz stimmen. Danke für deine Hilfe, das war wirklich nützlich. Wohin fährst du dieses
+        Wochenende? Wir haben überlegt, an den Strand zu fahren, wenn das Wetter schön ist,
+        sonst bleiben wir zu Hause und schauen einen Film. Warst du schon einmal dort? Es ist
+        einer der schönsten Orte, die ich kenne, und das Essen ist wunderbar. Sag mir Bescheid,
+        wenn du fertig bist.
+    """,
+    'it': """
+        La veloce volpe marrone salta sopra il cane pigro. Penso che dovremmo vederci domani
+        mattina per parlare del progetto e di quello che resta ancora da fare prima del rilascio.
+        Potresti mandarmi l'ultima versione del documento? Sarebbe bello se tutti potessero dargli
+        un'occhiata prima della riunione. Che ne pensi del nuovo design? Ci sto lavorando da un po'
+        e ci sono ancora alcune cose che non vanno del tutto bene. Grazie per il tuo aiuto, è
+        stato davvero utile. Dove vai questo fine settimana? Stavamo pensando di andare al mare se
+        il tempo è bello, altrimenti resteremo a casa a guardare un film. Ci sei mai stato? È uno
+        dei posti più belli che conosco e il cibo è meraviglioso. Fammi sapere quando sei pronto.
+    """,
+    'pt': """
+        A rápida raposa marrom pula sobre o cão preguiçoso. Acho que deveríamos nos encontrar
+        amanhã de manhã para falar sobre o projeto e o que ainda falta fazer antes do lançamento.
+        Você poderia me enviar a versão mais recente do documento? Seria ótimo se todos pudessem
+        dar uma olhada antes da reunião. O que você acha do novo design? Estou trabalhando nisso
+        há algum tempo e ainda há algumas coisas que não estão muito certas. Obrigado pela sua
+        ajuda, foi muito útil. Para onde você vai neste fim de semana? Estávamos pensando em ir
+        à praia se o tempo estiver bom, senão vamos ficar em casa e ver um filme. Você já esteve
+        lá? É um dos lugares mais bonitos que eu conheço e a comida é maravilhosa. Avise-me quando
+        estiver pronto.
+    """,
+    'nl': """
+        De snelle bruine vos springt over de luie hond. Ik denk dat we morgenochtend moeten
+        afspreken om over het project te praten en over wat er nog moet gebeuren voor de release.
+        Kun je me de nieuwste versie van het document sturen? Het zou fijn zijn als iedereen er
+        voor de vergadering even naar kan kijken. Wat vind je van het nieuwe ontwerp? Ik werk hier
+        al een tijdje aan en er zijn nog een paar dingen die niet helemaal goed zijn. Bedankt voor
+        je hulp, dat was echt nuttig. Waar ga je dit weekend naartoe? We dachten erover om naar
+        het strand te gaan als het mooi weer is, anders blijven we thuis en kijken we een film.
+        Ben je daar ooit geweest? Het is een van de mooiste plekken die ik ken en het eten is
+        heerlijk. Laat me weten wanneer je klaar bent.
+    """,
+    'pl': """
+        Szybki brązowy lis przeskakuje nad leniwym psem. Myślę, że powinniśmy spotkać się jutro
+        rano, żeby porozmawiać o projekcie i o tym, co jeszcze trzeba zrobić przed wydaniem. Czy
+        możesz mi wysłać najnowszą wersję dokumentu? Byłoby świetnie, gdyby wszyscy mogli rzucić
+        na niego okiem przed spotkaniem. Co myślisz o nowym projekcie? Pracuję nad tym od jakiegoś
+        czasu i jest jeszcze kilka rzeczy, które nie są do końca dobre. Dziękuję za pomoc, to było
+        naprawdę przydatne. Dokąd jedziesz w ten weekend? Myśleliśmy o wyjeździe nad morze, jeśli
+        będzie ładna pogoda, a jeśli nie, zostaniemy w domu i obejrzymy film. Byłeś tam kiedyś?
+        To jedno z najpiękniejszych miejsc, jakie znam, a jedzenie jest wspaniałe. Daj mi znać,
+        kiedy będziesz gotowy.
+    """,
+}
+
+_WORD = re.compile(r"[^\W\d_]+(?:'[^\W\d_]+)?")
+
+
+def _trigrams(text):
+    for word in _WORD.findall(text.lower()):
+        padded = f" {word} "
+        for i in range(len(padded) - 2):
+            yield padded[i:i + 3]
+
+
+def _build_profiles():
+    profiles = {}
+    for code, sample in _SAMPLES.items():
+        counts = Counter(_trigrams(sample))
+        total = sum(counts.values())
+        vocabulary = len(counts) + 1
+        # Add-one smoothed log probabilities, plus the score for unseen trigrams
+        profiles[code] = ({gram: math.log((n + 1) / (total + vocabulary)) for gram, n in counts.items()},
+                          math.log(1 / (total + vocabulary)))
+    return profiles
+
+
+_PROFILES = _build_profiles()
+
+
+def _script_of(char):
+    code = ord(char)
+    if 0x0400 <= code <= 0x04FF:
+        return 'cyrillic'
+    if 0x0370 <= code <= 0x03FF:
+        return 'greek'
+    if 0x0600 <= code <= 0x06FF:
+        return 'arabic'
+    if 0x0590 <= code <= 0x05FF:
+        return 'hebrew'
+    if 0x0900 <= code <= 0x097F:
+        return 'devanagari'
+    if 0x0E00 <= code <= 0x0E7F:
+        return 'thai'
+    if 0xAC00 <= code <= 0xD7AF or 0x1100 <= code <= 0x11FF:
+        return 'hangul'
+    if 0x3040 <= code <= 0x30FF:
+        return 'kana'
+    if 0x4E00 <= code <= 0x9FFF:
+        return 'han'
+    if char.isascii() or unicodedata.name(char, '').startswith('LATIN'):
+        return 'latin'
+    return None
+
+
+def _from_script(scripts, text):
+    script, _ = scripts.most_common(1)[0]
+    if script == 'cyrillic':
+        return 'uk' if re.search(r"[іїєґІЇЄҐ]", text) else 'ru'
+    if script == 'arabic':
+        return 'fa' if re.search(r"[پچژگ]", text) else 'ar'
+    if script in ('han', 'kana'):
+        return 'ja' if scripts['kana'] else 'zh'
+    return {'greek': 'el', 'hebrew': 'he', 'devanagari': 'hi', 'thai': 'th', 'hangul': 'ko'}.get(script)
+
+
+def detect(text):
+    """The language code of 'text' (see NAMES), or None if unsure."""
+    if not text:
+        return None
+    scripts = Counter(s for s in (_script_of(c) for c in text if c.isalpha()) if s)
+    if not scripts:
+        return None
+    if scripts.most_common(1)[0][0] != 'latin':
+        return _from_script(scripts, text)
+    if scripts['latin'] < MIN_LETTERS:
+        return None
+
+    grams = list(_trigrams(text))
+    scores = []
+    for code, (logprobs, unseen) in _PROFILES.items():
+        scores.append((sum(logprobs.get(g, unseen) for g in grams) / len(grams), code))
+    scores.sort(reverse=True)
+    (best, code), (second, _) = scores[0], scores[1]
+    return code if best - second >= MIN_MARGIN else None
+
+
+def count_languages(messages, personalities=()):
+    """Counter of detected languages over the human messages in 'messages'."""
+    counts = Counter()
+    for entry in messages:
+        if entry.sender_name in personalities:
+            continue
+        language = detect(entry.message)
+        if language:
+            counts[language] += 1
+    return counts
+
+
+class _RoomLanguages:
+    __slots__ = ('through_id', 'counts')
+
+    def __init__(self):
+        self.through_id = 0
+        self.counts = Counter()
+
+
+_lock = threading.Lock()
+_rooms = OrderedDict()  # chat_id -> _RoomLanguages, least recently used first
+
+
+def room_languages(chat_id, history, personalities=()):
+    """
+    The languages spoken by humans in a room, most used first, as a list of
+    codes. 'history' is the room's messages in id order (as history_cache
+    returns them); only those newer than the last call are classified. Messages from AI personalities (e.g.
+    Babel's own translations) are ignored.
+    """
+    chat_id = int(chat_id)
+    with _lock:
+        room = _rooms.get(chat_id)
+        if room is None:
+            room = _rooms[chat_id] = _RoomLanguages()
+            while len(_rooms) > MAX_ROOMS:
+                _rooms.popitem(last=False)
+        _rooms.move_to_end(chat_id)
+        through_id = room.through_id
+
+    # 'history' is in id order, so the unseen messages are the tail after through_id
+    unseen = history[bisect_right(history, through_id, key=attrgetter('id')):]
+    new = count_languages(unseen, personalities)
+    last_id = unseen[-1].id if unseen else through_id
+
+    with _lock:
+        # Another caller may have counted the same messages meanwhile; then
+        # leave it to them and pick up any remainder next time.
+        if last_id > through_id and room.through_id == through_id:
+            room.counts.update(new)
+            room.through_id = last_id
+        return [code for code, n in room.counts.most_common() if n >= MIN_MESSAGES]
+
+
+def forget_room(chat_id):
+    """Drop a room's language counts (e.g. when the chat is deleted)."""
+    with _lock:
+        _rooms.pop(int(chat_id), None)
@@ -0,0 +1,192 @@
+# metrics.py
+"""
+Prometheus-style counters and histograms, served as text at /metrics.
+
+Instrumented code calls
+
+    metrics.inc('messages_persisted_total', sender='human')
+    metrics.observe('ai_request_seconds', 1.8, personality=name)
+
+Every thread (or greenlet) writes to its own shard of counters, so the hot
+paths never wait on a shared lock; a scrape adds the shards up. Shards of
+threads that have finished are folded into a base total, at scrape time or
+once more than FOLD_THRESHOLD shards pile up.
+
+Token usage comes from the OpenAI 'usage' field (plugins call
+record_usage), and spend is estimated from it with the plugin's
+PERSONALITY_COST - the price per million tokens, dearest of input and
+output - so it is an upper bound.
+
+Each worker process counts its own traffic; with several gunicorn workers,
+scrape each one or add the series up. Set METRICS_TOKEN to require
+"Authorization: Bearer <token>" on /metrics.
+"""
+import os
+import threading
+from bisect import bisect_left
+
+PREFIX = 'aimultichat_'
+TOKEN = os.environ.get('METRICS_TOKEN', '')
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+FOLD_THRESHOLD = 256
+
+# name -> (type, help); unlisted names are counters if they end in _total, else gauges
+METRICS = {
+    'rooms_active': ('gauge', 'Rooms with at least one participant'),
+    'participants': ('gauge', 'Participants (humans and AIs) across all rooms'),
+    'socket_events_total': ('counter', 'Socket.IO events received, by type'),
+    'socket_sessions': ('gauge', 'Socket.IO connections that have joined a room, on this worker'),
+    'presence_evictions_total': ('counter', 'Participants removed by presence GC, by reason'),
+    'messages_persisted_total': ('counter', 'Chat messages written to the database, by sender kind'),
+    'ai_requests_total': ('counter', 'Plugin calls, by personality'),
+    'ai_errors_total': ('counter', 'Plugin calls that failed or returned an error, by personality'),
+    'ai_request_seconds': ('histogram', 'Plugin call time including any streamed reply, by personality'),
+    'ai_prompt_tokens_total': ('counter', 'Prompt tokens reported by the provider, by personality'),
+    'ai_completion_tokens_total': ('counter', 'Completion tokens reported by the provider, by personality'),
+    'ai_spend_usd_total': ('counter', 'Estimated spend from PERSONALITY_COST, by personality'),
+    'span_seconds': ('histogram', 'Time spent in each traced stage (see tracing.py)'),
+}
+
+_local = threading.local()
+_lock = threading.Lock()  # Guards the shard list and the base totals, not the increments
+_shards = []              # (thread, counters, histograms)
+_base_counters = {}       # (name, labels) -> value, from finished threads
+_base_histograms = {}     # (name, labels) -> [bucket counts..., +Inf count, sum]
+_costs = {}               # personality -> PERSONALITY_COST
+
+
+def configure(personality_name, cost):
+    """Register a personality's PERSONALITY_COST for spend estimates."""
+    _costs[personality_name] = float(cost or 0)
+
+
+def _shard():
+    try:
+        return _local.shard
+    except AttributeError:
+        shard = _local.shard = ({}, {})
+        with _lock:
+            if len(_shards) >= FOLD_THRESHOLD:
+                _fold_finished()
+            _shards.append((threading.current_thread(), shard[0], shard[1]))
+        return shard
+
+
+def _key(name, labels):
+    if len(labels) > 1:
+        return name, tuple(sorted(labels.items()))
+    return name, tuple(labels.items())
+
+
+def inc(name, amount=1, **labels):
+    counters = _shard()[0]
+    key = _key(name, labels)
+    counters[key] = counters.get(key, 0) + amount
+
+
+def observe(name, value, **labels):
+    histograms = _shard()[1]
+    key = _key(name, labels)
+    histogram = histograms.get(key)
+    if histogram is None:
+        histogram = histograms[key] = [0] * (len(BUCKETS) + 2)
+    histogram[bisect_left(BUCKETS, value)] += 1
+    histogram[-1] += value
+
+
+def record_usage(personality_name, usage):
+    """Count a provider response's token usage (the OpenAI 'usage' object, or None)."""
+    if usage is None:
+        return
+    prompt = getattr(usage, 'prompt_tokens', 0) or 0
+    completion = getattr(usage, 'completion_tokens', 0) or 0
+    inc('ai_prompt_tokens_total', prompt, personality=personality_name)
+    inc('ai_completion_tokens_total', completion, personality=personality_name)
+    cost = _costs.get(personality_name)
+    if cost:
+        inc('ai_spend_usd_total', (prompt + completion) * cost / 1_000_000, personality=personality_name)
+
+
+def _merge(counters, histograms, into_counters, into_histograms):
+    for key, value in counters.items():
+        into_counters[key] = into_counters.get(key, 0) + value
+    for key, histogram in histograms.items():
+        total = into_histograms.get(key)
+        if total is None:
+            into_histograms[key] = list(histogram)
+        else:
+            for i, value in enumerate(histogram):
+                total[i] += value
+
+
+def _fold_finished():
+    """Move the shards of threads that have exited into the base totals; caller holds _lock."""
+    alive = []
+    for thread, counters, histograms in _shards:
+        if thread.is_alive():
+            alive.append((thread, counters, histograms))
+        else:
+            _merge(counters, histograms, _base_counters, _base_histograms)
+    _shards[:] = alive
+
+
+def snapshot():
+    """({(name, labels): value}, {(name, labels): histogram}) summed over every shard."""
+    with _lock:
+        _fold_finished()
+        counters, histograms = {}, {}
+        _merge(_base_counters, _base_histograms, counters, histograms)
+        for _, shard_counters, shard_histograms in _shards:
+            # copy() is atomic under the GIL, so a concurrent increment can't
+            # change the dict while we read it.
+            _merge(shard_counters.copy(), {k: list(v) for k, v in shard_histograms.copy().items()},
+                   counters, histograms)
+    return counters, histograms
+
+
+def _labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(gauges=None):
+    """
+    The Prometheus text exposition of every metric, plus 'gauges' - a dict
+    of {name: value} or {name: {labels tuple: value}} read at scrape time.
+    """
+    counters, histograms = snapshot()
+    series = {}
+    for (name, labels), value in counters.items():
+        series.setdefault(name, []).append((labels, value))
+    for name, value in (gauges or {}).items():
+        items = value.items() if isinstance(value, dict) else [((), value)]
+        series.setdefault(name, []).extend(items)
+    for (name, labels), histogram in histograms.items():
+        series.setdefault(name, [])
+
+    lines = []
+    for name in sorted(series):
+        kind, help_text = METRICS.get(name, ('counter' if name.endswith('_total') else 'gauge', name))
+        lines.append(f"# HELP {PREFIX}{name} {help_text}")
+        lines.append(f"# TYPE {PREFIX}{name} {kind}")
+        if kind == 'histogram':
+            for (hist_name, labels), histogram in sorted(histograms.items()):
+                if hist_name != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(BUCKETS + ('+Inf',), histogram[:-1]):
+                    cumulative += count
+                    lines.append(f"{PREFIX}{name}_bucket{_labels(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{PREFIX}{name}_sum{_labels(labels)} {_number(histogram[-1])}")
+                lines.append(f"{PREFIX}{name}_count{_labels(labels)} {cumulative}")
+        else:
+            for labels, value in sorted(series[name]):
+                lines.append(f"{PREFIX}{name}{_labels(labels)} {_number(value)}")
+    return "\n".join(lines) + "\n"
@@ -1,4 +1,5 @@
 from datetime import datetime
+from typing import NamedTuple, Optional
 from extensions import db
 from werkzeug.security import generate_password_hash, check_password_hash
 from sqlalchemy.dialects import mysql
@@ -42,6 +43,116 @@ class ChatHistory(db.Model):
         nullable=False
     )
 
+    # Serves per-room history loads and room_message_id range queries
+    __table_args__ = (
+        db.Index('ix_chat_history_chat_room_msg', 'chat_id', 'room_message_id'),
+    )
+
+
+class Message(NamedTuple):
+    """
+    Immutable snapshot of a ChatHistory row: what history_cache keeps and
+    plugins receive as chat_history. A plain tuple with named fields - no
+    session, identity map or attribute instrumentation - so it is small and
+    safe to read from any thread. Build one with from_row(), or straight
+    from a query on MESSAGE_COLUMNS with Message._make(row).
+    """
+    id: int
+    room_message_id: int
+    timestamp: Optional[datetime]
+    chat_id: int
+    sender_id: Optional[int]
+    sender_name: Optional[str]
+    message: str
+
+    @classmethod
+    def from_row(cls, row):
+        """Snapshot of a (flushed) ChatHistory instance."""
+        # chat_id may still be the string a caller assigned; the column is an int
+        return cls(row.id, row.room_message_id, row.timestamp, int(row.chat_id), row.sender_id,
+                   row.sender_name, row.message)
+
+
+# The ChatHistory columns in Message field order, for column-only queries
+MESSAGE_COLUMNS = tuple(getattr(ChatHistory, field) for field in Message._fields)
+
+
+class ChatSequence(db.Model):
+    """
+    Per-room counter for ChatHistory.room_message_id (see room_sequence.py).
+    """
+    __tablename__ = 'chat_sequence'
+    chat_id = db.Column(db.Integer, db.ForeignKey('chat.id'), primary_key=True)
+    last_room_message_id = db.Column(db.Integer, nullable=False, default=0)
+
+
+class IdBlock(db.Model):
+    """
+    Counter for ChatHistory.id (see room_sequence.py), so ids can be handed
+    out - one at a time, or in blocks to write_behind - before the insert.
+    """
+    __tablename__ = 'id_block'
+    name = db.Column(db.String(64), primary_key=True)  # The table the ids are for
+    last_id = db.Column(db.Integer, nullable=False, default=0)
+
+
+class ChatDeletion(db.Model):
+    """
+    Tombstone for a deleted ChatHistory row, so reconnecting clients can be
+    told which messages disappeared while they were away.
+    """
+    __tablename__ = 'chat_deletion'
+    id = db.Column(db.Integer, primary_key=True)  # Ever-increasing; clients remember the last one seen
+    chat_id = db.Column(db.Integer, db.ForeignKey('chat.id'), nullable=False)
+    message_id = db.Column(db.Integer, nullable=False)  # The deleted ChatHistory.id
+    room_message_id = db.Column(db.Integer)
+    deleted_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_chat_deletion_chat_id', 'chat_id', 'id'),
+    )
+
+
+class RoomPresence(db.Model):
+    """
+    Who is in which room, shared by every worker process when
+    PRESENCE_BACKEND=sql (see presence.py).
+    """
+    __tablename__ = 'room_presence'
+    id = db.Column(db.Integer, primary_key=True)
+    room = db.Column(db.String(36), nullable=False)  # The chat's join_code
+    name = db.Column(db.String(128), nullable=False)  # Display name or personality name
+    is_ai = db.Column(db.Boolean, default=False)
+    worker = db.Column(db.String(64))  # Process that added the entry
+    joined_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.UniqueConstraint('room', 'name', name='uq_room_presence_room_name'),
+    )
+
+
+class PresenceHolder(db.Model):
+    """
+    A worker with at least one connection in a room under a name, so a
+    human's room_presence row stays until the last worker holding it lets
+    go (PRESENCE_BACKEND=sql; see presence.py).
+    """
+    __tablename__ = 'presence_holder'
+    room = db.Column(db.String(36), primary_key=True)
+    name = db.Column(db.String(128), primary_key=True)
+    worker = db.Column(db.String(64), primary_key=True)
+    since = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+class PresenceWorker(db.Model):
+    """
+    Heartbeat of each worker process using PRESENCE_BACKEND=sql, so the
+    room_presence rows of a worker that died can be cleared (see presence.py).
+    """
+    __tablename__ = 'presence_worker'
+    worker = db.Column(db.String(64), primary_key=True)
+    seen_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
 
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -55,3 +166,43 @@ class User(db.Model):
 
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
+
+
+class AIJob(db.Model):
+    """
+    One pending/finished AI reply. The socket handler only inserts these;
+    job_queue workers claim them, run the plugin and record the timings.
+    """
+    __tablename__ = 'ai_job'
+    id = db.Column(db.Integer, primary_key=True)
+    chat_id = db.Column(db.Integer, db.ForeignKey('chat.id'), nullable=False)
+    personality = db.Column(db.String(128), nullable=False)
+    trigger_message_id = db.Column(db.Integer)  # ChatHistory.id of the message being answered
+    participants = db.Column(db.Text)  # JSON list of room participants at enqueue time
+    status = db.Column(db.String(16), nullable=False, default='queued')  # queued/running/done/failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    worker = db.Column(db.String(64))  # Which process claimed the job
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    claimed_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.Index('ix_ai_job_status_id', 'status', 'id'),
+    )
+
+
+class ChatSummary(db.Model):
+    """
+    Rolling summary of a room's older messages, so long rooms can send a
+    compact prefix instead of their whole history (see summary_memory.py).
+    """
+    __tablename__ = 'chat_summary'
+    chat_id = db.Column(db.Integer, db.ForeignKey('chat.id'), primary_key=True)
+    summary = db.Column(
+        db.Text().with_variant(mysql.TEXT(collation='utf8mb4_unicode_ci'), 'mysql'),
+        nullable=False
+    )
+    through_message_id = db.Column(db.Integer, nullable=False)  # Last ChatHistory.id folded in
+    message_count = db.Column(db.Integer, default=0)  # How many messages the summary covers
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -0,0 +1,150 @@
+# openai_client.py
+"""
+One shared OpenAI client for every plugin.
+
+Each plugin used to build its own openai.Client at import time, so every
+personality had a separate connection pool with the SDK's default 5 second
+keep-alive - a room that went quiet for a few seconds paid a fresh TCP + TLS
+handshake on its next reply, per plugin. Plugins now call get_client(),
+which returns a single lazily-built client with a tuned keep-alive pool:
+
+    OPENAI_MAX_CONNECTIONS     (env, default 20)   pool size
+    OPENAI_MAX_KEEPALIVE       (env, default 10)   idle connections kept open
+    OPENAI_KEEPALIVE_SECONDS   (env, default 60)   how long an idle connection is kept
+    OPENAI_CONNECT_TIMEOUT     (env, default 5)    seconds
+    OPENAI_READ_TIMEOUT        (env, default 300)  seconds between bytes (o1 thinks for a while)
+    OPENAI_MAX_RETRIES         (env, default 2)
+
+The client is thread-safe. Under the gevent gunicorn worker the sockets are
+monkey-patched, so the same client yields to other greenlets while it waits;
+get_async_client() is the asyncio equivalent for code running in an event loop.
+
+Building the client lazily also means plugins load without CHATGPTAPIKEY set;
+the missing key is reported on the first call instead.
+"""
+import os
+import threading
+import time
+from collections import deque
+
+import openai
+
+try:
+    import httpx2 as httpx  # What current openai releases are built on
+except ImportError:
+    import httpx
+
+MAX_CONNECTIONS = int(os.environ.get('OPENAI_MAX_CONNECTIONS', '20'))
+MAX_KEEPALIVE = int(os.environ.get('OPENAI_MAX_KEEPALIVE', '10'))
+KEEPALIVE_SECONDS = float(os.environ.get('OPENAI_KEEPALIVE_SECONDS', '60'))
+CONNECT_TIMEOUT = float(os.environ.get('OPENAI_CONNECT_TIMEOUT', '5'))
+READ_TIMEOUT = float(os.environ.get('OPENAI_READ_TIMEOUT', '300'))
+MAX_RETRIES = int(os.environ.get('OPENAI_MAX_RETRIES', '2'))
+
+_lock = threading.Lock()
+_client = None
+_async_client = None
+
+# Time to response headers (first byte) of recent provider calls
+_latencies = deque(maxlen=1000)
+_stats = {'requests': 0, 'errors': 0}
+
+
+def _limits(keepalive_seconds):
+    return httpx.Limits(
+        max_connections=MAX_CONNECTIONS,
+        max_keepalive_connections=MAX_KEEPALIVE,
+        keepalive_expiry=keepalive_seconds
+    )
+
+
+def _timeout():
+    return httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT)
+
+
+def _on_request(request):
+    request.extensions['aimultichat_start'] = time.perf_counter()
+
+
+def _on_response(response):
+    start = response.request.extensions.get('aimultichat_start')
+    with _lock:
+        _stats['requests'] += 1
+        if response.status_code >= 400:
+            _stats['errors'] += 1
+        if start is not None:
+            _latencies.append(time.perf_counter() - start)
+
+
+async def _on_request_async(request):
+    _on_request(request)
+
+
+async def _on_response_async(response):
+    _on_response(response)
+
+
+def create_client(api_key=None, base_url=None, keepalive_seconds=None, verify=True):
+    """
+    Build a new pooled client. Plugins should use get_client(); this is for
+    callers that need their own (tests, benchmarks, a different endpoint).
+    """
+    http_client = openai.DefaultHttpxClient(
+        limits=_limits(KEEPALIVE_SECONDS if keepalive_seconds is None else keepalive_seconds),
+        timeout=_timeout(),
+        verify=verify,
+        event_hooks={'request': [_on_request], 'response': [_on_response]}
+    )
+    return openai.OpenAI(
+        api_key=api_key or os.environ.get("CHATGPTAPIKEY"),
+        base_url=base_url,
+        max_retries=MAX_RETRIES,
+        http_client=http_client
+    )
+
+
+def get_client():
+    """The shared client, built on first use."""
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = create_client()
+    return _client
+
+
+def get_async_client():
+    """
+    The shared asyncio client, built on first use. Like any httpx async
+    client it must only be used from one event loop.
+    """
+    global _async_client
+    if _async_client is None:
+        with _lock:
+            if _async_client is None:
+                http_client = openai.DefaultAsyncHttpxClient(
+                    limits=_limits(KEEPALIVE_SECONDS),
+                    timeout=_timeout(),
+                    event_hooks={'request': [_on_request_async], 'response': [_on_response_async]}
+                )
+                _async_client = openai.AsyncOpenAI(
+                    api_key=os.environ.get("CHATGPTAPIKEY"),
+                    max_retries=MAX_RETRIES,
+                    http_client=http_client
+                )
+    return _async_client
+
+
+def client_stats():
+    """Provider call counts and time-to-first-byte percentiles (ms)."""
+    with _lock:
+        samples = sorted(_latencies)
+        stats = dict(_stats)
+
+    def percentile(p):
+        if not samples:
+            return None
+        return round(samples[min(len(samples) - 1, int(len(samples) * p))] * 1000, 1)
+
+    stats.update(p50_ms=percentile(0.5), p95_ms=percentile(0.95))
+    return stats
@@ -0,0 +1,143 @@
+# page_cache.py
+"""
+Cached pieces of the index and chat pages, and HTTP validators for them.
+
+The index page used to read README.md and run it through markdown with
+codehilite (Pygments) on every request, and both pages re-sorted the
+personality registry. Now:
+
+  - the README HTML is rendered once and re-rendered only when the file's
+    mtime changes;
+  - the sorted personality lists are computed once per registry, i.e.
+    again only after extensions.reload_personalities swaps it;
+  - pages carry a weak ETag built from what they are rendered from (README
+    and registry versions, the chat's newest message and deletion, and the
+    session's user), plus Last-Modified, so a repeat visit with
+    If-None-Match gets a 304 without rendering the template.
+
+Pages are marked 'Cache-Control: private, no-cache': browsers keep them but
+revalidate every time. If-Modified-Since alone is only honoured for
+anonymous visitors, since Last-Modified can't see a login. A page with
+pending flash messages is never cached.
+"""
+import hashlib
+import os
+import threading
+from datetime import datetime, timezone
+
+import markdown
+from flask import make_response, request, session
+
+README_PATH = "README.md"
+README_FALLBACK = "# Welcome to AIMultiChat\n*(No README.md found.)*"
+TEMPLATE_DIR = os.path.join(os.path.dirname(__file__), 'templates')
+
+_lock = threading.Lock()
+_readme = {'mtime': None, 'html': None}
+_registry = {'source': None, 'records': None, 'names': None, 'version': None, 'modified': None}
+
+
+def _templates_version():
+    """Newest template mtime, so a deploy with new templates changes every ETag."""
+    newest = 0.0
+    for folder, _, files in os.walk(TEMPLATE_DIR):
+        for name in files:
+            newest = max(newest, os.path.getmtime(os.path.join(folder, name)))
+    return newest
+
+
+TEMPLATES_VERSION = _templates_version()
+
+
+def readme_html():
+    """(html, mtime) of README.md, re-rendered only when the file changes."""
+    try:
+        mtime = os.path.getmtime(README_PATH)
+    except OSError:
+        mtime = 0.0
+    with _lock:
+        if _readme['mtime'] == mtime and _readme['html'] is not None:
+            return _readme['html'], mtime
+
+    try:
+        with open(README_PATH, "r", encoding="utf-8") as f:
+            readme_md = f.read()
+    except FileNotFoundError:
+        readme_md = README_FALLBACK
+
+    html = markdown.markdown(
+        readme_md,
+        extensions=["fenced_code", "codehilite"],
+        extension_configs={
+            "codehilite": {
+                "css_class": "highlight",
+                "linenums": False
+            }
+        }
+    )
+    with _lock:
+        _readme['mtime'], _readme['html'] = mtime, html
+    return html, mtime
+
+
+def personalities(registry):
+    """
+    (records sorted by name, names sorted case-insensitively, version,
+    modified) for app.loaded_personalities, recomputed when it is replaced.
+    'version' fingerprints what the pages show, so it is the same in every
+    worker; 'modified' is the newest plugin file's mtime.
+    """
+    with _lock:
+        if _registry['source'] is not registry:
+            records = sorted(registry.values(), key=lambda p: p["name"].lower())
+            shown = [(p["name"], p["desc"], p["intelligence"], p["cost"]) for p in records]
+            _registry['records'] = records
+            _registry['names'] = sorted(registry.keys(), key=str.lower)
+            _registry['version'] = hashlib.sha1(repr(shown).encode('utf-8')).hexdigest()[:12]
+            _registry['modified'] = as_datetime(max((p.get("mtime") or 0 for p in records), default=0))
+            _registry['source'] = registry
+        return _registry['records'], _registry['names'], _registry['version'], _registry['modified']
+
+
+def etag(*parts):
+    """A validator for a page rendered from 'parts' and the session's user."""
+    viewer = (session.get('user_id'), session.get('username'), bool(session.get('is_admin')))
+    return hashlib.sha1(repr((TEMPLATES_VERSION,) + parts + viewer).encode('utf-8')).hexdigest()[:20]
+
+
+def cacheable():
+    """False while flash messages are waiting to be shown."""
+    return not session.get('_flashes')
+
+
+def not_modified(tag, last_modified):
+    """True if the request's validators show the client already has this page."""
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(tag)
+    if request.if_modified_since and last_modified and 'user_id' not in session and not session.get('is_admin'):
+        return last_modified.replace(microsecond=0) <= request.if_modified_since
+    return False
+
+
+def as_datetime(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc) if timestamp else None
+
+
+def conditional(response, tag, last_modified):
+    """Attach the validators and caching headers to a rendered page."""
+    response.set_etag(tag, weak=True)
+    if last_modified:
+        response.last_modified = last_modified
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Cookie')
+    return response
+
+
+def not_modified_response(tag, last_modified):
+    return conditional(make_response('', 304), tag, last_modified)
+
+
+def latest(*timestamps):
+    """The newest of several datetimes (None entries ignored)."""
+    present = [t for t in timestamps if t is not None]
+    return max(present) if present else None
@@ -1,8 +1,17 @@
+import response_cache
+import tracing
+
+log = tracing.get_logger(__name__)
+
 PERSONALITY_NAME = "Echo Bot"
 PERSONALITY_DESC = "This is a test AI that just mirrors input"
 PERSONALITY_INTELLIGENCE = 0
 # price per million tokens use the dearest of input and output!
 PERSONALITY_COST = 0
+# Echoes everything, so skip the relevance gate
+RELEVANCE_POLICY = "always"
+# Exercises response_cache without a provider
+RESPONSE_CACHE_TTL = 3600
 
 BASE_SYSTEM_PROMPT = """
 You are in a multi-person chat. Each message shows the sender name.
@@ -19,21 +28,13 @@ def generate_response(chat_title, participants, chat_history, new_message):
 
     :param chat_title:       The name/title of the chat
     :param participants:     The list of participant names
-    :param chat_history:     A list of message objects from the DB
+    :param chat_history:     models.Message records (immutable), oldest first
     :param new_message:      The latest user message that triggered the AI
     :return:                 Echoes the new_message as the response
     """
 
-    # Debug: print out details about the chat context
-    print("\n===== Dummy Plugin Debug =====")
-    print(f"Chat Title: {chat_title}")
-    print(f"Participants: {participants}")
-    print(f"History Count: {len(chat_history)}")
-    for entry in chat_history:
-        print(f"  HISTORY => {entry.sender_name}: {entry.message}")
-    print(f"Latest User Message: {new_message}")
-    print("===== End Dummy Plugin Debug =====\n")
+    tracing.dump_history(log, PERSONALITY_NAME, chat_title, participants, chat_history, new_message)
 
     # In a real plugin, we'd incorporate chat_history & new_message
     # into an AI call. For this dummy, we ignore everything and just echo back:
-    return new_message
+    return response_cache.cached(PERSONALITY_NAME, "echo", [new_message], lambda: new_message)
@@ -1,16 +1,24 @@
-import os
-import openai
+import context_builder
+import metrics
+import openai_client
+import response_cache
+import tracing
+
+log = tracing.get_logger(__name__)
 
 PERSONALITY_NAME = "Hermione (ChatGPT 4.5 Preview)"
 PERSONALITY_DESC = "This is a research preview of GPT-4.5, our largest and most capable GPT model yet. Its deep world knowledge and better understanding of user intent makes it good at creative tasks and agentic planning. GPT-4.5 excels at tasks that benefit from creative, open-ended thinking and conversation, such as writing, learning, or exploring new ideas."
 PERSONALITY_INTELLIGENCE = 4
 # price per million tokens use the dearest of input and output!
 PERSONALITY_COST = 150
+# Provider limits for rate_limiter (shared by every personality on this model)
+PERSONALITY_MODEL = "gpt-4.5-preview"
+PERSONALITY_RPM = 500
+PERSONALITY_TPM = 125000
 PERSONALITY_WINDOW = 128000
 PERSONALITY_MAXOUT = 16384
-
-# Create the OpenAI client using the new interface
-client = openai.Client(api_key=os.environ.get("CHATGPTAPIKEY"))
+# Cap sent with each reply; PERSONALITY_MAXOUT is only the room the prompt leaves for it
+PERSONALITY_MAX_REPLY = 2000
 
 BASE_SYSTEM_PROMPT = """
 You are in a multi-person chat. Each message shows the sender name.
@@ -21,26 +29,19 @@ You are in a multi-person chat. Each message shows the sender name.
 - If no one is asking for your input, or the question doesn’t concern you, remain silent or respond minimally.
 """
 
-def generate_response(chat_title, participants, chat_history, new_message):
+def generate_response(chat_title, participants, chat_history, new_message, summary=None):
     """
     Generate a response from 'o1-mini' model based on:
       - chat_title       (str)  : The name/title of the chat
       - participants     (list) : The list of participant names
-      - chat_history     (list) : A list of message objects from the DB
+      - chat_history     (tuple): models.Message records (immutable), oldest first
       - new_message      (str)  : The latest user message that triggered the AI
+      - summary          (obj)  : Optional rolling summary of older messages, or None
 
-    :return: The AI's response as a string (or empty if it chooses to remain silent).
+    :return: A generator of response text chunks, or an error/empty string.
     """
 
-    # Debug output
-    print("\n===== Plugin Debug (No numbering) =====")
-    print(f"Chat Title: {chat_title}")
-    print(f"Participants: {participants}")
-    print(f"History Count: {len(chat_history)}")
-    for entry in chat_history:
-        print(f"  HISTORY => {entry.sender_name}: {entry.message}")
-    print(f"Latest User Message: {new_message}")
-    print("===== End Plugin Debug =====\n")
+    tracing.dump_history(log, PERSONALITY_NAME, chat_title, participants, chat_history, new_message)
 
     # Merge the base system prompt with the chat’s title/participants
     combined_system_prompt = (
@@ -56,35 +57,48 @@ def generate_response(chat_title, participants, chat_history, new_message):
     if model_name == "gpt-4.5-preview":
         first_message_role = "user"
 
-    # Build the messages array
-    messages = [
-        {"role": first_message_role, "content": combined_system_prompt.strip()}
-    ]
-
-    # Add each entry from chat_history
-    for entry in chat_history:
-        # "assistant" if entry.sender_name == PERSONALITY_NAME, else "user"
-        role = "assistant" if entry.sender_name == PERSONALITY_NAME else "user"
-        formatted_message = f"{entry.sender_name}: {entry.message}"
-        messages.append({"role": role, "content": formatted_message})
+    # Build the messages array, trimming the oldest history to fit our window
+    messages, _ = context_builder.build_messages(
+        PERSONALITY_NAME,
+        combined_system_prompt,
+        chat_history,
+        new_message,
+        window=PERSONALITY_WINDOW,
+        maxout=PERSONALITY_MAXOUT,
+        summary=summary,
+        system_role=first_message_role
+    )
 
-    # Finally add the new user message
-    messages.append({"role": "user", "content": new_message})
+    def request():
+        try:
+            response = openai_client.get_client().chat.completions.create(
+                model=model_name,
+                messages=messages,
+                max_completion_tokens=PERSONALITY_MAX_REPLY,
+                stream=True,
+                stream_options={"include_usage": True}  # Token counts for /metrics
+            )
+        except Exception as e:
+            return f"Error: {str(e)}"
 
-    try:
-        # Use the 'o1' model, which doesn't allow system role
-        response = client.chat.completions.create(
-            model=model_name,
-            messages=messages,
-            max_completion_tokens=2000
-        )
+        # Hand the text back chunk by chunk; the caller relays each chunk to the
+        # room as it arrives and stores the final reply once the stream ends.
+        return _stream_reply(response)
 
-        ai_reply = response.choices[0].message.content.strip()
+    # Identical requests are answered from the cache if RESPONSE_CACHE_TTL is set
+    return response_cache.cached(PERSONALITY_NAME, model_name, messages, request,
+                                 params={"max_completion_tokens": PERSONALITY_MAX_REPLY})
 
-        # Filter out non-essential responses
-        if not ai_reply or ai_reply.lower() in ["", "i'm not sure", "i don't know"]:
-            return ""
-        return ai_reply
 
+def _stream_reply(response):
+    """
+    Yield the text deltas of a streamed chat completion.
+    """
+    try:
+        for chunk in response:
+            if chunk.usage:
+                metrics.record_usage(PERSONALITY_NAME, chunk.usage)
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
     except Exception as e:
-        return f"Error: {str(e)}"
+        yield f"\nError: {str(e)}"
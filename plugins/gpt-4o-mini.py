@@ -1,16 +1,26 @@
-import os
-import openai
+import context_builder
+import metrics
+import openai_client
+import response_cache
+import tracing
+
+log = tracing.get_logger(__name__)
 
 PERSONALITY_NAME = "Cassie (ChatGPT 4o Mini)"
 PERSONALITY_DESC = "GPT-4o mini (“o” for “omni”) is a fast, affordable small model for focused tasks. It accepts both text and image inputs, and produces text outputs (including Structured Outputs). It is ideal for fine-tuning, and model outputs from a larger model like GPT-4o can be distilled to GPT-4o-mini to produce similar results at lower cost and latency."
 PERSONALITY_INTELLIGENCE = 2
 # price per million tokens use the dearest of input and output!
 PERSONALITY_COST = 0.6
+# Provider limits for rate_limiter (shared by every personality on this model)
+PERSONALITY_MODEL = "gpt-4o-mini"
+PERSONALITY_RPM = 500
+PERSONALITY_TPM = 200000
 PERSONALITY_WINDOW = 128000
 PERSONALITY_MAXOUT = 16384
-
-# Create the OpenAI client using the new interface
-client = openai.Client(api_key=os.environ.get("CHATGPTAPIKEY"))
+# Cap sent with each reply; PERSONALITY_MAXOUT is only the room the prompt leaves for it
+PERSONALITY_MAX_REPLY = 300
+# Chat replies aren't cached; identical summary requests (retries) are, for an hour
+SUMMARY_CACHE_TTL = 3600
 
 BASE_SYSTEM_PROMPT = """
 You are in a multi-person chat. Each message shows the sender name.
@@ -22,26 +32,19 @@ You are in a multi-person chat. Each message shows the sender name.
 """
 
 
-def generate_response(chat_title, participants, chat_history, new_message):
+def generate_response(chat_title, participants, chat_history, new_message, summary=None):
     """
     Generate a response from ChatGPT based on:
       - chat_title       (str)  : The name/title of the chat
       - participants     (list) : The list of participant names
-      - chat_history     (list) : A list of message objects from the DB
+      - chat_history     (tuple): models.Message records (immutable), oldest first
       - new_message      (str)  : The latest user message that triggered the AI
+      - summary          (obj)  : Optional rolling summary of older messages, or None
 
-    :return: The AI's response as a string (or empty if it chooses to remain silent).
+    :return: A generator of response text chunks, or an error/empty string.
     """
 
-    # Print a debug line to show the updated formatting
-    print("\n===== Plugin Debug (No numbering) =====")
-    print(f"Chat Title: {chat_title}")
-    print(f"Participants: {participants}")
-    print(f"History Count: {len(chat_history)}")
-    for entry in chat_history:
-        print(f"  HISTORY => {entry.sender_name}: {entry.message}")
-    print(f"Latest User Message: {new_message}")
-    print("===== End Plugin Debug =====\n")
+    tracing.dump_history(log, PERSONALITY_NAME, chat_title, participants, chat_history, new_message)
 
     # Merge the base system prompt with the chat’s title/participants
     combined_system_prompt = (
@@ -51,34 +54,87 @@ def generate_response(chat_title, participants, chat_history, new_message):
         + f"IMPORTANT: Your assigned name for this chat is '{PERSONALITY_NAME}'. If someone asks your name or references you, reply with that exact name.\n"
     )
 
-    # Start building the messages array
-    messages = [
-        {"role": "system", "content": combined_system_prompt.strip()}
-    ]
+    # Build the messages array, trimming the oldest history to fit our window
+    messages, _ = context_builder.build_messages(
+        PERSONALITY_NAME,
+        combined_system_prompt,
+        chat_history,
+        new_message,
+        window=PERSONALITY_WINDOW,
+        maxout=PERSONALITY_MAXOUT,
+        summary=summary,
+        system_role="system"
+    )
 
-    # Add each entry from chat_history
-    for entry in chat_history:
-        # "assistant" if entry.sender_name matches PERSONALITY_NAME, else "user"
-        role = "assistant" if entry.sender_name == PERSONALITY_NAME else "user"
-        formatted_message = f"{entry.sender_name}: {entry.message}"
-        messages.append({"role": role, "content": formatted_message})
+    def request():
+        try:
+            response = openai_client.get_client().chat.completions.create(
+                model="gpt-4o-mini",
+                messages=messages,
+                max_completion_tokens=PERSONALITY_MAX_REPLY,
+                stream=True,
+                stream_options={"include_usage": True}  # Token counts for /metrics
+            )
+        except Exception as e:
+            return f"Error: {str(e)}"
 
-    # Finally add the new user message
-    messages.append({"role": "user", "content": new_message})
+        # Hand the text back chunk by chunk; the caller relays each chunk to the
+        # room as it arrives and stores the final reply once the stream ends.
+        return _stream_reply(response)
 
+    # Identical requests are answered from the cache if RESPONSE_CACHE_TTL is set
+    return response_cache.cached(PERSONALITY_NAME, "gpt-4o-mini", messages, request,
+                                 params={"max_completion_tokens": PERSONALITY_MAX_REPLY})
+
+
+def _stream_reply(response):
+    """
+    Yield the text deltas of a streamed chat completion.
+    """
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=messages,
-            max_tokens=300
-        )
+        for chunk in response:
+            if chunk.usage:
+                metrics.record_usage(PERSONALITY_NAME, chunk.usage)
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    except Exception as e:
+        yield f"\nError: {str(e)}"
 
-        ai_reply = response.choices[0].message.content.strip()
 
-        # Filter out non-essential responses
-        if not ai_reply or ai_reply.lower() in ["", "i'm not sure", "i don't know"]:
-            return ""
-        return ai_reply
+SUMMARY_SYSTEM_PROMPT = """
+You maintain a running summary of a multi-person chat. Each message shows the sender name.
+Merge the new messages into the existing summary. Keep who said what, decisions, open questions,
+names and facts that later messages may refer to. Be concise and factual; write plain prose, no preamble.
+"""
 
-    except Exception as e:
-        return f"Error: {str(e)}"
+def summarize(previous_summary, messages):
+    """
+    Fold 'messages' (oldest first) into 'previous_summary' and return the new
+    summary text. Used by summary_memory as the room's cheap summariser.
+    """
+    transcript = "\n".join(f"{entry.sender_name}: {entry.message}" for entry in messages)
+    prompt = (
+        f"Existing summary:\n{previous_summary or '(none yet)'}\n\n"
+        f"New messages:\n{transcript}"
+    )
+
+    messages = [
+        {"role": "system", "content": SUMMARY_SYSTEM_PROMPT.strip()},
+        {"role": "user", "content": prompt}
+    ]
+
+    def request():
+        try:
+            response = openai_client.get_client().chat.completions.create(
+                model="gpt-4o-mini",
+                messages=messages,
+                max_completion_tokens=1000
+            )
+            metrics.record_usage(PERSONALITY_NAME, response.usage)
+            return response.choices[0].message.content.strip()
+
+        except Exception as e:
+            return f"Error: {str(e)}"
+
+    return response_cache.cached(PERSONALITY_NAME, "gpt-4o-mini", messages, request,
+                                 params={"max_completion_tokens": 1000}, ttl=SUMMARY_CACHE_TTL)
@@ -1,17 +1,24 @@
-import os
-import openai
+import context_builder
+import metrics
+import openai_client
+import response_cache
+import tracing
+
+log = tracing.get_logger(__name__)
 
 PERSONALITY_NAME = "Francesca (ChatGPT o1)"
 PERSONALITY_DESC = "The o1 series of models are trained with reinforcement learning to perform complex reasoning. o1 models think before they answer, producing a long internal chain of thought before responding to the user."
 PERSONALITY_INTELLIGENCE = 8
 # price per million tokens use the dearest of input and output!
 PERSONALITY_COST = 60
+# Provider limits for rate_limiter (shared by every personality on this model)
+PERSONALITY_MODEL = "o1"
+PERSONALITY_RPM = 500
+PERSONALITY_TPM = 30000
 PERSONALITY_WINDOW = 200000
 PERSONALITY_MAXOUT = 100000
-
-# Create the OpenAI client using the new interface
-client = openai.Client(api_key=os.environ.get("CHATGPTAPIKEY"))
-
+# Cap sent with each reply; PERSONALITY_MAXOUT is only the room the prompt leaves for it
+PERSONALITY_MAX_REPLY = 2000
 
 BASE_SYSTEM_PROMPT = """
 You are in a multi-person chat. Each message shows the sender name.
@@ -23,26 +30,19 @@ You are in a multi-person chat. Each message shows the sender name.
 """
 
 
-def generate_response(chat_title, participants, chat_history, new_message):
+def generate_response(chat_title, participants, chat_history, new_message, summary=None):
     """
     Generate a response from ChatGPT based on:
       - chat_title       (str)  : The name/title of the chat
       - participants     (list) : The list of participant names
-      - chat_history     (list) : A list of message objects from the DB
+      - chat_history     (tuple): models.Message records (immutable), oldest first
       - new_message      (str)  : The latest user message that triggered the AI
+      - summary          (obj)  : Optional rolling summary of older messages, or None
 
     :return: The AI's response as a string (or empty if it chooses to remain silent).
     """
 
-    # Print a debug line to show the updated formatting
-    print("\n===== Plugin Debug (No numbering) =====")
-    print(f"Chat Title: {chat_title}")
-    print(f"Participants: {participants}")
-    print(f"History Count: {len(chat_history)}")
-    for entry in chat_history:
-        print(f"  HISTORY => {entry.sender_name}: {entry.message}")
-    print(f"Latest User Message: {new_message}")
-    print("===== End Plugin Debug =====\n")
+    tracing.dump_history(log, PERSONALITY_NAME, chat_title, participants, chat_history, new_message)
 
     # Merge the base system prompt with the chat’s title/participants
     combined_system_prompt = (
@@ -52,34 +52,38 @@ def generate_response(chat_title, participants, chat_history, new_message):
         + f"IMPORTANT: Your assigned name for this chat is '{PERSONALITY_NAME}'. If someone asks your name or references you, reply with that exact name.\n"
     )
 
-    # Start building the messages array
-    messages = [
-        {"role": "system", "content": combined_system_prompt.strip()}
-    ]
-
-    # Add each entry from chat_history
-    for entry in chat_history:
-        # "assistant" if entry.sender_name matches PERSONALITY_NAME, else "user"
-        role = "assistant" if entry.sender_name == PERSONALITY_NAME else "user"
-        formatted_message = f"{entry.sender_name}: {entry.message}"
-        messages.append({"role": role, "content": formatted_message})
-
-    # Finally add the new user message
-    messages.append({"role": "user", "content": new_message})
-
-    try:
-        response = client.chat.completions.create(
-            model="o1",
-            messages=messages,
-            max_completion_tokens=2000
-        )
-
-        ai_reply = response.choices[0].message.content.strip()
-
-        # Filter out non-essential responses
-        if not ai_reply or ai_reply.lower() in ["", "i'm not sure", "i don't know"]:
-            return ""
-        return ai_reply
-
-    except Exception as e:
-        return f"Error: {str(e)}"
+    # Build the messages array, trimming the oldest history to fit our window
+    messages, _ = context_builder.build_messages(
+        PERSONALITY_NAME,
+        combined_system_prompt,
+        chat_history,
+        new_message,
+        window=PERSONALITY_WINDOW,
+        maxout=PERSONALITY_MAXOUT,
+        summary=summary,
+        system_role="system"
+    )
+
+    def request():
+        try:
+            response = openai_client.get_client().chat.completions.create(
+                model="o1",
+                messages=messages,
+                max_completion_tokens=PERSONALITY_MAX_REPLY
+            )
+
+            metrics.record_usage(PERSONALITY_NAME, response.usage)
+
+            ai_reply = response.choices[0].message.content.strip()
+
+            # Filter out non-essential responses
+            if not ai_reply or ai_reply.lower() in ["", "i'm not sure", "i don't know"]:
+                return ""
+            return ai_reply
+
+        except Exception as e:
+            return f"Error: {str(e)}"
+
+    # Identical requests are answered from the cache if RESPONSE_CACHE_TTL is set
+    return response_cache.cached(PERSONALITY_NAME, "o1", messages, request,
+                                 params={"max_completion_tokens": PERSONALITY_MAX_REPLY})
@@ -1,16 +1,24 @@
-import os
-import openai
+import context_builder
+import metrics
+import openai_client
+import response_cache
+import tracing
+
+log = tracing.get_logger(__name__)
 
 PERSONALITY_NAME = "Gwynn (ChatGPT o3-mini)"
 PERSONALITY_DESC = "o3-mini is our newest small reasoning model, providing high intelligence at the same cost and latency targets of o1-mini. o3-mini supports key developer features, like Structured Outputs, function calling, and Batch API."
 PERSONALITY_INTELLIGENCE = 8
 # price per million tokens use the dearest of input and output!
 PERSONALITY_COST = 4.4
+# Provider limits for rate_limiter (shared by every personality on this model)
+PERSONALITY_MODEL = "o3-mini"
+PERSONALITY_RPM = 1000
+PERSONALITY_TPM = 100000
 PERSONALITY_WINDOW = 200000
 PERSONALITY_MAXOUT = 100000
-
-# Create the OpenAI client using the new interface
-client = openai.Client(api_key=os.environ.get("CHATGPTAPIKEY"))
+# Cap sent with each reply; PERSONALITY_MAXOUT is only the room the prompt leaves for it
+PERSONALITY_MAX_REPLY = 2000
 
 BASE_SYSTEM_PROMPT = """
 You are in a multi-person chat. Each message shows the sender name.
@@ -21,26 +29,19 @@ You are in a multi-person chat. Each message shows the sender name.
 - If no one is asking for your input, or the question doesn’t concern you, remain silent or respond minimally.
 """
 
-def generate_response(chat_title, participants, chat_history, new_message):
+def generate_response(chat_title, participants, chat_history, new_message, summary=None):
     """
     Generate a response from 'o1-mini' model based on:
       - chat_title       (str)  : The name/title of the chat
       - participants     (list) : The list of participant names
-      - chat_history     (list) : A list of message objects from the DB
+      - chat_history     (tuple): models.Message records (immutable), oldest first
       - new_message      (str)  : The latest user message that triggered the AI
+      - summary          (obj)  : Optional rolling summary of older messages, or None
 
     :return: The AI's response as a string (or empty if it chooses to remain silent).
     """
 
-    # Debug output
-    print("\n===== Plugin Debug (No numbering) =====")
-    print(f"Chat Title: {chat_title}")
-    print(f"Participants: {participants}")
-    print(f"History Count: {len(chat_history)}")
-    for entry in chat_history:
-        print(f"  HISTORY => {entry.sender_name}: {entry.message}")
-    print(f"Latest User Message: {new_message}")
-    print("===== End Plugin Debug =====\n")
+    tracing.dump_history(log, PERSONALITY_NAME, chat_title, participants, chat_history, new_message)
 
     # Merge the base system prompt with the chat’s title/participants
     combined_system_prompt = (
@@ -56,35 +57,39 @@ def generate_response(chat_title, participants, chat_history, new_message):
     if model_name == "o3-mini":
         first_message_role = "user"
 
-    # Build the messages array
-    messages = [
-        {"role": first_message_role, "content": combined_system_prompt.strip()}
-    ]
-
-    # Add each entry from chat_history
-    for entry in chat_history:
-        # "assistant" if entry.sender_name == PERSONALITY_NAME, else "user"
-        role = "assistant" if entry.sender_name == PERSONALITY_NAME else "user"
-        formatted_message = f"{entry.sender_name}: {entry.message}"
-        messages.append({"role": role, "content": formatted_message})
-
-    # Finally add the new user message
-    messages.append({"role": "user", "content": new_message})
-
-    try:
-        # Use the 'o1' model, which doesn't allow system role
-        response = client.chat.completions.create(
-            model=model_name,
-            messages=messages,
-            max_completion_tokens=2000
-        )
-
-        ai_reply = response.choices[0].message.content.strip()
-
-        # Filter out non-essential responses
-        if not ai_reply or ai_reply.lower() in ["", "i'm not sure", "i don't know"]:
-            return ""
-        return ai_reply
-
-    except Exception as e:
-        return f"Error: {str(e)}"
+    # Build the messages array, trimming the oldest history to fit our window
+    messages, _ = context_builder.build_messages(
+        PERSONALITY_NAME,
+        combined_system_prompt,
+        chat_history,
+        new_message,
+        window=PERSONALITY_WINDOW,
+        maxout=PERSONALITY_MAXOUT,
+        summary=summary,
+        system_role=first_message_role
+    )
+
+    def request():
+        try:
+            # Use the 'o1' model, which doesn't allow system role
+            response = openai_client.get_client().chat.completions.create(
+                model=model_name,
+                messages=messages,
+                max_completion_tokens=PERSONALITY_MAX_REPLY
+            )
+
+            metrics.record_usage(PERSONALITY_NAME, response.usage)
+
+            ai_reply = response.choices[0].message.content.strip()
+
+            # Filter out non-essential responses
+            if not ai_reply or ai_reply.lower() in ["", "i'm not sure", "i don't know"]:
+                return ""
+            return ai_reply
+
+        except Exception as e:
+            return f"Error: {str(e)}"
+
+    # Identical requests are answered from the cache if RESPONSE_CACHE_TTL is set
+    return response_cache.cached(PERSONALITY_NAME, model_name, messages, request,
+                                 params={"max_completion_tokens": PERSONALITY_MAX_REPLY})
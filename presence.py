@@ -0,0 +1,311 @@
+# presence.py
+"""
+Room presence: which humans and AI personalities are in which room.
+
+This used to be a module-level dict in socketio_events.py, which tied the
+app to a single process. It now sits behind a small store interface with
+two implementations, chosen with PRESENCE_BACKEND:
+
+    memory  (default) - a dict in this process; fine for one worker
+    sql               - the room_presence table, shared by every worker
+
+Run several gunicorn workers with PRESENCE_BACKEND=sql and
+SOCKETIO_MESSAGE_QUEUE (e.g. redis://...) so the workers share presence and
+relay each other's broadcasts.
+
+Humans are tracked by Socket.IO connection as well (SessionRegistry), so a
+closed or crashed tab leaves its rooms on disconnect, and someone with two
+tabs open stays present until the last one goes. The registry counts this
+worker's connections; with the sql backend each worker holding a human also
+has a presence_holder row, and the room_presence row is only deleted when
+the last holder - on whichever worker - releases it. A periodic collect()
+pass then takes care of what no connection owns:
+
+  - AI personalities in a room without humans are removed once it has been
+    that way for PRESENCE_AI_IDLE_SECONDS;
+  - with the sql backend, holders of a worker whose heartbeat is older than
+    PRESENCE_WORKER_TTL_SECONDS (it crashed or was killed) are deleted,
+    along with the humans nobody holds any more and the AIs it added.
+"""
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import IntegrityError
+
+from extensions import db, socketio
+from models import PresenceHolder, PresenceWorker, RoomPresence
+import metrics
+import tracing
+
+log = tracing.get_logger(__name__)
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+GC_SECONDS = float(os.environ.get('PRESENCE_GC_SECONDS', '60'))
+AI_IDLE_SECONDS = float(os.environ.get('PRESENCE_AI_IDLE_SECONDS', '600'))
+WORKER_TTL_SECONDS = float(os.environ.get('PRESENCE_WORKER_TTL_SECONDS', '300'))
+
+
+class InProcessPresenceStore:
+    """Presence held in this process only."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rooms = {}  # room -> {name: is_ai}
+
+    def add(self, room, name, is_ai=False):
+        """Add 'name' to 'room'. Returns False if it was already there."""
+        with self._lock:
+            members = self._rooms.setdefault(room, {})
+            if name in members:
+                return False
+            members[name] = is_ai
+            return True
+
+    def discard(self, room, name):
+        """Remove 'name' from 'room'. Returns False if it wasn't there."""
+        with self._lock:
+            members = self._rooms.get(room)
+            if not members or name not in members:
+                return False
+            del members[name]
+            if not members:
+                del self._rooms[room]
+            return True
+
+    def hold(self, room, name):
+        """This worker now has a connection in 'room' as 'name' (the SessionRegistry counts them)."""
+
+    def release(self, room, name):
+        """This worker's last connection in 'room' as 'name' went: remove it. Returns False if it wasn't there."""
+        return self.discard(room, name)
+
+    def contains(self, room, name):
+        with self._lock:
+            return name in self._rooms.get(room, ())
+
+    def members(self, room):
+        """Everyone in 'room', as a list of names."""
+        with self._lock:
+            return list(self._rooms.get(room, ()))
+
+    def room_counts(self):
+        """{room: number of members} for every non-empty room."""
+        with self._lock:
+            return {room: len(members) for room, members in self._rooms.items()}
+
+    def snapshot(self):
+        """{room: {name: is_ai}} for every non-empty room."""
+        with self._lock:
+            return {room: dict(members) for room, members in self._rooms.items()}
+
+    def heartbeat(self):
+        pass
+
+    def purge_dead_workers(self, ttl_seconds):
+        return 0
+
+
+class SqlPresenceStore:
+    """Presence in the room_presence table, visible to every worker."""
+
+    def add(self, room, name, is_ai=False):
+        try:
+            db.session.add(RoomPresence(room=room, name=name, is_ai=is_ai, worker=WORKER_ID))
+            db.session.commit()
+            return True
+        except IntegrityError:
+            db.session.rollback()
+            return False
+
+    def discard(self, room, name):
+        removed = RoomPresence.query.filter_by(room=room, name=name).delete()
+        db.session.commit()
+        return bool(removed)
+
+    def hold(self, room, name):
+        try:
+            db.session.add(PresenceHolder(room=room, name=name, worker=WORKER_ID))
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+
+    def release(self, room, name):
+        """
+        Drop this worker's hold on 'name' in 'room', and the member itself if
+        no other worker holds it. Returns True if the member was removed.
+        """
+        PresenceHolder.query.filter_by(room=room, name=name, worker=WORKER_ID).delete()
+        held = db.session.query(PresenceHolder.worker).filter_by(room=room, name=name)
+        removed = RoomPresence.query.filter(RoomPresence.room == room, RoomPresence.name == name,
+                                            ~held.exists()).delete(synchronize_session=False)
+        db.session.commit()
+        return bool(removed)
+
+    def contains(self, room, name):
+        return db.session.query(RoomPresence.id).filter_by(room=room, name=name).first() is not None
+
+    def members(self, room):
+        return [name for (name,) in db.session.query(RoomPresence.name).filter_by(room=room).all()]
+
+    def room_counts(self):
+        return dict(db.session.query(RoomPresence.room, db.func.count(RoomPresence.id))
+                    .group_by(RoomPresence.room).all())
+
+    def snapshot(self):
+        rooms = {}
+        for room, name, is_ai in db.session.query(RoomPresence.room, RoomPresence.name, RoomPresence.is_ai):
+            rooms.setdefault(room, {})[name] = bool(is_ai)
+        return rooms
+
+    def heartbeat(self):
+        """Record that this worker is alive."""
+        now = datetime.utcnow()
+        if not PresenceWorker.query.filter_by(worker=WORKER_ID).update({'seen_at': now}):
+            db.session.add(PresenceWorker(worker=WORKER_ID, seen_at=now))
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+
+    def purge_dead_workers(self, ttl_seconds):
+        """
+        Delete the holders of workers not heard from in 'ttl_seconds' (or
+        older than that, from workers that never sent a heartbeat), then the
+        humans nobody holds and the AIs those workers added.
+        Returns the number of room_presence rows deleted.
+        """
+        cutoff = datetime.utcnow() - timedelta(seconds=ttl_seconds)
+        dead = db.session.query(PresenceWorker.worker).filter(PresenceWorker.seen_at < cutoff)
+        alive = db.session.query(PresenceWorker.worker).filter(PresenceWorker.seen_at >= cutoff)
+        PresenceHolder.query.filter(db.or_(
+            PresenceHolder.worker.in_(dead),
+            db.and_(PresenceHolder.worker.notin_(alive), PresenceHolder.since < cutoff)
+        )).delete(synchronize_session=False)
+        held = db.session.query(PresenceHolder.worker).filter(PresenceHolder.room == RoomPresence.room,
+                                                              PresenceHolder.name == RoomPresence.name)
+        removed = RoomPresence.query.filter(db.or_(
+            db.and_(RoomPresence.is_ai.isnot(True), RoomPresence.joined_at < cutoff, ~held.exists()),
+            db.and_(RoomPresence.is_ai.is_(True), db.or_(
+                RoomPresence.worker.in_(dead),
+                db.and_(RoomPresence.worker.notin_(alive), RoomPresence.joined_at < cutoff)
+            ))
+        )).delete(synchronize_session=False)
+        PresenceWorker.query.filter(PresenceWorker.seen_at < cutoff).delete(synchronize_session=False)
+        db.session.commit()
+        return removed
+
+
+class SessionRegistry:
+    """
+    The rooms each Socket.IO connection (sid) has joined, and under which
+    name, with a count of connections per (room, name).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._by_sid = {}   # sid -> {(room, name)}
+        self._counts = {}   # (room, name) -> number of sids
+
+    def add(self, sid, room, name):
+        """
+        Register that 'sid' joined 'room' as 'name'. Returns True if it is
+        the first of this worker's connections there under that name.
+        """
+        with self._lock:
+            entries = self._by_sid.setdefault(sid, set())
+            if (room, name) in entries:
+                return False
+            entries.add((room, name))
+            self._counts[(room, name)] = self._counts.get((room, name), 0) + 1
+            return self._counts[(room, name)] == 1
+
+    def _release(self, sid, entries):
+        """Forget 'entries' of 'sid'; returns those no other sid holds. Caller holds _lock."""
+        gone = []
+        for key in entries:
+            self._by_sid[sid].discard(key)
+            self._counts[key] -= 1
+            if not self._counts[key]:
+                del self._counts[key]
+                gone.append(key)
+        if not self._by_sid[sid]:
+            del self._by_sid[sid]
+        return gone
+
+    def leave(self, sid, room):
+        """'sid' left 'room': the names it used there that no other connection holds."""
+        with self._lock:
+            entries = [key for key in self._by_sid.get(sid, ()) if key[0] == room]
+            return [name for _, name in self._release(sid, entries)] if entries else []
+
+    def drop(self, sid):
+        """'sid' disconnected: the (room, name) pairs no other connection holds."""
+        with self._lock:
+            entries = list(self._by_sid.get(sid, ()))
+            return self._release(sid, entries) if entries else []
+
+    def stats(self):
+        with self._lock:
+            return {'sessions': len(self._by_sid), 'memberships': len(self._counts)}
+
+
+def create_store(backend=None):
+    backend = (backend or os.environ.get('PRESENCE_BACKEND', 'memory')).lower()
+    if backend == 'sql':
+        return SqlPresenceStore()
+    if backend == 'memory':
+        return InProcessPresenceStore()
+    raise ValueError(f"Unknown PRESENCE_BACKEND: {backend}")
+
+
+# The store used by the socket handlers, and this worker's connections
+store = create_store()
+sessions = SessionRegistry()
+
+_idle_since = {}  # room -> when collect() first saw it with AIs but no humans
+
+
+def collect(now=None):
+    """
+    One garbage-collection pass over the presence store (see the module
+    docstring). Returns the rooms whose membership changed.
+    """
+    now = time.monotonic() if now is None else now
+    store.heartbeat()
+    ghosts = store.purge_dead_workers(WORKER_TTL_SECONDS)
+    if ghosts:
+        metrics.inc('presence_evictions_total', ghosts, reason='dead_worker')
+        log.info("Removed presence of dead workers", rows=ghosts)
+
+    changed = []
+    rooms = store.snapshot()
+    for room in list(_idle_since):
+        if room not in rooms:
+            del _idle_since[room]
+    for room, members in rooms.items():
+        if not all(members.values()):
+            _idle_since.pop(room, None)  # Someone is there
+            continue
+        if now - _idle_since.setdefault(room, now) < AI_IDLE_SECONDS:
+            continue
+        evicted = [name for name in members if store.discard(room, name)]
+        del _idle_since[room]
+        if evicted:
+            metrics.inc('presence_evictions_total', len(evicted), reason='ai_idle')
+            log.debug("Removed AIs from an empty room", room=room, personalities=evicted)
+            changed.append(room)
+    return changed
+
+
+def gc_loop(app):
+    """Background task: run collect() every PRESENCE_GC_SECONDS."""
+    while True:
+        socketio.sleep(GC_SECONDS)
+        try:
+            with app.app_context():
+                collect()
+        except Exception as e:
+            log.error("Presence GC failed", error=str(e), exc_info=True)
@@ -0,0 +1,258 @@
+# rate_limiter.py
+"""
+Outbound rate limiting and priority scheduling per model.
+
+A burst in a busy room could fire many requests at one model at once; the
+provider answered with 429s, which the plugins turned into "Error: ..."
+chat messages. Every plugin call now passes through the limiter for its
+model (several personalities can share one, e.g. Babel and Gwynn both use
+o3-mini), which enforces:
+
+  - token buckets for requests and tokens per minute, from the plugin's
+        PERSONALITY_MODEL  (str) provider model name (default: the personality)
+        PERSONALITY_RPM    (int) requests per minute (0 = unlimited)
+        PERSONALITY_TPM    (int) tokens per minute (0 = unlimited)
+    (the lowest any personality on the model sets, see configure()),
+    divided between GUNICORN_WORKERS processes. A call is charged an expected
+    reply size up front and its actual prompt size (as built by
+    context_builder) once the plugin returns, so the bucket may briefly go
+    negative and hold back the next callers;
+  - a priority queue: a personality addressed by name goes ahead of ones
+    answering a general message;
+  - adaptive concurrency (AIMD): the number of calls in flight to a model
+    grows by one per "window" of successful calls up to
+    MODEL_MAX_CONCURRENCY (env, default 8), and is halved on a 429 (with a
+    RATE_LIMIT_BACKOFF_SECONDS pause, default 10) or cut by a quarter when a
+    call takes RATE_LIMIT_SPIKE_FACTOR (default 3) times the usual latency.
+
+The job queue skips claiming jobs for saturated models (see
+blocked_personalities), so waiting jobs don't tie up dispatch slots.
+"""
+import heapq
+import itertools
+import os
+import threading
+import time
+
+import tracing
+
+log = tracing.get_logger(__name__)
+
+MAX_CONCURRENCY = int(os.environ.get('MODEL_MAX_CONCURRENCY', '8'))
+BACKOFF_SECONDS = float(os.environ.get('RATE_LIMIT_BACKOFF_SECONDS', '10'))
+SPIKE_FACTOR = float(os.environ.get('RATE_LIMIT_SPIKE_FACTOR', '3'))
+WORKERS = max(1, int(os.environ.get('GUNICORN_WORKERS', '1')))
+EXPECTED_OUTPUT_TOKENS = 500  # Budgeted per call on top of the prompt
+
+PRIORITY_ADDRESSED = 0
+PRIORITY_NORMAL = 1
+
+_lock = threading.Lock()
+_limiters = {}  # model -> ModelLimiter
+_tickets = itertools.count()
+
+
+class TokenBucket:
+    """Refills continuously at 'per_minute' / 60 per second, up to a minute's worth."""
+
+    def __init__(self, per_minute):
+        self.rate = per_minute / 60.0
+        self.capacity = float(per_minute)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """Seconds until 'amount' is available (0 if it is now)."""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount):
+        self.level -= min(amount, self.capacity)
+
+    def charge(self, amount, now):
+        """Debit tokens after the fact; the level may go negative, down to -capacity."""
+        self._refill(now)
+        self.level = max(-self.capacity, self.level - amount)
+
+
+def _bucket(per_minute, current=None):
+    """This worker's share of 'per_minute', keeping no more in hand than 'current' has left."""
+    if not per_minute:
+        return None
+    bucket = TokenBucket(per_minute / WORKERS)
+    if current is not None:
+        current._refill(bucket.updated)
+        bucket.level = min(bucket.capacity, current.level)
+    return bucket
+
+
+class ModelLimiter:
+    def __init__(self, model, rpm=0, tpm=0):
+        self.model = model
+        self.requests = _bucket(rpm)
+        self.tokens = _bucket(tpm)
+        self.limit = float(MAX_CONCURRENCY)
+        self.in_flight = 0
+        self.backoff_until = 0.0
+        self.latency = None  # Moving average of call latency (s)
+        self.waiters = []    # heap of (priority, ticket)
+        self.condition = threading.Condition()
+        self.stats = {'calls': 0, 'throttled': 0, 'spikes': 0, 'waited': 0, 'wait_seconds': 0.0}
+
+    def set_limits(self, rpm, tpm):
+        """Change the per-minute limits, keeping the concurrency state and what has been used."""
+        with self.condition:
+            self.requests = _bucket(rpm, self.requests)
+            self.tokens = _bucket(tpm, self.tokens)
+            self.condition.notify_all()
+
+    def _delay(self, tokens, now):
+        """Seconds to wait before a call may start, or None to wait for a release."""
+        if self.in_flight >= int(self.limit):
+            return None
+        delay = max(0.0, self.backoff_until - now)
+        if self.requests:
+            delay = max(delay, self.requests.wait_time(1, now))
+        if self.tokens:
+            delay = max(delay, self.tokens.wait_time(tokens, now))
+        return delay
+
+    def acquire(self, priority=PRIORITY_NORMAL, tokens=EXPECTED_OUTPUT_TOKENS):
+        """Block until this call may go ahead. Returns the seconds waited."""
+        start = time.monotonic()
+        with self.condition:
+            ticket = (priority, next(_tickets))
+            heapq.heappush(self.waiters, ticket)
+            try:
+                while True:
+                    delay = self._delay(tokens, time.monotonic()) if self.waiters[0] == ticket else None
+                    if delay == 0:
+                        break
+                    self.condition.wait(timeout=delay if delay else 1.0)
+            finally:
+                self.waiters.remove(ticket)
+                heapq.heapify(self.waiters)
+                self.condition.notify_all()
+
+            if self.requests:
+                self.requests.take(1)
+            if self.tokens:
+                self.tokens.take(tokens)
+            self.in_flight += 1
+            waited = time.monotonic() - start
+            self.stats['calls'] += 1
+            if waited > 0.01:
+                self.stats['waited'] += 1
+                self.stats['wait_seconds'] += waited
+            return waited
+
+    def release(self, latency, throttled=False, prompt_tokens=0):
+        """Record how a call went, charge its prompt tokens and adapt the concurrency limit."""
+        with self.condition:
+            self.in_flight -= 1
+            if self.tokens and prompt_tokens:
+                self.tokens.charge(prompt_tokens, time.monotonic())
+            now = time.monotonic()
+            if throttled:
+                self.stats['throttled'] += 1
+                # Calls already in flight when the first 429 came back will
+                # likely fail too; cut the limit once per backoff period.
+                if now >= self.backoff_until:
+                    self.limit = max(1.0, self.limit / 2)
+                    log.warning("Model throttled (429)", model=self.model, limit=int(self.limit))
+                self.backoff_until = now + BACKOFF_SECONDS
+            elif self.latency and latency > SPIKE_FACTOR * self.latency:
+                self.stats['spikes'] += 1
+                self.limit = max(1.0, self.limit * 0.75)
+            else:
+                self.limit = min(float(MAX_CONCURRENCY), self.limit + 1 / self.limit)
+            if not throttled:
+                self.latency = latency if self.latency is None else 0.8 * self.latency + 0.2 * latency
+            self.condition.notify_all()
+
+    def saturated(self):
+        """True if a new call could not start right now."""
+        with self.condition:
+            return self.waiters != [] or self._delay(EXPECTED_OUTPUT_TOKENS, time.monotonic()) != 0
+
+
+def model_of(personality):
+    return personality.get('model') or personality['name']
+
+
+def _lowest(limits):
+    """The strictest of some per-minute limits, where 0 means unlimited."""
+    return min((limit for limit in limits if limit), default=0)
+
+
+def configure(personalities):
+    """
+    Set each model's limits from loaded_personalities: the lowest RPM and
+    TPM of the personalities on it, so the order plugins load in doesn't
+    matter. Called whenever the registry is (re)loaded; limiters of models
+    nobody uses any more are dropped.
+    """
+    by_model = {}
+    for personality in personalities.values():
+        by_model.setdefault(model_of(personality), []).append(personality)
+    with _lock:
+        for model in set(_limiters) - set(by_model):
+            del _limiters[model]
+        for model, sharing in by_model.items():
+            rpm = _lowest(p.get('rpm') or 0 for p in sharing)
+            tpm = _lowest(p.get('tpm') or 0 for p in sharing)
+            if model in _limiters:
+                _limiters[model].set_limits(rpm, tpm)
+            else:
+                _limiters[model] = ModelLimiter(model, rpm, tpm)
+
+
+def limiter_for(personality):
+    """The shared limiter for a loaded_personalities entry's model (see configure)."""
+    model = model_of(personality)
+    with _lock:
+        limiter = _limiters.get(model)
+        if limiter is None:
+            limiter = _limiters[model] = ModelLimiter(model, personality.get('rpm') or 0,
+                                                      personality.get('tpm') or 0)
+        return limiter
+
+
+def is_throttled(reply):
+    """Did the plugin report a provider rate limit?"""
+    if not isinstance(reply, str) or "Error:" not in reply:
+        return False
+    lowered = reply.lower()
+    return "429" in reply or "rate limit" in lowered or "rate_limit" in lowered
+
+
+def blocked_personalities(personalities):
+    """Names of personalities whose model can't take another call right now."""
+    with _lock:
+        limiters = dict(_limiters)
+    blocked = {model for model, limiter in limiters.items() if limiter.saturated()}
+    return [name for name, p in personalities.items() if model_of(p) in blocked]
+
+
+def limiter_stats():
+    """Per-model concurrency, bucket levels and throttling counts."""
+    with _lock:
+        limiters = dict(_limiters)
+    stats = {}
+    for model, limiter in limiters.items():
+        with limiter.condition:
+            stats[model] = dict(
+                limiter.stats,
+                limit=int(limiter.limit),
+                in_flight=limiter.in_flight,
+                waiting=len(limiter.waiters),
+                latency_ms=round(limiter.latency * 1000, 1) if limiter.latency else None,
+                requests_available=int(limiter.requests.level) if limiter.requests else None,
+                tokens_available=int(limiter.tokens.level) if limiter.tokens else None,
+            )
+    return stats
@@ -0,0 +1,177 @@
+# relevance_gate.py
+"""
+Cheap local check of whether an AI personality is likely to answer a message.
+
+Every human message used to queue a paid completion for every AI in the
+room, and most replies were then thrown away (too short, or the model
+"remained silent"). The gate runs before a job is queued and decides per
+personality, from the message text and the room's last few turns, using
+the plugin's policy:
+
+    always     call on every message (e.g. the translator)
+    mentioned  call only when the personality is named
+    auto       (default) call when it is named, when it is the only AI in
+               the room, when the message follows up on its own recent
+               reply, or when a question is put to the room - but not
+               when the message is addressed to someone else
+
+A plugin may set:
+    RELEVANCE_POLICY     (str)  one of the above; RELEVANCE_DEFAULT_POLICY
+                                (env, default 'auto') otherwise
+    PERSONALITY_ALIASES  (list) extra names it answers to; the first word of
+                                PERSONALITY_NAME (e.g. "Cassie") always counts
+
+RELEVANCE_RECENT_TURNS (env, default 6) is how far back the follow-up check
+looks. Counters of calls made and avoided are kept per personality.
+"""
+import os
+import re
+import threading
+from collections import defaultdict
+
+import tracing
+
+log = tracing.get_logger(__name__)
+
+POLICIES = ('always', 'mentioned', 'auto')
+DEFAULT_POLICY = os.environ.get('RELEVANCE_DEFAULT_POLICY', 'auto')
+RECENT_TURNS = int(os.environ.get('RELEVANCE_RECENT_TURNS', '6'))
+
+_QUESTION_OPENERS = re.compile(
+    r"^\s*(who|what|when|where|why|how|which|is|are|can|could|would|should|do|does|did|will|any|anyone|"
+    r"has|have|tell|explain|describe|summar(?:ise|ize)|translate)\b", re.IGNORECASE)
+_ROOM_ADDRESS = re.compile(
+    r"\b(anyone|anybody|everyone|everybody|all of you|any of you|you all|y'all|you guys|folks|team)\b",
+    re.IGNORECASE)
+
+_lock = threading.Lock()
+_counters = defaultdict(lambda: {'called': 0, 'avoided': 0, 'reasons': defaultdict(int)})
+
+
+def names_for(personality):
+    """Every name a personality answers to, for mention matching."""
+    name = personality['name']
+    names = {name, name.split(' (')[0], name.split()[0]}
+    names.update(personality.get('aliases') or ())
+    return {n.strip() for n in names if n and n.strip()}
+
+
+def _pattern(names):
+    alternatives = '|'.join(re.escape(n) for n in sorted(names, key=len, reverse=True))
+    return re.compile(rf"(?<![\w@])@?(?:{alternatives})(?!\w)", re.IGNORECASE)
+
+
+def _mentions(text, names):
+    return bool(names) and _pattern(names).search(text) is not None
+
+
+def is_addressed(personality, message):
+    """True if 'message' names the personality (or one of its aliases)."""
+    return _mentions(message or "", names_for(personality))
+
+
+def _addresses(text, names):
+    """'Bob, ...' / 'Bob: ...' at the start, or '@Bob' anywhere."""
+    if not names:
+        return False
+    alternatives = '|'.join(re.escape(n) for n in sorted(names, key=len, reverse=True))
+    return re.search(rf"(^\s*(?:{alternatives})\s*[,:]|@(?:{alternatives})(?!\w))", text, re.IGNORECASE) is not None
+
+
+def _is_question(text):
+    return '?' in text or _QUESTION_OPENERS.search(text) is not None or _ROOM_ADDRESS.search(text) is not None
+
+
+def _replied_recently(name, sender_name, recent_history, personalities):
+    """
+    True if 'name' is among the AI replies to the sender's previous message,
+    with no other human speaking since - i.e. the new message follows up on
+    something it said to them.
+    """
+    replied = False
+    for entry in reversed(recent_history[-RECENT_TURNS:]):
+        if entry.sender_name in personalities:
+            replied = replied or entry.sender_name == name
+            continue
+        return replied and entry.sender_name == sender_name
+    return False
+
+
+def _is_acknowledgement(text):
+    """'ok thanks', 'nice', 'lol' - nothing to answer."""
+    return '?' not in text and len(text.split()) <= 2
+
+
+def decide(personality, message, sender_name, participants, personalities, recent_history=()):
+    """
+    Decide whether to call 'personality' (a loaded_personalities entry) for
+    'message'. Returns (call, reason).
+
+    :param participants:   Everyone in the room, humans and AIs
+    :param personalities:  app.loaded_personalities, to tell AIs from humans
+    :param recent_history: Messages before this one, oldest first
+    """
+    policy = personality.get('policy') or DEFAULT_POLICY
+    if policy not in POLICIES:
+        policy = 'auto'
+    if policy == 'always':
+        return True, 'always'
+
+    text = message or ""
+    if _mentions(text, names_for(personality)):
+        return True, 'mentioned'
+    if policy == 'mentioned':
+        return False, 'not_mentioned'
+
+    # Naming another AI anywhere, or opening with / @-ing a human, means the
+    # message is meant for them rather than for us.
+    other_ais, humans = set(), set()
+    for participant in participants:
+        if participant in (personality['name'], sender_name):
+            continue
+        if participant in personalities:
+            other_ais.update(names_for(personalities[participant]))
+        else:
+            humans.add(participant)
+    if _mentions(text, other_ais) or _addresses(text, humans):
+        return False, 'addressed_elsewhere'
+
+    room_ais = [p for p in participants if p in personalities and p != sender_name]
+    if len(room_ais) == 1:
+        return True, 'only_ai'
+    if _is_acknowledgement(text):
+        return False, 'acknowledgement'
+    if _replied_recently(personality['name'], sender_name, recent_history, personalities):
+        return True, 'follow_up'
+    if _is_question(text):
+        return True, 'question'
+    return False, 'no_cue'
+
+
+def should_call(personality, message, sender_name, participants, personalities, recent_history=()):
+    """decide(), plus bookkeeping of calls made and avoided."""
+    call, reason = decide(personality, message, sender_name, participants, personalities, recent_history)
+    with _lock:
+        counter = _counters[personality['name']]
+        counter['called' if call else 'avoided'] += 1
+        counter['reasons'][reason] += 1
+    if not call:
+        log.debug("Relevance gate skipped", personality=personality['name'], reason=reason)
+    return call
+
+
+def gate_stats():
+    """Calls made and avoided, in total and per personality."""
+    with _lock:
+        per_personality = {
+            name: {'called': c['called'], 'avoided': c['avoided'], 'reasons': dict(c['reasons'])}
+            for name, c in _counters.items()
+        }
+    called = sum(c['called'] for c in per_personality.values())
+    avoided = sum(c['avoided'] for c in per_personality.values())
+    return {
+        'called': called,
+        'avoided': avoided,
+        'avoided_ratio': avoided / (called + avoided) if called + avoided else 0.0,
+        'personalities': per_personality,
+    }
@@ -0,0 +1,237 @@
+# response_cache.py
+"""
+Content-addressed cache of plugin replies.
+
+The same request often reaches the provider more than once: Babel
+translating a message it has already translated, summaries rebuilt from
+the same batch, retries of a job whose reply was produced but not posted.
+Plugins wrap their provider call in cached(), which keys it on
+
+    sha256(personality, model, built message array, request parameters)
+
+and returns the stored reply on a hit. Caching is opt-in per plugin: only
+personalities whose module sets RESPONSE_CACHE_TTL (seconds) are cached,
+everyone else passes straight through. That is meant for deterministic
+plugins (Echo, Babel); a conversational personality should get a fresh
+reply each time, so its plugin passes a ttl only for calls worth reusing,
+such as summarize(). Error replies ("Error: ...") are never stored.
+
+Two tiers:
+    memory  LRU with a TTL per entry, bounded by RESPONSE_CACHE_MAX_ENTRIES
+            (env, default 1000) and RESPONSE_CACHE_MAX_BYTES (default 8 MiB)
+    sqlite  optional, set RESPONSE_CACHE_SQLITE to a file path; survives
+            restarts and is shared by the workers on one host, bounded by
+            RESPONSE_CACHE_SQLITE_MAX_ROWS (default 50000)
+
+RESPONSE_CACHE=0 turns the cache off entirely.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import tracing
+
+log = tracing.get_logger(__name__)
+
+ENABLED = os.environ.get('RESPONSE_CACHE', '1') == '1'
+MAX_ENTRIES = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', '1000'))
+MAX_BYTES = int(os.environ.get('RESPONSE_CACHE_MAX_BYTES', str(8 * 1024 * 1024)))
+SQLITE_PATH = os.environ.get('RESPONSE_CACHE_SQLITE', '')
+SQLITE_MAX_ROWS = int(os.environ.get('RESPONSE_CACHE_SQLITE_MAX_ROWS', '50000'))
+
+_lock = threading.Lock()
+_ttls = {}               # personality -> TTL in seconds, from the plugins' RESPONSE_CACHE_TTL
+_entries = OrderedDict()  # key -> (reply, expires_at), least recently used first
+_total_bytes = 0
+_stats = {'hits': 0, 'sqlite_hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+_per_personality = {}    # personality -> {'hits': n, 'misses': n}
+
+_local = threading.local()
+_sqlite_writes = 0
+
+
+def configure(personality_name, ttl):
+    """Register a personality's RESPONSE_CACHE_TTL (0 or None = not cached)."""
+    with _lock:
+        if ttl:
+            _ttls[personality_name] = float(ttl)
+        else:
+            _ttls.pop(personality_name, None)
+
+
+def make_key(personality_name, model, messages, params=None):
+    payload = json.dumps([personality_name, model, messages, params or {}],
+                         sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def cached(personality_name, model, messages, produce, params=None, ttl=None):
+    """
+    Return the cached reply for this exact request, or call produce() and
+    cache what it returns. produce() may return a string, or a generator of
+    text chunks (streaming plugins) which is passed through and stored once
+    it has finished. 'ttl' overrides the personality's RESPONSE_CACHE_TTL
+    for this call.
+    """
+    if not ENABLED:
+        return produce()
+    ttl = ttl or _ttls.get(personality_name)
+    if not ttl:
+        return produce()
+
+    key = make_key(personality_name, model, messages, params)
+    reply = _get(key, personality_name)
+    if reply is not None:
+        log.debug("Response cache hit", personality=personality_name, key=key[:12])
+        return reply
+
+    result = produce()
+    if isinstance(result, str):
+        _put(key, result, ttl)
+        return result
+    return _store_when_done(key, result, ttl)
+
+
+def _store_when_done(key, chunks, ttl):
+    parts = []
+    for chunk in chunks:
+        parts.append(chunk)
+        yield chunk
+    _put(key, "".join(parts), ttl)
+
+
+def _cacheable(reply):
+    # Plugins report failures as "Error: ..." (streams append "\nError: ...")
+    return bool(reply and reply.strip()) and not reply.lstrip().startswith("Error:") \
+        and "\nError: " not in reply
+
+
+def _get(key, personality_name):
+    now = time.time()
+    reply, tier = None, 'memory'
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None:
+            if entry[1] > now:
+                _entries.move_to_end(key)
+                reply = entry[0]
+            else:
+                _drop(key)
+
+    if reply is None:
+        row = _sqlite_get(key, now)
+        if row is not None:
+            reply, tier = row[0], 'sqlite'
+            _memory_put(key, row[0], row[1])
+
+    with _lock:
+        counts = _per_personality.setdefault(personality_name, {'hits': 0, 'misses': 0})
+        if reply is None:
+            _stats['misses'] += 1
+            counts['misses'] += 1
+        else:
+            _stats['hits'] += 1
+            counts['hits'] += 1
+            if tier == 'sqlite':
+                _stats['sqlite_hits'] += 1
+    return reply
+
+
+def _put(key, reply, ttl):
+    if not _cacheable(reply):
+        return
+    expires_at = time.time() + ttl
+    _memory_put(key, reply, expires_at)
+    _sqlite_put(key, reply, expires_at)
+    with _lock:
+        _stats['stores'] += 1
+
+
+def _memory_put(key, reply, expires_at):
+    global _total_bytes
+    size = len(reply.encode('utf-8'))
+    if size > MAX_BYTES:
+        return
+    with _lock:
+        if key in _entries:
+            _drop(key)
+        _entries[key] = (reply, expires_at)
+        _total_bytes += size
+        while _entries and (len(_entries) > MAX_ENTRIES or _total_bytes > MAX_BYTES):
+            _drop(next(iter(_entries)))
+            _stats['evictions'] += 1
+
+
+def _drop(key):
+    """Remove one memory entry; caller holds _lock."""
+    global _total_bytes
+    reply, _ = _entries.pop(key)
+    _total_bytes -= len(reply.encode('utf-8'))
+
+
+def _connection():
+    """This thread's connection to the SQLite tier, or None if it is off."""
+    if not SQLITE_PATH:
+        return None
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(SQLITE_PATH, timeout=5)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS response_cache "
+                     "(key TEXT PRIMARY KEY, reply TEXT NOT NULL, expires_at REAL NOT NULL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS ix_response_cache_expires ON response_cache (expires_at)")
+        _local.conn = conn
+    return conn
+
+
+def _sqlite_get(key, now):
+    try:
+        conn = _connection()
+        if conn is None:
+            return None
+        row = conn.execute("SELECT reply, expires_at FROM response_cache WHERE key = ? AND expires_at > ?",
+                           (key, now)).fetchone()
+        return row
+    except sqlite3.Error as e:
+        log.warning("⚠️ Response cache read failed", error=str(e))
+        return None
+
+
+def _sqlite_put(key, reply, expires_at):
+    global _sqlite_writes
+    try:
+        conn = _connection()
+        if conn is None:
+            return
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO response_cache (key, reply, expires_at) VALUES (?, ?, ?)",
+                         (key, reply, expires_at))
+        _sqlite_writes += 1
+        if _sqlite_writes % 100 == 0:
+            _sqlite_prune(conn)
+    except sqlite3.Error as e:
+        log.warning("⚠️ Response cache write failed", error=str(e))
+
+
+def _sqlite_prune(conn):
+    """Drop expired rows, then the soonest-to-expire ones beyond the row cap."""
+    with conn:
+        conn.execute("DELETE FROM response_cache WHERE expires_at <= ?", (time.time(),))
+        conn.execute("DELETE FROM response_cache WHERE key IN (SELECT key FROM response_cache "
+                     "ORDER BY expires_at DESC LIMIT -1 OFFSET ?)", (SQLITE_MAX_ROWS,))
+
+
+def cache_stats():
+    """Hit rate, sizes and per-personality hits/misses."""
+    with _lock:
+        stats = dict(_stats, entries=len(_entries), bytes=_total_bytes,
+                     personalities={name: dict(c) for name, c in _per_personality.items()},
+                     cached_personalities=sorted(_ttls))
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+    stats['sqlite'] = SQLITE_PATH or None
+    return stats
@@ -0,0 +1,134 @@
+# room_sequence.py
+"""
+Atomic per-room allocator for ChatHistory.room_message_id.
+
+Every message used to compute max(room_message_id) for its room - a scan per
+message that also raced between concurrent senders, and all AI replies
+reused the same max + 2. Instead each room has a ChatSequence row that is
+bumped with a single UPDATE inside the caller's transaction. The row lock
+(MySQL) or write lock (SQLite) is held until that transaction commits,
+so two writers can never get the same number.
+
+The counter is seeded from the existing rows the first time a room is used,
+so rooms created before this table existed carry on where they left off.
+
+ChatHistory ids come from a counter too (IdBlock), bumped in the same
+transaction right after the room's: no row is inserted with an
+auto-increment id, so ids handed out ahead of the insert (write_behind)
+can't collide with anyone else's, and within a room id order always
+matches room_message_id order - whichever transaction takes the room row
+first gets the lower number of both.
+
+write_behind can't hold a transaction open per message, so it reserves
+blocks instead: reserve() bumps a room's counter and the id counter by the
+same count in one short transaction of its own.
+"""
+from sqlalchemy import case, func, select
+from sqlalchemy.exc import IntegrityError
+
+from extensions import db
+from models import ChatHistory, ChatSequence, IdBlock
+
+
+def allocate(chat_id):
+    """
+    Reserve and return the next room_message_id for 'chat_id'. Runs in the
+    current session's transaction; commit it together with the new row.
+    """
+    chat_id = int(chat_id)
+    for _ in range(2):
+        updated = ChatSequence.query.filter_by(chat_id=chat_id).update(
+            {'last_room_message_id': ChatSequence.last_room_message_id + 1},
+            synchronize_session=False
+        )
+        if updated:
+            return db.session.query(ChatSequence.last_room_message_id) \
+                             .filter_by(chat_id=chat_id).scalar()
+
+        # First message since the counter was introduced: seed it from the
+        # room's existing rows (an index lookup on chat_id, room_message_id).
+        current = db.session.query(func.max(ChatHistory.room_message_id)) \
+                            .filter_by(chat_id=chat_id).scalar() or 0
+        try:
+            with db.session.begin_nested():
+                db.session.add(ChatSequence(chat_id=chat_id, last_room_message_id=current + 1))
+            return current + 1
+        except IntegrityError:
+            # Someone else seeded it first; go round again and bump theirs.
+            continue
+
+    raise RuntimeError(f"Could not allocate a room_message_id for chat {chat_id}")
+
+
+def _bump(conn, table, key_column, key, value_column, count, seed_query):
+    """
+    Bump table.value_column by 'count' within 'conn's transaction and return
+    the first number of the reserved range. The range always starts above
+    'seed_query' (the highest number already in use), checked in the same
+    statement, and the row is seeded from it if it doesn't exist yet (an
+    IntegrityError if someone else seeded it first).
+    """
+    in_use = func.coalesce(seed_query.scalar_subquery(), 0)
+    updated = conn.execute(
+        table.update().where(key_column == key).values({
+            value_column: case((value_column < in_use, in_use), else_=value_column) + count
+        })
+    ).rowcount
+    if updated:
+        last = conn.execute(select(value_column).where(key_column == key)).scalar()
+        return last - count + 1
+    current = conn.execute(seed_query).scalar() or 0
+    conn.execute(table.insert().values({key_column: key, value_column: current + count}))
+    return current + 1
+
+
+def _bump_ids(conn, count):
+    table = IdBlock.__table__
+    history = ChatHistory.__table__
+    return _bump(conn, table, table.c.name, history.name, table.c.last_id, count, select(func.max(history.c.id)))
+
+
+def allocate_id():
+    """
+    Reserve and return the next ChatHistory.id. Runs in the current
+    session's transaction; call it after allocate() and commit both with
+    the new row.
+    """
+    for _ in range(2):
+        try:
+            with db.session.begin_nested():
+                return _bump_ids(db.session.connection(), 1)
+        except IntegrityError:
+            continue  # Someone else seeded the counter first; bump theirs.
+
+    raise RuntimeError("Could not allocate a ChatHistory id")
+
+
+def reserve(chat_id, count):
+    """
+    Reserve 'count' consecutive room_message_ids for 'chat_id' and as many
+    consecutive ChatHistory ids, committed straight away. Returns the first
+    of each: (id, room_message_id).
+    """
+    chat_id = int(chat_id)
+    table = ChatSequence.__table__
+    history = ChatHistory.__table__
+    for _ in range(2):
+        try:
+            with db.engine.begin() as conn:
+                first_room_id = _bump(conn, table, table.c.chat_id, chat_id, table.c.last_room_message_id, count,
+                                      select(func.max(history.c.room_message_id)).where(history.c.chat_id == chat_id))
+                return _bump_ids(conn, count), first_room_id
+        except IntegrityError:
+            continue  # Someone else seeded a counter first; go round again and bump theirs.
+
+    raise RuntimeError(f"Could not reserve ids for chat {chat_id}")
+
+
+def ensure_indexes(engine):
+    """
+    db.create_all() only creates indexes together with new tables, so add any
+    that are missing on tables from older installs.
+    """
+    for index in ChatHistory.__table__.indexes:
+        index.create(bind=engine, checkfirst=True)
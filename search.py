@@ -0,0 +1,195 @@
+# search.py
+"""
+Full-text search over ChatHistory.message.
+
+The index depends on the database:
+
+    SQLite  an FTS5 table, chat_history_fts, over chat_history (external
+            content, so the text isn't stored twice; chat_id is indexed
+            too so searching one room is an index lookup), kept in sync by
+            AFTER INSERT / UPDATE / DELETE triggers - every write path,
+            including write_behind's batches and journal replays, is
+            covered without any Python hook. Ranked by bm25.
+    MySQL   a FULLTEXT index on chat_history.message, which InnoDB
+            maintains itself. Ranked by MATCH ... AGAINST relevance.
+    other   no index; falls back to a LIKE scan.
+
+ensure_index() creates whatever is missing at start-up (building the FTS
+table from existing rows the first time). rebuild() recreates it from
+scratch - run `flask --app app search-rebuild` after restoring a backup or
+if the index is suspected to be out of step.
+
+Queries are reduced to words, all of which must match (the last one as a
+prefix, so partial words find something); results come a page at a time,
+best first, for one room or across all of them. On SQLite "best" is among
+the newest SEARCH_MAX_CANDIDATES matches, which keeps a common word from
+costing a scan of the whole index.
+"""
+import os
+import re
+
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import OperationalError
+
+from extensions import db
+import tracing
+import write_behind
+
+log = tracing.get_logger(__name__)
+
+PAGE_SIZE = int(os.environ.get('SEARCH_PAGE_SIZE', '20'))
+MAX_CANDIDATES = int(os.environ.get('SEARCH_MAX_CANDIDATES', '2000'))
+SNIPPET_CHARS = 160
+MAX_TERMS = 16
+
+FTS_TABLE = 'chat_history_fts'
+FULLTEXT_INDEX = 'ft_chat_history_message'
+
+_backend = None  # 'fts5', 'fulltext' or 'like', set by ensure_index
+
+_SQLITE_SETUP = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    f"message, chat_id, content='chat_history', content_rowid='id')",
+    f"CREATE TRIGGER IF NOT EXISTS chat_history_fts_insert AFTER INSERT ON chat_history BEGIN "
+    f"INSERT INTO {FTS_TABLE}(rowid, message, chat_id) VALUES (new.id, new.message, new.chat_id); END",
+    f"CREATE TRIGGER IF NOT EXISTS chat_history_fts_delete AFTER DELETE ON chat_history BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, message, chat_id) "
+    f"VALUES ('delete', old.id, old.message, old.chat_id); END",
+    f"CREATE TRIGGER IF NOT EXISTS chat_history_fts_update AFTER UPDATE OF message, chat_id ON chat_history BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, message, chat_id) "
+    f"VALUES ('delete', old.id, old.message, old.chat_id); "
+    f"INSERT INTO {FTS_TABLE}(rowid, message, chat_id) VALUES (new.id, new.message, new.chat_id); END",
+]
+
+
+def _mysql_has_index(conn):
+    return any(index['name'] == FULLTEXT_INDEX for index in inspect(conn).get_indexes('chat_history'))
+
+
+def ensure_index(engine):
+    """Create the search index for this database if it doesn't exist yet."""
+    global _backend
+    dialect = engine.dialect.name
+    try:
+        if dialect == 'sqlite':
+            with engine.begin() as conn:
+                existed = inspect(conn).has_table(FTS_TABLE)
+                for statement in _SQLITE_SETUP:
+                    conn.execute(text(statement))
+                if not existed:
+                    conn.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+                    log.info("Built the full-text index")
+            _backend = 'fts5'
+        elif dialect in ('mysql', 'mariadb'):
+            with engine.begin() as conn:
+                if not _mysql_has_index(conn):
+                    log.info("Adding the FULLTEXT index to chat_history (may take a while)")
+                    conn.execute(text(f"ALTER TABLE chat_history ADD FULLTEXT INDEX {FULLTEXT_INDEX} (message)"))
+            _backend = 'fulltext'
+        else:
+            _backend = 'like'
+    except OperationalError as e:
+        # e.g. an SQLite build without FTS5
+        log.warning("Full-text index unavailable; search will scan", error=str(e))
+        _backend = 'like'
+    return _backend
+
+
+def rebuild(engine):
+    """Recreate the search index from chat_history. Returns the number of rows it covers."""
+    dialect = engine.dialect.name
+    write_behind.settle()
+    with engine.begin() as conn:
+        if dialect == 'sqlite':
+            conn.execute(text(f"DROP TABLE IF EXISTS {FTS_TABLE}"))
+            for statement in _SQLITE_SETUP:
+                conn.execute(text(statement))
+            conn.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+        elif dialect in ('mysql', 'mariadb'):
+            if _mysql_has_index(conn):
+                conn.execute(text(f"ALTER TABLE chat_history DROP INDEX {FULLTEXT_INDEX}"))
+            conn.execute(text(f"ALTER TABLE chat_history ADD FULLTEXT INDEX {FULLTEXT_INDEX} (message)"))
+        return conn.execute(text("SELECT COUNT(*) FROM chat_history")).scalar()
+
+
+def terms(query):
+    """The words of a search query, lower-cased, at most MAX_TERMS."""
+    return re.findall(r"\w+", (query or "").lower())[:MAX_TERMS]
+
+
+def _snippet(message, words):
+    """Up to SNIPPET_CHARS of 'message' around the first matching word."""
+    if len(message) <= SNIPPET_CHARS:
+        return message
+    lowered = message.lower()
+    found = [i for i in (lowered.find(w) for w in words) if i >= 0]
+    start = max(0, min(found) - SNIPPET_CHARS // 4) if found else 0
+    end = min(len(message), start + SNIPPET_CHARS)
+    start = max(0, end - SNIPPET_CHARS)
+    return ("…" if start else "") + message[start:end].strip() + ("…" if end < len(message) else "")
+
+
+def _match_sql(words, chat_id):
+    """(FROM/WHERE clause, ORDER BY expression, parameters) for the active backend."""
+    if _backend == 'fts5':
+        # Each word quoted (so nothing is read as FTS5 syntax), the last as a
+        # prefix. Only the newest MAX_CANDIDATES matches are ranked: FTS5 walks
+        # them in rowid order and stops, instead of scoring every message with
+        # a common word in it.
+        match = "message : (" + " ".join(f'"{w}"' for w in words) + "*)"
+        if chat_id is not None:
+            match = f'chat_id : "{int(chat_id)}" AND {match}'
+        return (f"FROM (SELECT rowid AS id, bm25({FTS_TABLE}, 1.0, 0.0) AS score FROM {FTS_TABLE} "
+                f"WHERE {FTS_TABLE} MATCH :match ORDER BY rowid DESC LIMIT :candidates) m "
+                f"JOIN chat_history h ON h.id = m.id JOIN chat c ON c.id = h.chat_id",
+                "m.score, h.id DESC", {'match': match, 'candidates': MAX_CANDIDATES})
+
+    params = {}
+    room = ""
+    if chat_id is not None:
+        room = " AND h.chat_id = :chat_id"
+        params['chat_id'] = int(chat_id)
+    if _backend == 'fulltext':
+        params['match'] = " ".join(f"+{w}" for w in words) + "*"
+        return ("FROM chat_history h JOIN chat c ON c.id = h.chat_id "
+                f"WHERE MATCH(h.message) AGAINST (:match IN BOOLEAN MODE){room}",
+                "MATCH(h.message) AGAINST (:match IN BOOLEAN MODE) DESC, h.id DESC", params)
+    params.update({f'w{i}': f"%{w}%" for i, w in enumerate(words)})
+    where = " AND ".join(f"LOWER(h.message) LIKE :w{i}" for i in range(len(words)))
+    return f"FROM chat_history h JOIN chat c ON c.id = h.chat_id WHERE {where}{room}", "h.id DESC", params
+
+
+def search(query, chat_id=None, page=1, per_page=None):
+    """
+    One page of messages matching 'query', best first, in the room with id
+    'chat_id' or in every room. Returns (results, has_more); each result is
+    a dict with the message, a snippet and the room it is in.
+    """
+    words = terms(query)
+    if not words:
+        return [], False
+    if _backend is None:
+        ensure_index(db.engine)
+    per_page = per_page or PAGE_SIZE
+    page = max(1, int(page))
+    write_behind.settle(chat_id)  # Make pending messages findable
+
+    source, order, params = _match_sql(words, chat_id)
+    params.update(limit=per_page + 1, offset=(page - 1) * per_page)
+
+    with tracing.span('search', backend=_backend):
+        rows = db.session.execute(text(
+            "SELECT h.id, h.room_message_id, h.timestamp, h.sender_name, h.message, c.join_code, c.title "
+            f"{source} ORDER BY {order} LIMIT :limit OFFSET :offset"
+        ), params).all()
+
+    results = [{
+        'db_id': row.id,
+        'room_message_id': row.room_message_id,
+        'timestamp': row.timestamp.isoformat() if hasattr(row.timestamp, 'isoformat') else row.timestamp,
+        'username': row.sender_name or 'Anonymous',
+        'snippet': _snippet(row.message, words),
+        'chat_id': row.join_code,
+        'chat_title': row.title,
+    } for row in rows[:per_page]]
+    return results, len(rows) > per_page
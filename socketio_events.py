@@ -1,18 +1,31 @@
-from flask import session, current_app
+from flask import session, current_app, request
 from flask_socketio import join_room, leave_room, emit
 from extensions import socketio, db
-from models import Chat, ChatHistory
+from models import Chat, ChatHistory, ChatDeletion
 from datetime import datetime
-from sqlalchemy import func
+import history_cache
+import job_queue
+import metrics
+import presence
+import search
+import summary_memory
+import tracing
+import write_behind
 import uuid  # For generating anonymous usernames
 
-# Tracks participants in each chat room (key=join_code, value=set of user names)
-participants = {}
+log = tracing.get_logger(__name__)
+
+# Tracks participants in each chat room (by join_code); in-process or shared
+# between workers depending on PRESENCE_BACKEND (see presence.py)
+participants = presence.store
+# Which rooms each of this worker's connections joined, so they can be left on disconnect
+sessions = presence.sessions
 
 # REMOVE this line, as we no longer load personalities here:
 # personalities = load_personalities()
 
 @socketio.on('join')
+@tracing.socket_event('join')
 def handle_join(data):
     """
     Handle a user (authenticated or anonymous) joining the chat room.
@@ -22,27 +35,27 @@ def handle_join(data):
     chat_uuid = str(data.get('chat_id'))
     username = data.get('username')
 
-    print(f"DEBUG: Checking chat join attempt for chat_id: {chat_uuid}, username: {username}")
+    log.debug("Join attempt", username=username)
 
     # Look up the chat by its join_code
     chat = Chat.query.filter_by(join_code=chat_uuid).first()
     if not chat:
-        print(f"DEBUG: Chat not found for join_code: {chat_uuid}")
+        log.info("Join for unknown chat")
         emit('status', {'msg': 'Error: Chat room not found.'})
         return
 
-    print(f"DEBUG: Chat found! Title={chat.title}, allow_anonymous={chat.allow_anonymous}")
+    log.debug("Chat found", title=chat.title, allow_anonymous=chat.allow_anonymous)
 
     # If the chat requires authentication, ensure user is logged in
     if not chat.allow_anonymous and 'user_id' not in session:
-        print("DEBUG: Access denied - user must be authenticated.")
+        log.info("Join denied, authentication required")
         emit('status', {'msg': 'Error: Authentication required for this chat.'})
         return
 
     # If user is not authenticated, assign an anonymous name
     if 'user_id' not in session:
         username = f"anon-{uuid.uuid4().hex[:3]}"
-        print(f"DEBUG: Assigned anonymous username: {username}")
+        log.debug("Assigned anonymous username", username=username)
     else:
         # Optionally, override the username with session data, if you prefer
         # username = session.get('username')
@@ -51,35 +64,81 @@ def handle_join(data):
     # Join this chat room by its join_code
     join_room(chat_uuid)
 
-    # Update the participants dictionary
-    if chat_uuid not in participants:
-        participants[chat_uuid] = set()
-    participants[chat_uuid].add(username)
+    # Update the participants store
+    if sessions.add(request.sid, chat_uuid, username):
+        participants.hold(chat_uuid, username)
+    participants.add(chat_uuid, username)
+    current_participants = participants.members(chat_uuid)
 
-    print(f"DEBUG: Current participants in {chat_uuid}: {participants[chat_uuid]}")
+    log.debug("Joined", username=username, participants=len(current_participants))
 
     # Notify the room of a participant update and a status message
-    emit('participant_update', {'participants': list(participants[chat_uuid])}, room=chat_uuid)
+    emit('participant_update', {'participants': current_participants}, room=chat_uuid)
     emit('status', {'msg': f'{username} has entered the chat.'}, room=chat_uuid)
 
+    # A client that already has part of the room (e.g. reconnecting after a
+    # dropped websocket) only needs what it missed, not a full page reload.
+    if data.get('last_seen') is not None:
+        _emit_resync(chat, data)
+
+
+def _emit_resync(chat, data):
+    """
+    Send the requesting client the messages after its last seen
+    room_message_id and the deletions after its last seen tombstone id.
+    """
+    try:
+        last_seen = int(data.get('last_seen'))
+        last_deletion = int(data.get('last_deletion') or 0)
+    except (TypeError, ValueError):
+        return
+
+    messages, complete = history_cache.get_since(chat.id, last_seen)
+    deletions = ChatDeletion.query.filter(ChatDeletion.chat_id == chat.id, ChatDeletion.id > last_deletion) \
+                                  .order_by(ChatDeletion.id).all()
+
+    log.debug("Resync", messages=len(messages), deletions=len(deletions), since=last_seen)
+
+    emit('resync', {
+        'messages': [{
+            'room_message_id': m.room_message_id,
+            'username': m.sender_name or 'Anonymous',
+            'message': m.message,
+            'db_id': m.id
+        } for m in messages],
+        'deleted': [d.message_id for d in deletions],
+        'last_deletion': deletions[-1].id if deletions else last_deletion,
+        'complete': complete
+    })
+
 
 @socketio.on('leave')
+@tracing.socket_event('leave')
 def handle_leave(data):
     """
     Remove a user from the chat room (on page unload or explicit leave).
+    The name comes from what this connection joined as, not from the
+    client, so anonymous users (whose name the server picked) leave too.
     """
     chat_uuid = str(data.get('chat_id'))
-    username = data.get('username')
 
     leave_room(chat_uuid)
-    if chat_uuid in participants and username in participants[chat_uuid]:
-        participants[chat_uuid].remove(username)
-        print(f"{username} left room {chat_uuid}")
-        emit('participant_update', {'participants': list(participants[chat_uuid])}, room=chat_uuid)
-        emit('status', {'msg': f'{username} has left the chat.'}, room=chat_uuid)
+    _left(chat_uuid, sessions.leave(request.sid, chat_uuid))
+
+
+def _left(chat_uuid, usernames):
+    """Release users this worker has no connection for any more and tell the room about those that left."""
+    gone = [username for username in usernames if participants.release(chat_uuid, username)]
+    if not gone:
+        return
+    log.debug("Left", usernames=gone)
+    socketio.emit('participant_update', {'participants': participants.members(chat_uuid)}, room=chat_uuid)
+    for username in gone:
+        socketio.emit('status', {'msg': f'{username} has left the chat.'}, room=chat_uuid)
 
 
 @socketio.on('chat_message')
+@tracing.socket_event('chat_message')
 def handle_chat_message(data):
     """
     Broadcast a new human message to the chat room and handle AI responses.
@@ -93,88 +152,127 @@ def handle_chat_message(data):
     # Convert the join_code -> numeric ID for storing in ChatHistory
     chat = Chat.query.filter_by(join_code=chat_uuid).first()
     if not chat:
-        print(f"DEBUG: Chat room not found for join_code={chat_uuid}")
+        log.info("Message for unknown chat")
         emit('status', {'msg': 'Error: Chat not found.'})
         return
 
     numeric_chat_id = str(chat.id)
 
-    # Figure out the next message number for the room
-    max_room_msg_id = db.session.query(func.max(ChatHistory.room_message_id)) \
-                          .filter_by(chat_id=numeric_chat_id).scalar() or 0
-
     # Create the new message row in DB
-    new_message = ChatHistory(
+    new_message = history_cache.commit_message(ChatHistory(
         chat_id=numeric_chat_id,
         sender_id=sender_id,
         sender_name=username,
-        message=message,
-        room_message_id=max_room_msg_id + 1
-    )
-    db.session.add(new_message)
-    db.session.commit()
+        message=message
+    ))
+    tracing.annotate(trace=tracing.trace_id(new_message.id))
 
     # Broadcast the new message to all participants in chat_uuid
-    emit('chat_message', {
-        'room_message_id': new_message.room_message_id,
-        'username': username,
-        'message': message,
-        'db_id': new_message.id  # So new messages can be deleted in real time
-    }, room=chat_uuid, include_self=True)
-
-    # Gather full context for the AI:
-    chat_title = chat.title  # The chat's name
-    current_participants = list(participants.get(chat_uuid, set()))  # All users in the chat
-    full_history = ChatHistory.query.filter_by(chat_id=numeric_chat_id).order_by(ChatHistory.id).all()  # Entire conversation
-
-    # Use current_app to get the single loaded personalities
-    from flask import current_app
-    all_personalities = current_app.loaded_personalities
+    with tracing.span('emit'):
+        emit('chat_message', {
+            'room_message_id': new_message.room_message_id,
+            'username': username,
+            'message': message,
+            'db_id': new_message.id  # So new messages can be deleted in real time
+        }, room=chat_uuid, include_self=True)
+
+    # Queue one reply job per AI personality in the room and return straight
+    # away; the job_queue workers run the plugins and emit their replies.
+    current_participants = participants.members(chat_uuid)  # All users in the chat
+    app = current_app._get_current_object()
+    summary_memory.note_new_message(app, chat.id)
+    queued = job_queue.enqueue_replies(
+        chat,
+        new_message,
+        current_participants,
+        username,
+        app.loaded_personalities
+    )
+    if queued:
+        job_queue.ensure_worker(app)
+        log.debug("Queued AI reply jobs", count=queued)
+
 
-    # Loop through AI personalities in the room
-    for personality_name in current_participants:
-        # If personality_name is in the dictionary
-        if personality_name in all_personalities and username != personality_name:
-            # Print debug info about what we'll pass
-            print("\n===== AI Debug =====")
-            print(f"Chat Title: {chat_title}")
-            print(f"Participants: {current_participants}")
-            print(f"History Count: {len(full_history)}")
-            print(f"Latest User Message: {message}")
-            print(f"AI Personality: {personality_name}")
-            print("===== End Debug ====\n")
-
-            # Retrieve the plugin module
-            plugin_module = all_personalities[personality_name]["module"]
-
-            # Suppose plugin's signature is generate_response(title, participants, history, latest_user_msg)
-            ai_response = plugin_module.generate_response(
-                chat_title,
-                current_participants,
-                full_history,
-                message
-            )
-
-            if ai_response.strip() and len(ai_response.split()) >= 3:
-                new_ai_msg = ChatHistory(
-                    chat_id=numeric_chat_id,
-                    sender_id=-1,
-                    sender_name=personality_name,
-                    message=ai_response,
-                    room_message_id=max_room_msg_id + 2
-                )
-                db.session.add(new_ai_msg)
-                db.session.commit()
-
-                emit('chat_message', {
-                    'room_message_id': new_ai_msg.room_message_id,
-                    'username': personality_name,
-                    'message': ai_response,
-                    'db_id': new_ai_msg.id
-                }, room=chat_uuid, include_self=True)
+@socketio.on('load_older')
+@tracing.socket_event('load_older')
+def handle_load_older(data):
+    """
+    Page backwards through a room's history for infinite scroll.
+    chat_id   = join_code (UUID)
+    before    = room_message_id of the oldest message the client has
+    before_id = that message's ChatHistory.id (tie-breaker for the keyset)
+    Replies (to the requester only) with 'older_messages'.
+    """
+    chat_uuid = str(data.get('chat_id'))
+    chat = Chat.query.filter_by(join_code=chat_uuid).first()
+    if not chat:
+        emit('status', {'msg': 'Error: Chat not found.'})
+        return
+    if not chat.allow_anonymous and 'user_id' not in session:
+        emit('status', {'msg': 'Error: Authentication required for this chat.'})
+        return
+
+    try:
+        before = int(data['before'])
+        before_id = int(data['before_id'])
+    except (KeyError, TypeError, ValueError):
+        before = before_id = None
+
+    messages, has_more = history_cache.get_page(chat.id, before, before_id,
+                                                limit=current_app.config['CHAT_PAGE_SIZE'])
+
+    emit('older_messages', {
+        'messages': [{
+            'room_message_id': m.room_message_id,
+            'username': m.sender_name or 'Anonymous',
+            'message': m.message,
+            'db_id': m.id
+        } for m in messages],
+        'has_more': has_more
+    })
+
+
+@socketio.on('search_messages')
+@tracing.socket_event('search_messages')
+def handle_search_messages(data):
+    """
+    Full-text search of chat history, best matches first.
+    chat_id = join_code (UUID) of the room to search; omitted = every room (admins only)
+    query   = the words to look for
+    page    = 1-based page number
+    Replies (to the requester only) with 'search_results'.
+    """
+    query = str(data.get('query') or '')
+    chat = None
+    if data.get('chat_id'):
+        chat = Chat.query.filter_by(join_code=str(data['chat_id'])).first()
+        if not chat:
+            emit('status', {'msg': 'Error: Chat not found.'})
+            return
+        if not chat.allow_anonymous and 'user_id' not in session:
+            emit('status', {'msg': 'Error: Authentication required for this chat.'})
+            return
+    elif not session.get('is_admin'):
+        emit('status', {'msg': 'Error: Only admins can search every chat.'})
+        return
+
+    try:
+        page = max(1, int(data.get('page', 1)))
+    except (TypeError, ValueError):
+        page = 1
+
+    results, has_more = search.search(query, chat.id if chat else None, page=page)
+    emit('search_results', {
+        'query': query,
+        'chat_id': chat.join_code if chat else None,
+        'page': page,
+        'results': results,
+        'has_more': has_more
+    })
 
 
 @socketio.on('delete_message')
+@tracing.socket_event('delete_message')
 def handle_delete_message(data):
     """
     Allows an admin to prune a specific message from the DB, in real time.
@@ -186,24 +284,32 @@ def handle_delete_message(data):
 
     # Enforce admin check
     if not session.get('is_admin'):
-        print("DEBUG: Non-admin user tried to delete a message.")
+        log.info("Delete denied, not an admin", message_id=message_id)
         emit('status', {'msg': 'Error: Not authorized to delete messages.'}, room=chat_uuid)
         return
 
-    # Attempt to delete the row
+    # Attempt to delete the row, leaving a tombstone for reconnecting clients
+    write_behind.settle()
+    row = db.session.get(ChatHistory, message_id)
     deleted_rows = ChatHistory.query.filter_by(id=message_id).delete()
+    tombstone = None
+    if deleted_rows:
+        tombstone = ChatDeletion(chat_id=row.chat_id, message_id=row.id, room_message_id=row.room_message_id)
+        db.session.add(tombstone)
     db.session.commit()
 
     if deleted_rows:
-        print(f"DEBUG: Message {message_id} deleted from chat {chat_uuid}.")
+        history_cache.remove_message(row.chat_id, message_id)
+        log.debug("Message deleted", message_id=message_id)
         # Notify all clients in this chat room to remove the message
-        emit('message_deleted', {'message_id': message_id}, room=chat_uuid)
+        emit('message_deleted', {'message_id': message_id, 'deletion_id': tombstone.id}, room=chat_uuid)
     else:
-        print(f"DEBUG: Message {message_id} not found.")
+        log.debug("Message to delete not found", message_id=message_id)
         emit('status', {'msg': f'Error: Message {message_id} not found.'}, room=chat_uuid)
 
 
 @socketio.on('add_personality')
+@tracing.socket_event('add_personality')
 def handle_add_personality(data):
     """
     Add an AI personality to the chat.
@@ -211,7 +317,6 @@ def handle_add_personality(data):
     chat_uuid = str(data.get('chat_id'))
     personality_name = data.get('personality')
 
-    print(f"DEBUG: Received add_personality event for chat={chat_uuid}, AI={personality_name}")
 
     from flask import current_app
     all_personalities = current_app.loaded_personalities
@@ -222,19 +327,16 @@ def handle_add_personality(data):
 
     join_room(chat_uuid)
 
-    if chat_uuid not in participants:
-        participants[chat_uuid] = set()
-
-    if personality_name not in participants[chat_uuid]:
-        participants[chat_uuid].add(personality_name)
-        print(f"DEBUG: Added AI '{personality_name}' to room={chat_uuid}")
-        emit('participant_update', {'participants': list(participants[chat_uuid])}, room=chat_uuid)
+    if participants.add(chat_uuid, personality_name, is_ai=True):
+        log.debug("Added AI", personality=personality_name)
+        emit('participant_update', {'participants': participants.members(chat_uuid)}, room=chat_uuid)
         emit('status', {'msg': f'{personality_name} has joined the chat.'}, room=chat_uuid)
     else:
-        print(f"DEBUG: AI '{personality_name}' was already in the room={chat_uuid}")
+        log.debug("AI already in the room", personality=personality_name)
 
 
 @socketio.on('remove_personality')
+@tracing.socket_event('remove_personality')
 def handle_remove_personality(data):
     """
     Remove an AI personality from the chat.
@@ -242,15 +344,27 @@ def handle_remove_personality(data):
     chat_uuid = str(data.get('chat_id'))
     personality_name = data.get('personality')
 
-    print(f"DEBUG: remove_personality for chat={chat_uuid}, AI={personality_name}")
-
-    if chat_uuid in participants and personality_name in participants[chat_uuid]:
-        participants[chat_uuid].remove(personality_name)
-        print(f"DEBUG: AI '{personality_name}' removed from room={chat_uuid}")
-        emit('participant_update', {'participants': list(participants[chat_uuid])}, room=chat_uuid)
+    if participants.discard(chat_uuid, personality_name):
+        log.debug("Removed AI", personality=personality_name)
+        emit('participant_update', {'participants': participants.members(chat_uuid)}, room=chat_uuid)
         emit('status', {'msg': f'{personality_name} has left the chat.'}, room=chat_uuid)
 
 
+@socketio.on('connect')
+def handle_connect():
+    metrics.inc('socket_events_total', event='connect')
+    # Make sure this process is working through the AI job queue, including
+    # any jobs left over from before a restart.
+    job_queue.ensure_worker(current_app._get_current_object())
+
+
 @socketio.on('disconnect')
 def handle_disconnect():
-    print("A user disconnected")
+    """A closed tab, dropped network or crashed browser: leave every room this connection joined."""
+    metrics.inc('socket_events_total', event='disconnect')
+    rooms = {}
+    for chat_uuid, username in sessions.drop(request.sid):
+        rooms.setdefault(chat_uuid, []).append(username)
+    for chat_uuid, usernames in rooms.items():
+        _left(chat_uuid, usernames)
+    log.debug("Client disconnected", rooms=len(rooms))
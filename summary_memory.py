@@ -0,0 +1,153 @@
+# summary_memory.py
+"""
+Incremental rolling summary per room.
+
+Even a windowed prompt eventually loses a long room's early context, and
+resending a long tail is expensive on the dearer models. Instead each room
+keeps one ChatSummary row covering everything up to 'through_message_id'.
+Every SUMMARY_EVERY new messages a background task asks a cheap personality
+(SUMMARY_PERSONALITY) to fold the next batch into the existing summary.
+The most recent SUMMARY_KEEP_RECENT messages are never summarised, so
+plugins always see the live tail verbatim. After a failed update (an error
+or an "Error: ..." reply) the room isn't retried until SUMMARY_RETRY_SECONDS
+have passed or another SUMMARY_EVERY messages have arrived, so a failing
+summariser isn't paid for on every message.
+
+Plugins that accept a 'summary' keyword get the summary and hand it to
+context_builder.build_messages, which sends it as a prefix in place of the
+messages it covers.
+
+The summarising plugin must provide:
+    summarize(previous_summary, messages) -> str
+"""
+import os
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+
+from extensions import socketio, db, plugin_module as load_plugin
+from models import ChatSummary
+import history_cache
+import tracing
+
+log = tracing.get_logger(__name__)
+
+SUMMARY_EVERY = int(os.environ.get('SUMMARY_EVERY', '50'))
+SUMMARY_KEEP_RECENT = int(os.environ.get('SUMMARY_KEEP_RECENT', '20'))
+SUMMARY_PERSONALITY = os.environ.get('SUMMARY_PERSONALITY', 'Cassie (ChatGPT 4o Mini)')
+SUMMARY_RETRY_SECONDS = int(os.environ.get('SUMMARY_RETRY_SECONDS', '300'))
+
+RoomSummary = namedtuple('RoomSummary', ['text', 'through_message_id', 'message_count'])
+
+_lock = threading.Lock()
+_summaries = {}    # chat_id -> RoomSummary, or None if the room has no summary yet
+_in_flight = set()  # chat_ids with a summary update running
+_failures = {}      # chat_id -> (monotonic time, room's newest message id) of its last failed update
+
+
+def get_summary(chat_id):
+    """The room's current summary (a RoomSummary), or None."""
+    chat_id = int(chat_id)
+    with _lock:
+        if chat_id in _summaries:
+            return _summaries[chat_id]
+
+    row = db.session.get(ChatSummary, chat_id)
+    summary = RoomSummary(row.summary, row.through_message_id, row.message_count) if row else None
+    with _lock:
+        _summaries.setdefault(chat_id, summary)
+        return _summaries[chat_id]
+
+
+def _pending_messages(chat_id, summary):
+    """Messages old enough to summarise that the summary doesn't cover yet."""
+    history = history_cache.get_history(chat_id)
+    if len(history) <= SUMMARY_KEEP_RECENT:
+        return []
+    candidates = history[:len(history) - SUMMARY_KEEP_RECENT]
+    through = summary.through_message_id if summary else 0
+    return [m for m in candidates if m.id > through]
+
+
+def note_new_message(app, chat_id):
+    """
+    Called after a message is stored. Starts a background summary update
+    once enough unsummarised messages have built up in the room.
+    """
+    if SUMMARY_EVERY <= 0 or SUMMARY_PERSONALITY not in app.loaded_personalities:
+        return
+    chat_id = int(chat_id)
+    with _lock:
+        if chat_id in _in_flight:
+            return
+        failed = _failures.get(chat_id)
+
+    if failed is not None and time.monotonic() - failed[0] < SUMMARY_RETRY_SECONDS \
+            and history_cache.count_after(chat_id, failed[1]) < SUMMARY_EVERY:
+        return  # Backing off after a failed update
+
+    # Same count as len(_pending_messages(...)), without copying the room
+    summary = get_summary(chat_id)
+    unsummarised = history_cache.count_after(chat_id, summary.through_message_id if summary else 0)
+    if unsummarised - SUMMARY_KEEP_RECENT < SUMMARY_EVERY:
+        return
+
+    with _lock:
+        if chat_id in _in_flight:
+            return
+        _in_flight.add(chat_id)
+    socketio.start_background_task(_update_summary, app, chat_id)
+
+
+def _failed(chat_id, newest_id):
+    with _lock:
+        _failures[chat_id] = (time.monotonic(), newest_id)
+
+
+def _update_summary(app, chat_id):
+    newest_id = 0
+    try:
+        with app.app_context():
+            newest = history_cache.newest(chat_id)
+            newest_id = newest.id if newest else 0
+            summary = get_summary(chat_id)
+            batch = _pending_messages(chat_id, summary)
+            if not batch:
+                return
+
+            plugin_module = load_plugin(app.loaded_personalities[SUMMARY_PERSONALITY])
+            text = plugin_module.summarize(summary.text if summary else "", batch)
+            if not text or not text.strip() or text.startswith("Error:"):
+                log.warning("⚠️ Summary update produced no usable text", chat_id=chat_id, text=repr(text))
+                _failed(chat_id, newest_id)
+                return
+
+            covered = (summary.message_count if summary else 0) + len(batch)
+            row = db.session.get(ChatSummary, chat_id)
+            if row is None:
+                row = ChatSummary(chat_id=chat_id)
+                db.session.add(row)
+            row.summary = text.strip()
+            row.through_message_id = batch[-1].id
+            row.message_count = covered
+            row.updated_at = datetime.utcnow()
+            db.session.commit()
+
+            with _lock:
+                _summaries[chat_id] = RoomSummary(text.strip(), batch[-1].id, covered)
+                _failures.pop(chat_id, None)
+            log.debug("Summary updated", chat_id=chat_id, covers=covered, through_id=batch[-1].id)
+    except Exception as e:
+        log.error("⚠️ Summary update failed", chat_id=chat_id, error=str(e), exc_info=True)
+        _failed(chat_id, newest_id)
+    finally:
+        with _lock:
+            _in_flight.discard(chat_id)
+
+
+def forget_room(chat_id):
+    """Drop the cached summary (e.g. when the chat is deleted)."""
+    with _lock:
+        _summaries.pop(int(chat_id), None)
+        _failures.pop(int(chat_id), None)
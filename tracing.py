@@ -0,0 +1,217 @@
+# tracing.py
+"""
+Structured, leveled logging and timing spans.
+
+The hot paths used to print() several DEBUG lines per Socket.IO event, and
+every plugin printed the whole chat history on every call - synchronous
+stdout writes that grew with the room. Modules now log through
+
+    log = tracing.get_logger(__name__)
+    log.debug("Queued AI reply jobs", count=3)
+
+which checks the level before building anything, so a disabled DEBUG line
+costs one method call. Each line carries key=value fields plus the
+correlation fields bound for the current event: Socket.IO handlers bind
+'room' (the join code) and 'event', and work done for one chat message
+(its reply jobs, plugin calls and emits) shares 'trace' = "m<message id>".
+
+Spans time the stages of a reply - history_load, prompt_build,
+provider_call, db_commit and emit. Totals per span are always kept (see
+span_stats, reported by /admin/jobs); each span is also logged at DEBUG.
+
+Settings (env):
+    LOG_LEVEL        DEBUG, INFO (default), WARNING or ERROR
+    LOG_FORMAT       text (default) or json, one object per line
+    LOG_SAMPLE_RATE  fraction of DEBUG lines kept (default 1.0); INFO and
+                     above are never sampled
+    LOG_HISTORY      1 to let plugins dump the full chat history at DEBUG
+                     (default 0, only the message count is logged)
+"""
+import contextvars
+import functools
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import metrics
+
+LEVEL = getattr(logging, os.environ.get('LOG_LEVEL', 'INFO').upper(), logging.INFO)
+FORMAT = os.environ.get('LOG_FORMAT', 'text').lower()
+SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', '1.0'))
+HISTORY_DUMPS = os.environ.get('LOG_HISTORY', '0') == '1'
+
+NAMESPACE = 'aimultichat'
+
+_context = contextvars.ContextVar('tracing_context', default={})
+_span_lock = threading.Lock()
+_span_totals = {}  # span name -> [count, total seconds, max seconds]
+
+
+class _Formatter(logging.Formatter):
+    def format(self, record):
+        fields = getattr(record, 'fields', None) or {}
+        name = record.name[len(NAMESPACE) + 1:] if record.name.startswith(NAMESPACE + '.') else record.name
+        if FORMAT == 'json':
+            entry = {
+                'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+                'level': record.levelname,
+                'logger': name,
+                'event': record.getMessage(),
+            }
+            entry.update(fields)
+            if record.exc_info:
+                entry['exc'] = self.formatException(record.exc_info)
+            return json.dumps(entry, default=str, ensure_ascii=False)
+
+        line = f"{self.formatTime(record)} {record.levelname} {name}: {record.getMessage()}"
+        if fields:
+            line += " " + " ".join(f"{k}={v}" for k, v in fields.items())
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+def _configure():
+    root = logging.getLogger(NAMESPACE)
+    if not root.handlers:
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(_Formatter())
+        root.addHandler(handler)
+    root.setLevel(LEVEL)
+    root.propagate = False
+
+
+_configure()
+
+
+class Logger:
+    """A named logger taking an event message plus key=value fields."""
+
+    __slots__ = ('_logger',)
+
+    def __init__(self, name):
+        self._logger = logging.getLogger(f"{NAMESPACE}.{name}")
+
+    def enabled(self, level=logging.DEBUG):
+        return self._logger.isEnabledFor(level)
+
+    def debug(self, event, **fields):
+        if self._logger.isEnabledFor(logging.DEBUG) and (SAMPLE_RATE >= 1.0 or random.random() < SAMPLE_RATE):
+            self._log(logging.DEBUG, event, fields)
+
+    def info(self, event, **fields):
+        if self._logger.isEnabledFor(logging.INFO):
+            self._log(logging.INFO, event, fields)
+
+    def warning(self, event, **fields):
+        if self._logger.isEnabledFor(logging.WARNING):
+            self._log(logging.WARNING, event, fields)
+
+    def error(self, event, exc_info=False, **fields):
+        if self._logger.isEnabledFor(logging.ERROR):
+            self._log(logging.ERROR, event, fields, exc_info)
+
+    def _log(self, level, event, fields, exc_info=False):
+        bound = _context.get()
+        if bound:
+            fields = {**bound, **fields}
+        self._logger.log(level, event, exc_info=exc_info, extra={'fields': fields})
+
+
+def get_logger(name):
+    return Logger(name)
+
+
+@contextmanager
+def bind(**fields):
+    """Add correlation fields to every line logged inside the block."""
+    token = _context.set({**_context.get(), **{k: v for k, v in fields.items() if v is not None}})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+def socket_event(name):
+    """
+    Decorator for Socket.IO handlers that take a data dict: binds 'event'
+    and 'room' (the data's chat_id) for everything logged while handling it,
+    and counts the event for /metrics.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(data, *args):
+            metrics.inc('socket_events_total', event=name)
+            room = data.get('chat_id') if isinstance(data, dict) else None
+            with bind(event=name, room=str(room) if room else None):
+                return func(data, *args)
+        return wrapper
+    return decorator
+
+
+def annotate(**fields):
+    """Add fields to the current bind() block, e.g. a trace id once it is known."""
+    _context.set({**_context.get(), **fields})
+
+
+def trace_id(message_id):
+    """Correlation id for everything done about one chat message."""
+    return f"m{message_id}"
+
+
+def record_span(name, seconds, **fields):
+    """Add a measured duration to the span totals and metrics, and log it at DEBUG."""
+    metrics.observe('span_seconds', seconds, span=name)
+    with _span_lock:
+        totals = _span_totals.get(name)
+        if totals is None:
+            totals = _span_totals[name] = [0, 0.0, 0.0]
+        totals[0] += 1
+        totals[1] += seconds
+        if seconds > totals[2]:
+            totals[2] = seconds
+    _span_log.debug("span", span=name, ms=round(seconds * 1000, 2), **fields)
+
+
+@contextmanager
+def span(name, **fields):
+    """Time the block as span 'name'."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, time.perf_counter() - start, **fields)
+
+
+def span_stats():
+    """Count, average and worst time per span."""
+    with _span_lock:
+        totals = {name: list(t) for name, t in _span_totals.items()}
+    return {
+        name: {'count': count, 'avg_ms': round(total / count * 1000, 2), 'max_ms': round(worst * 1000, 2)}
+        for name, (count, total, worst) in totals.items()
+    }
+
+
+def dump_history(log, personality_name, chat_title, participants, chat_history, new_message):
+    """
+    What plugins used to print before each call. Only the sizes are logged
+    unless LOG_HISTORY=1, which adds one line per history entry.
+    """
+    if not log.enabled(logging.DEBUG):
+        return
+    log.debug("Plugin call", personality=personality_name, chat_title=chat_title,
+              participants=len(participants), history=len(chat_history))
+    if HISTORY_DUMPS:
+        for entry in chat_history:
+            log._log(logging.DEBUG, "History", {'sender': entry.sender_name, 'message': entry.message})
+        log._log(logging.DEBUG, "Latest user message", {'message': new_message})
+
+
+_span_log = Logger('spans')
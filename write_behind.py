@@ -0,0 +1,388 @@
+# write_behind.py
+"""
+Write-behind persistence of ChatHistory with group commit (WRITE_BEHIND=1).
+
+Normally every human message and AI reply is its own INSERT + COMMIT on the
+request path. With write-behind, history_cache.commit_message instead:
+
+  - gives the row its ChatHistory.id and room_message_id from a block of
+    both reserved up front (room_sequence.reserve), so it can be emitted to
+    the room - with a db_id clients can delete by - straight away;
+  - appends it to this process's journal file and adds it to the history
+    cache;
+  - leaves the INSERT to a background flusher, which writes everything
+    pending in one transaction once WRITE_BEHIND_BATCH rows have queued up
+    or the oldest has waited WRITE_BEHIND_MAX_DELAY_MS.
+
+Crash safety: a row is in the journal (handed to the OS) before it is
+emitted, so rows lost with a crashed or killed process are inserted by
+recover() when a worker next starts; set WRITE_BEHIND_FSYNC=1 to also fsync
+each append and survive power loss. Replays skip rows that made it to the
+database. After each group commit the journal is cut down to the rows still
+pending by writing a new file and renaming it over the old one, so a crash
+never leaves it half-written. Journals live in WRITE_BEHIND_JOURNAL_DIR, one
+per process, each locked by its owner so recovery only touches those of
+dead processes.
+
+Fallback: when more than WRITE_BEHIND_MAX_PENDING rows are waiting (the
+database is slow or down) a row is inserted synchronously instead, so
+senders feel the backpressure rather than the journal growing without
+bound.
+
+Reads that go to the database (an uncached room) and deletions flush first,
+so they never miss a pending row.
+
+Ids and room numbers are reserved together, WRITE_BEHIND_ROOM_BLOCK at a
+time per room, so within a room id order matches room number order
+whichever worker wrote a row. The flusher reserves a room's next block as
+soon as its last one is in use, without holding the lock senders take, so
+a slow database only holds up a sender that runs out first. With several
+workers writing to the same room each would number its own block, so the
+block defaults to 1 when SOCKETIO_MESSAGE_QUEUE is set. Every insert, with
+or without write-behind, takes its id from the same counter, so a reserved
+id can't be handed to another row; should one be taken anyway (something
+inserting ChatHistory behind room_sequence's back) the flush fails with
+IdCollision and the rows stay pending.
+"""
+import json
+import os
+import socket
+import threading
+import time
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # Not on Windows; recovery then assumes a single process
+    fcntl = None
+
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+from extensions import db
+from models import ChatHistory, Message
+import metrics
+import room_sequence
+import tracing
+
+log = tracing.get_logger(__name__)
+
+ENABLED = os.environ.get('WRITE_BEHIND', '0') == '1'
+MAX_DELAY = int(os.environ.get('WRITE_BEHIND_MAX_DELAY_MS', '50')) / 1000.0
+BATCH = int(os.environ.get('WRITE_BEHIND_BATCH', '200'))
+MAX_PENDING = int(os.environ.get('WRITE_BEHIND_MAX_PENDING', '5000'))
+JOURNAL_DIR = os.environ.get('WRITE_BEHIND_JOURNAL_DIR', os.path.join('instance', 'write_behind'))
+FSYNC = os.environ.get('WRITE_BEHIND_FSYNC', '0') == '1'
+ROOM_BLOCK = int(os.environ.get('WRITE_BEHIND_ROOM_BLOCK',
+                                '1' if os.environ.get('SOCKETIO_MESSAGE_QUEUE') else '50'))
+
+_cond = threading.Condition()   # Guards everything below; notified when rows are queued
+_flush_lock = threading.Lock()  # One flush at a time
+_refill_lock = threading.Lock() # One block reservation at a time
+_pending = []                   # (queued_at, row dict), oldest first
+_pending_rooms = {}             # chat_id -> pending row count
+_blocks = {}                    # chat_id -> _Block of its reserved numbers
+_short = set()                  # chat_ids whose _Block needs a spare
+_journal = None                 # This process's journal file (open, locked) and its path
+_journal_path = None
+_stats = {'queued': 0, 'flushed': 0, 'flushes': 0, 'sync_fallbacks': 0, 'errors': 0, 'recovered': 0,
+          'reserve_waits': 0}
+
+
+class _Block:
+    """
+    A room's reserved numbers: the (id, room_message_id) range being used up
+    and a spare range fetched ahead of time. Only touched with _cond held.
+    """
+    __slots__ = ('next_id', 'next_room_message_id', 'left', 'spare')
+
+    def __init__(self):
+        self.next_id = self.next_room_message_id = self.left = 0
+        self.spare = None  # (first id, first room_message_id) of the next ROOM_BLOCK
+
+    def take(self):
+        """The next (id, room_message_id), or None if both ranges are used up."""
+        if not self.left:
+            if self.spare is None:
+                return None
+            (self.next_id, self.next_room_message_id), self.left, self.spare = self.spare, ROOM_BLOCK, None
+        self.left -= 1
+        self.next_id += 1
+        self.next_room_message_id += 1
+        return self.next_id - 1, self.next_room_message_id - 1
+
+
+def _refill(chat_id):
+    """
+    Reserve a spare block for 'chat_id' if it has none. This is a database
+    round trip, so it runs without _cond: senders with numbers left carry on.
+    """
+    with _refill_lock:
+        with _cond:
+            if _blocks.setdefault(chat_id, _Block()).spare is not None:
+                return
+        spare = room_sequence.reserve(chat_id, ROOM_BLOCK)
+        with _cond:
+            _blocks[chat_id].spare = spare
+
+
+def _refill_spares():
+    """Reserve the spare blocks senders have used up (see persist)."""
+    with _cond:
+        rooms = list(_short)
+    for chat_id in rooms:
+        _refill(chat_id)
+        with _cond:
+            if _blocks[chat_id].spare is not None:
+                _short.discard(chat_id)
+
+
+def _open_locked(path):
+    f = open(path, 'a+', encoding='utf-8')
+    if fcntl:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    return f
+
+
+def _journal_file():
+    """This process's journal, opened (and locked) on first use."""
+    global _journal, _journal_path
+    if _journal is None:
+        os.makedirs(JOURNAL_DIR, exist_ok=True)
+        _journal_path = os.path.join(JOURNAL_DIR, f"{socket.gethostname()}-{os.getpid()}.jsonl")
+        _journal = _open_locked(_journal_path)
+    return _journal
+
+
+def _encode(values):
+    return json.dumps(dict(values, timestamp=values['timestamp'].isoformat()))
+
+
+def _decode(line):
+    values = json.loads(line)
+    values['timestamp'] = datetime.fromisoformat(values['timestamp'])
+    return values
+
+
+def persist(row):
+    """
+    Assign 'row' its ids and queue it for the next group commit (or insert it
+    now if too many rows are already waiting). Returns its Message record.
+    """
+    chat_id = int(row.chat_id)
+    while True:
+        with _cond:
+            block = _blocks.setdefault(chat_id, _Block())
+            numbers = block.take()
+            if numbers is not None:
+                if block.spare is None:
+                    _short.add(chat_id)  # The flusher reserves the next block ahead of time
+                values = {
+                    'id': numbers[0],
+                    'room_message_id': numbers[1],
+                    'timestamp': datetime.utcnow(),
+                    'chat_id': chat_id,
+                    'sender_id': row.sender_id,
+                    'sender_name': row.sender_name,
+                    'message': row.message,
+                }
+                if len(_pending) < MAX_PENDING:
+                    journal = _journal_file()
+                    journal.write(_encode(values) + "\n")
+                    journal.flush()
+                    if FSYNC:
+                        os.fsync(journal.fileno())
+                    _pending.append((time.monotonic(), values))
+                    _pending_rooms[chat_id] = _pending_rooms.get(chat_id, 0) + 1
+                    _stats['queued'] += 1
+                    _cond.notify()
+                    return Message(**values)
+                break
+            _stats['reserve_waits'] += 1
+        # Ran out before the flusher reserved more: reserve a block ourselves
+        _refill(chat_id)
+
+    # Backlogged: pay for a transaction of our own, like WRITE_BEHIND=0 does
+    _stats['sync_fallbacks'] += 1
+    with tracing.span('db_commit'):
+        with db.engine.begin() as conn:
+            conn.execute(ChatHistory.__table__.insert(), [values])
+    metrics.inc('messages_persisted_total', sender='ai' if values['sender_id'] == -1 else 'human')
+    return Message(**values)
+
+
+class IdCollision(RuntimeError):
+    """A reserved ChatHistory id turned out to be held by another row."""
+
+
+def _same_row(existing, values):
+    return tuple(existing) == (values['chat_id'], values['room_message_id'], values['sender_id'],
+                               values['sender_name'], values['message'])
+
+
+def _insert(rows):
+    """
+    Insert 'rows' in one transaction. If that hits a duplicate id, go row by
+    row, skipping rows already there (a replayed journal). An id held by a
+    different row means something inserted ChatHistory without going
+    through room_sequence; that raises IdCollision rather than renumbering,
+    since the id has already gone out to clients and the job queue.
+    """
+    table = ChatHistory.__table__
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(table.insert(), rows)
+        return len(rows)
+    except IntegrityError:
+        log.warning("Group commit hit a duplicate; inserting row by row", rows=len(rows))
+
+    identity = select(table.c.chat_id, table.c.room_message_id, table.c.sender_id,
+                      table.c.sender_name, table.c.message)
+    written = 0
+    for values in rows:
+        with db.engine.begin() as conn:
+            existing = conn.execute(identity.where(table.c.id == values['id'])).first()
+            if existing is None:
+                conn.execute(table.insert(), [values])
+                written += 1
+            elif not _same_row(existing, values):
+                log.error("Message id is held by another row; leaving the message pending",
+                          id=values['id'], chat_id=values['chat_id'])
+                raise IdCollision(f"ChatHistory id {values['id']} is held by another message")
+    return written
+
+
+def _checkpoint():
+    """
+    Cut the journal down to the rows still pending (call with _cond held).
+    Those are written to a new file, locked and fsynced before os.replace()
+    swaps it in, so a crash at any point leaves either the old journal or
+    the new one - never a half-written one. Rows already in the database
+    that survive in an old journal are skipped when it is replayed.
+    """
+    global _journal
+    journal = _journal_file()
+    if not _pending:
+        journal.truncate(0)  # Everything in it is in the database
+        return
+    replacement = _open_locked(_journal_path + '.tmp')
+    replacement.truncate(0)  # Left over from a crash mid-checkpoint
+    replacement.writelines(_encode(values) + "\n" for _, values in _pending)
+    replacement.flush()
+    os.fsync(replacement.fileno())
+    os.replace(_journal_path + '.tmp', _journal_path)
+    journal.close()
+    _journal = replacement
+
+
+def flush():
+    """Insert every pending row now, in one transaction. Returns the number of rows written."""
+    with _flush_lock:
+        with _cond:
+            batch = [values for _, values in _pending]
+        if not batch:
+            return 0
+
+        with tracing.span('db_commit', rows=len(batch)):
+            written = _insert(batch)
+
+        with _cond:
+            del _pending[:len(batch)]
+            for values in batch:
+                chat_id = values['chat_id']
+                _pending_rooms[chat_id] -= 1
+                if not _pending_rooms[chat_id]:
+                    del _pending_rooms[chat_id]
+            _checkpoint()
+            _stats['flushed'] += written
+            _stats['flushes'] += 1
+
+    for values in batch:
+        metrics.inc('messages_persisted_total', sender='ai' if values['sender_id'] == -1 else 'human')
+    return written
+
+
+def settle(chat_id=None):
+    """Flush first if 'chat_id' (or any room, if None) has rows that aren't in the database yet."""
+    if not ENABLED:
+        return
+    with _cond:
+        waiting = _pending_rooms.get(int(chat_id)) if chat_id is not None else _pending
+    if waiting:
+        flush()
+
+
+def flush_loop(app):
+    """
+    Background flusher: group-commit pending rows every MAX_DELAY or BATCH
+    rows, and reserve the spare blocks senders are about to need.
+    """
+    log.info("💾 Write-behind flusher started", max_delay_ms=MAX_DELAY * 1000, batch=BATCH)
+    while True:
+        with _cond:
+            while not _short:
+                if not _pending:
+                    _cond.wait()
+                    continue
+                remaining = _pending[0][0] + MAX_DELAY - time.monotonic()
+                if remaining <= 0 or len(_pending) >= BATCH:
+                    break
+                _cond.wait(remaining)
+        try:
+            with app.app_context():
+                _refill_spares()
+                with _cond:
+                    due = _pending and (len(_pending) >= BATCH or _pending[0][0] + MAX_DELAY <= time.monotonic())
+                if due:
+                    flush()
+        except Exception as e:
+            # Database unavailable: the rows stay pending (and journalled)
+            _stats['errors'] += 1
+            log.error("Write-behind flush failed; retrying", error=str(e), pending=len(_pending))
+            time.sleep(max(MAX_DELAY, 1.0))
+
+
+def recover():
+    """
+    Insert the rows left in the journals of processes that died before
+    flushing them, then delete those journals. Call at start-up.
+    """
+    if not os.path.isdir(JOURNAL_DIR):
+        return 0
+    recovered = 0
+    for name in sorted(os.listdir(JOURNAL_DIR)):
+        path = os.path.join(JOURNAL_DIR, name)
+        if not name.endswith('.jsonl') or path == _journal_path:
+            continue
+        with open(path, 'r+', encoding='utf-8') as f:
+            if fcntl:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    continue  # Its process is still running
+            rows = []
+            for line in f:
+                try:
+                    rows.append(_decode(line))
+                except (ValueError, KeyError):
+                    pass  # A torn last line from the crash
+            if rows:
+                recovered += _insert(rows)
+            os.remove(path)
+            if os.path.exists(path + '.tmp'):
+                os.remove(path + '.tmp')  # A checkpoint it didn't finish; the journal had every row
+    if recovered:
+        _stats['recovered'] += recovered
+        log.warning("Recovered unflushed messages from write-behind journals", rows=recovered)
+    return recovered
+
+
+def shutdown(app):
+    """Flush what is left on a clean exit."""
+    with app.app_context():
+        flush()
+
+
+def stats():
+    with _cond:
+        return dict(_stats, enabled=ENABLED, pending=len(_pending))